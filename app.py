@@ -1,15 +1,23 @@
 import streamlit as st
-import google.generativeai as genai
-import os
-import tempfile
-import PyPDF2
-import docx
-import chromadb
-import hashlib
-from typing import List, Dict
+import json
+import uuid
 import warnings
+from typing import Optional
+import ingestion
+import corpus_store
+import metrics
+import llm_client
+import coalescing
+import jobs
+from study_assistant import (
+    StudyAssistant, ExtractionCache, ResponseCache, MODEL_NAME,
+    EXTRACTION_CACHE_DIR, RESPONSE_CACHE_DIR, CORPUS_DB_PATH, QUESTION_DIFFICULTIES
+)
 warnings.filterwarnings('ignore')
 
+# How long a newly started job may finish inline before its progress is shown instead
+JOB_INLINE_WAIT_SECONDS = 0.5
+
 # Custom CSS for better UI
 CUSTOM_CSS = """
 <style>
@@ -92,280 +100,134 @@ CUSTOM_CSS = """
 </style>
 """
 
-class StudyAssistant:
-    def __init__(self, api_key: str):
-        """Initialize the Study Assistant with Gemini API"""
-        try:
-            genai.configure(api_key=api_key)
-            self.api_key = api_key
-            self.model = genai.GenerativeModel('gemini-2.5-flash')
-            self.documents = []
-            self.document_texts = []
-            st.session_state.api_key_valid = True
-        except Exception as e:
-            st.error(f"Failed to initialize Gemini API: {str(e)}")
-            st.session_state.api_key_valid = False
-    
-    def extract_text_from_pdf(self, file_path: str) -> str:
-        """Extract text from PDF file"""
-        text = ""
-        try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page in pdf_reader.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += page_text + "\n"
-        except Exception as e:
-            st.error(f"Failed to extract text from PDF: {str(e)}")
-            return ""
-        return text
-    
-    def extract_text_from_docx(self, file_path: str) -> str:
-        """Extract text from DOCX file"""
-        try:
-            doc = docx.Document(file_path)
-            return "\n".join([paragraph.text for paragraph in doc.paragraphs])
-        except Exception as e:
-            st.error(f"Failed to extract text from DOCX: {str(e)}")
-            return ""
-    
-    def extract_text_from_txt(self, file_path: str) -> str:
-        """Extract text from TXT file"""
-        try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                return file.read()
-        except Exception as e:
-            st.error(f"Failed to read TXT file: {str(e)}")
-            return ""
-    
-    def process_uploaded_file(self, uploaded_file) -> str:
-        """Process uploaded file and extract text"""
-        file_extension = uploaded_file.name.split('.')[-1].lower()
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{file_extension}') as tmp_file:
-            tmp_file.write(uploaded_file.getvalue())
-            tmp_path = tmp_file.name
-        
-        try:
-            if file_extension == 'pdf':
-                return self.extract_text_from_pdf(tmp_path)
-            elif file_extension == 'docx':
-                return self.extract_text_from_docx(tmp_path)
-            elif file_extension in ['txt', 'md']:
-                return self.extract_text_from_txt(tmp_path)
-            else:
-                st.error(f"Unsupported file type: {file_extension}")
-                return ""
-        finally:
-            try:
-                os.unlink(tmp_path)
-            except:
-                pass
-    
-    def split_text_into_chunks(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
-        """Split text into overlapping chunks"""
-        chunks = []
-        start = 0
-        text_length = len(text)
-        
-        while start < text_length:
-            end = min(start + chunk_size, text_length)
-            
-            # Try to end at a sentence boundary
-            if end < text_length:
-                # Look for sentence endings
-                for punct in ['. ', '! ', '? ', '\n\n', '\n']:
-                    punct_pos = text.rfind(punct, start, end)
-                    if punct_pos != -1 and punct_pos > start + chunk_size // 2:
-                        end = punct_pos + len(punct)
-                        break
-            
-            chunk = text[start:end]
-            if chunk.strip():
-                chunks.append(chunk)
-            
-            start = end - overlap  # Overlap chunks
-        
-        return chunks
-    
-    def summarize_document(self, text: str) -> str:
-        """Summarize the document"""
-        if not text or len(text.strip()) < 50:
-            return "Document content is too short to summarize."
-            
-        try:
-            prompt = f"""You are an expert study assistant. Please provide a comprehensive yet concise summary of the following study material. 
-            Focus on key concepts, important formulas, definitions, and main topics. Structure the summary with clear headings.
+@st.cache_resource
+def get_extraction_cache() -> ExtractionCache:
+    """Process-wide extraction cache shared by every session"""
+    return ExtractionCache(cache_dir=EXTRACTION_CACHE_DIR or None)
 
-            Document content:
-            {text[:5000]}  # Limiting context for efficiency
+@st.cache_resource
+def get_response_cache() -> ResponseCache:
+    """Process-wide model response cache shared by every session"""
+    return ResponseCache(cache_dir=RESPONSE_CACHE_DIR or None)
 
-            Provide a structured summary with these sections:
-            ## 📌 Main Topics Covered
-            ## 🎯 Key Concepts
-            ## 📐 Important Formulas/Theorems (if any)
-            ## 💡 Study Recommendations
-            ## 🚀 Quick Revision Points
-            """
-            
-            response = self.model.generate_content(prompt)
-            return response.text
-        except Exception as e:
-            return f"Error generating summary: {str(e)}"
-    
-    def generate_questions(self, text: str, num_questions: int = 5, question_type: str = "Mixed") -> List[Dict]:
-        """Generate exam questions from document"""
-        if not text or len(text.strip()) < 100:
-            return [{"error": "Document content is too short to generate questions."}]
-            
-        try:
-            type_instruction = ""
-            if question_type == "Multiple Choice":
-                type_instruction = "Focus on multiple choice questions with 4 options."
-            elif question_type == "Short Answer":
-                type_instruction = "Focus on short answer questions (2-3 sentences)."
-            elif question_type == "Problem Solving":
-                type_instruction = "Focus on problem-solving questions with step-by-step solutions."
-            
-            prompt = f"""Generate {num_questions} {question_type.lower()} exam-style questions based on the following study material. 
-            {type_instruction}
-            
-            Document content:
-            {text[:4000]}
-            
-            Format each question as:
-            ### Question [number]: [question text]
-            **Type:** [multiple choice/short answer/problem solving]
-            **Difficulty:** [Easy/Medium/Hard]
-            **Topic:** [Main topic]
-            
-            For multiple choice questions, include:
-            A. [Option A]
-            B. [Option B]
-            C. [Option C]
-            D. [Option D]
-            
-            Provide answer explanation at the end of each question.
-            """
-            
-            response = self.model.generate_content(prompt)
-            
-            # Parse response into structured format
-            questions = []
-            sections = response.text.split('### Question')
-            
-            for section in sections[1:num_questions+1]:  # Skip first empty section
-                lines = section.strip().split('\n')
-                if not lines:
-                    continue
-                    
-                question_data = {
-                    'question': lines[0].strip(),
-                    'type': '',
-                    'difficulty': '',
-                    'topic': '',
-                    'options': [],
-                    'answer': ''
-                }
-                
-                for line in lines[1:]:
-                    line = line.strip()
-                    if line.startswith('**Type:**'):
-                        question_data['type'] = line.replace('**Type:**', '').strip()
-                    elif line.startswith('**Difficulty:**'):
-                        question_data['difficulty'] = line.replace('**Difficulty:**', '').strip()
-                    elif line.startswith('**Topic:**'):
-                        question_data['topic'] = line.replace('**Topic:**', '').strip()
-                    elif line.startswith(('A.', 'B.', 'C.', 'D.')):
-                        question_data['options'].append(line.strip())
-                    elif line.lower().startswith('answer'):
-                        question_data['answer'] = line.strip()
-                
-                questions.append(question_data)
-            
-            return questions[:num_questions]
-        except Exception as e:
-            return [{"error": f"Error generating questions: {str(e)}"}]
-    
-    def explain_topic(self, topic: str) -> str:
-        """Explain a topic in simple language"""
-        if not topic.strip():
-            return "Please enter a topic to explain."
-            
-        try:
-            # Search in uploaded documents first
-            context = ""
-            for doc_text in self.document_texts:
-                if topic.lower() in doc_text.lower():
-                    # Get relevant portion
-                    idx = doc_text.lower().find(topic.lower())
-                    context = doc_text[max(0, idx-500):min(len(doc_text), idx+500)]
-                    break
-            
-            prompt = f"""Explain the following topic in simple, easy-to-understand language as if teaching a beginner.
-            Use analogies, real-world examples, and simple diagrams in text form where helpful.
-            Break down complex concepts into step-by-step explanations.
-            
-            Topic to explain: {topic}
-            
-            Context from study materials (if available):
-            {context}
-            
-            Structure your explanation as:
-            ## 📖 What is {topic}? (Simple Definition)
-            ## 🔍 Key Points Explained Simply
-            ## 🌟 Real-world Example/Analogy
-            ## ⚠️ Common Misconceptions to Avoid
-            ## 💎 Quick Summary (3-5 bullet points)
-            """
-            
-            response = self.model.generate_content(prompt)
-            return response.text
-        except Exception as e:
-            return f"Error explaining topic: {str(e)}"
-    
-    def search_in_documents(self, query: str) -> str:
-        """Search for relevant information in uploaded documents"""
-        if not self.document_texts:
-            return "No documents uploaded yet."
-            
-        try:
-            # Simple keyword-based search (for demo)
-            relevant_texts = []
-            for doc_text in self.document_texts:
-                # Check if query keywords are in the document
-                query_words = query.lower().split()
-                found_count = sum(1 for word in query_words if word in doc_text.lower())
-                if found_count > 0:
-                    # Get context around the found words
-                    for word in query_words:
-                        if word in doc_text.lower():
-                            idx = doc_text.lower().find(word)
-                            context = doc_text[max(0, idx-200):min(len(doc_text), idx+200)]
-                            relevant_texts.append(f"...{context}...")
-            
-            if not relevant_texts:
-                return "No relevant information found in documents."
-            
-            # Combine and summarize
-            combined_context = "\n\n".join(relevant_texts[:3])  # Take top 3 matches
-            
-            prompt = f"""Based on the following context from study materials, answer the question.
-            If the context doesn't contain enough information, say so clearly.
-            
-            Question: {query}
-            
-            Context from study materials:
-            {combined_context}
-            
-            Provide a helpful and accurate answer:
-            """
-            
-            response = self.model.generate_content(prompt)
-            return response.text
-        except Exception as e:
-            return f"Error searching documents: {str(e)}"
+@st.cache_resource
+def get_rate_limiter(api_key: str) -> llm_client.RateLimiter:
+    """Quota limiter shared by every session using the same API key"""
+    return llm_client.RateLimiter()
+
+@st.cache_resource
+def get_micro_batcher(api_key: str) -> Optional[coalescing.MicroBatcher]:
+    """Micro-batcher shared by every session using the same API key, or None when batching is disabled"""
+    if not coalescing.BATCH_WINDOW_SECONDS:
+        return None
+    return coalescing.MicroBatcher()
+
+@st.cache_resource
+def get_corpus_store() -> Optional[corpus_store.CorpusStore]:
+    """Process-wide persistent corpus store, or None when persistence is disabled"""
+    if not CORPUS_DB_PATH:
+        return None
+    return corpus_store.CorpusStore(CORPUS_DB_PATH)
+
+@st.cache_resource
+def get_process_metrics() -> metrics.Metrics:
+    """Process-wide stage timings and counters aggregated over every session"""
+    return metrics.Metrics()
+
+@st.cache_resource
+def get_job_runner() -> jobs.JobRunner:
+    """Background job pool and registry shared by every session, kept outside the rerun cycle"""
+    return jobs.default_runner()
+
+def show_error(message: str):
+    """st.error during a script run; inside a background job the message is kept on the job instead"""
+    jobs.report_error(message, st.error)
+
+def session_job(slot: str) -> Optional[jobs.Job]:
+    """This session's latest job for one tab ('upload', 'summary', 'questions'), if still known"""
+    return get_job_runner().get(st.session_state.job_ids.get(slot))
+
+def start_job(slot: str, label: str, func) -> jobs.Job:
+    """Run func(job) in the background as this session's job for slot, cancelling the one it replaces"""
+    previous = session_job(slot)
+    if previous is not None and not previous.done:
+        previous.cancel()
+    job = get_job_runner().submit(slot, label, func, owner=st.session_state.session_id)
+    st.session_state.job_ids[slot] = job.id
+    # Quick jobs (e.g. cached results) finish before the page renders, without a progress flash
+    job.wait(JOB_INLINE_WAIT_SECONDS)
+    return job
+
+@st.fragment(run_every=1)
+def show_job_progress(job_id: str, show_output: bool = False):
+    """Live progress of a running job with a cancel button; reruns the page once the job ends"""
+    job = get_job_runner().get(job_id)
+    if job is None:
+        return
+    if job.done:
+        st.rerun()
+    st.progress(job.progress, text=job.message or f"{job.label}...")
+    if show_output and job.output:
+        st.markdown(job.output)
+    if st.button("⏹️ Cancel", key=f"cancel_{job.id}", disabled=job.cancel_requested):
+        job.cancel()
+
+def show_job_outcome(job: jobs.Job):
+    """Errors reported by a finished job, or why it did not complete"""
+    for warning in job.warnings:
+        st.error(warning)
+    if job.status == jobs.FAILED:
+        st.error(f"❌ {job.label} failed: {job.error}")
+    elif job.status == jobs.CANCELLED:
+        st.warning(f"⏹️ {job.label} was cancelled")
+
+def show_questions(questions):
+    """One expander per generated question, with its options and answer"""
+    for i, q in enumerate(questions, 1):
+        if 'error' in q:
+            st.error(q['error'])
+            continue
+            
+        with st.expander(f"📝 Question {i} | {q.get('type', 'N/A')} | {q.get('difficulty', 'N/A')} | Topic: {q.get('topic', 'N/A')}"):
+            st.markdown(f"**{q.get('question', '')}**")
+            
+            if q.get('options'):
+                st.write("**Options:**")
+                for opt in q['options']:
+                    st.write(f"- {opt}")
+            
+            if q.get('answer'):
+                st.markdown("---")
+                st.success(f"**Answer:** {q['answer']}")
+
+@st.fragment(run_every=2)
+def show_pending_extraction():
+    """Progress of long PDFs still being extracted; pages extracted meanwhile become searchable"""
+    assistant = st.session_state.assistant
+    finished = assistant.refresh_pending_documents()
+    for name, extracted, page_count in assistant.pending_documents():
+        st.progress(extracted / page_count,
+                    text=f"📖 {name}: {extracted}/{page_count} pages extracted (already searchable)")
+    if finished:
+        st.rerun()
+
+def show_metrics(stats: metrics.Metrics, scope: str):
+    """Stage table, counters and JSON/Prometheus downloads for one metrics scope"""
+    rows = stats.stage_rows()
+    if rows:
+        st.dataframe(rows, hide_index=True, use_container_width=True)
+    else:
+        st.caption("No stages recorded yet.")
+    counters = stats.snapshot()['counters']
+    if counters:
+        st.caption(" • ".join(f"{name.replace('_', ' ')}: {value:,.4g}" for name, value in counters.items()))
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button("JSON", stats.to_json(), f"{scope}_metrics.json",
+                           "application/json", key=f"{scope}_metrics_json")
+    with col2:
+        st.download_button("Prometheus", stats.to_prometheus(scope), f"{scope}_metrics.prom",
+                           "text/plain", key=f"{scope}_metrics_prom")
 
 def main():
     # Apply custom CSS
@@ -392,6 +254,13 @@ def main():
         st.session_state.assistant = None
     if 'api_key_valid' not in st.session_state:
         st.session_state.api_key_valid = False
+    if 'stream_responses' not in st.session_state:
+        st.session_state.stream_responses = True
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    if 'job_ids' not in st.session_state:
+        # Tab -> id of this session's latest background job there
+        st.session_state.job_ids = {}
     
     # Sidebar
     with st.sidebar:
@@ -406,11 +275,17 @@ def main():
             if st.button("Validate API Key", use_container_width=True):
                 with st.spinner("Validating API key..."):
                     try:
-                        # Test the API key
-                        genai.configure(api_key=api_key)
-                        model = genai.GenerativeModel('gemini-2.5-flash')
-                        test_response = model.generate_content("Test")
-                        st.session_state.assistant = StudyAssistant(api_key)
+                        # Test the API key (the offline fake backend accepts any key)
+                        if llm_client.LLM_BACKEND != "fake":
+                            import google.generativeai as genai
+                            genai.configure(api_key=api_key)
+                            model = genai.GenerativeModel(MODEL_NAME)
+                            test_response = model.generate_content("Test")
+                        st.session_state.assistant = StudyAssistant(
+                            api_key, get_extraction_cache(), get_corpus_store(), get_response_cache(),
+                            rate_limiter=get_rate_limiter(api_key), on_error=show_error,
+                            process_metrics=get_process_metrics(), micro_batcher=get_micro_batcher(api_key)
+                        )
                         st.success("✅ API Key validated successfully!")
                         st.session_state.api_key_valid = True
                     except Exception as e:
@@ -420,6 +295,17 @@ def main():
             if st.session_state.assistant is None:
                 st.info("👆 Click 'Validate API Key' to start")
         
+        st.toggle("⚡ Stream responses", key="stream_responses",
+                  help="Show summaries, explanations and chat answers as they are generated")
+        
+        session_jobs = get_job_runner().jobs(owner=st.session_state.session_id)
+        if session_jobs:
+            running = sum(not job.done for job in session_jobs)
+            with st.expander(f"🧵 Background jobs ({running} running)"):
+                for job in session_jobs[:10]:
+                    progress = "" if job.done else f" ({job.progress:.0%})"
+                    st.caption(f"{job.label}: {job.status}{progress}")
+        
         st.markdown('</div>', unsafe_allow_html=True)
         
         # Statistics
@@ -427,7 +313,28 @@ def main():
             st.markdown('<div class="sidebar-content">', unsafe_allow_html=True)
             st.header("📊 Statistics")
             st.metric("Documents Loaded", len(st.session_state.assistant.documents))
-            st.metric("Total Text", f"{sum(len(d) for d in st.session_state.assistant.document_texts):,} chars")
+            st.metric("Total Text", f"{sum(ref.chars for ref in st.session_state.assistant.document_refs):,} chars")
+            shared = st.session_state.assistant.corpus_memory.stats()
+            st.caption(
+                f"🧠 Shared corpus: {shared['documents']} distinct documents, {shared['references']} session references "
+                f"({(shared['heap_chars'] + shared['hot_chars']) / 1e6:.1f}M chars in RAM, "
+                f"{shared['mapped_chars'] / 1e6:.1f}M memory-mapped)"
+            )
+            response_cache = st.session_state.assistant.response_cache
+            st.caption(f"⚡ Response cache: {response_cache.hits} hits / {response_cache.misses} misses")
+            timings = [t for t in st.session_state.assistant.generation_timings if not t['cached']]
+            if timings:
+                last = timings[-1]
+                st.caption(
+                    f"⏱️ Last answer: first token {last['ttft']:.2f}s • total {last['total']:.2f}s "
+                    f"(avg first token {sum(t['ttft'] for t in timings) / len(timings):.2f}s)"
+                )
+            with st.expander("⏱️ Pipeline timings"):
+                session_tab, process_tab = st.tabs(["This session", "All sessions"])
+                with session_tab:
+                    show_metrics(st.session_state.assistant.metrics, "session")
+                with process_tab:
+                    show_metrics(get_process_metrics(), "process")
             st.markdown('</div>', unsafe_allow_html=True)
         
         # Tech Stack Info
@@ -474,6 +381,22 @@ def main():
             st.header("📁 Upload Your Study Materials")
             st.markdown("Supported formats: PDF, DOCX, TXT, MD")
             
+            store = st.session_state.assistant.corpus_store
+            saved_documents = store.list_documents(st.session_state.assistant.owner) if store is not None else []
+            if saved_documents:
+                with st.expander(f"📚 Saved documents ({len(saved_documents)})"):
+                    labels = {doc['doc_hash']: f"{doc['name']} ({doc['chars']:,} chars)" for doc in saved_documents}
+                    selected_hashes = st.multiselect(
+                        "Load previously processed documents without re-uploading:",
+                        list(labels),
+                        format_func=labels.get
+                    )
+                    if selected_hashes and st.button("📂 Load Saved Documents", use_container_width=True):
+                        with st.spinner("Loading saved documents..."):
+                            added = st.session_state.assistant.load_saved_documents(selected_hashes)
+                        st.session_state.documents_loaded = bool(st.session_state.assistant.documents)
+                        st.success(f"✅ Loaded {len(added)} saved documents!")
+            
             uploaded_files = st.file_uploader(
                 "Drag and drop or click to browse",
                 type=['pdf', 'docx', 'txt', 'md'],
@@ -482,29 +405,96 @@ def main():
             )
             
             if uploaded_files:
-                progress_bar = st.progress(0)
-                all_texts = []
-                processed_files = []
+                # Long PDFs are loaded from their first pages and extracted in the background
+                long_pdfs = [f for f in uploaded_files if st.session_state.assistant.should_extract_progressively(f)]
+                for uploaded_file in long_pdfs:
+                    st.info(f"📖 {uploaded_file.name} is a long PDF: it becomes searchable from its first pages "
+                            "while the rest is extracted in the background")
+                uploaded_files = [f for f in uploaded_files if f not in long_pdfs]
                 
-                for i, uploaded_file in enumerate(uploaded_files):
-                    with st.spinner(f"Processing {uploaded_file.name}..."):
-                        text = st.session_state.assistant.process_uploaded_file(uploaded_file)
-                        if text and len(text.strip()) > 100:
-                            all_texts.append(text)
-                            processed_files.append(uploaded_file.name)
-                            st.success(f"✅ {uploaded_file.name} ({len(text):,} chars)")
-                        else:
-                            st.warning(f"⚠️ {uploaded_file.name} - Content too short or extraction failed")
+                # Extraction and indexing run as a background job, so other tabs stay usable meanwhile
+                upload_key = [f.file_id for f in uploaded_files]
+                job = session_job('upload')
+                if uploaded_files and (job is None or st.session_state.get('upload_key') != upload_key):
+                    assistant = st.session_state.assistant
+                    files = list(uploaded_files)
+                    
+                    def extract_and_index(job: jobs.Job):
+                        file_progress = [0.0] * len(files)
+                        
+                        def on_file_progress(file_index: int, file_fraction: float):
+                            file_progress[file_index] = file_fraction
+                            job.update(0.8 * sum(file_progress) / len(files),
+                                       f"Extracting {files[file_index].name}: {file_fraction:.0%}")
+                        
+                        texts = assistant.process_uploaded_files(
+                            files, max_workers=ingestion.default_worker_count(), progress_callback=on_file_progress
+                        )
+                        usable = [(f.name, text) for f, text in zip(files, texts) if text and len(text.strip()) > 100]
+                        job.update(0.8, "Indexing...")
+                        refs = assistant.prepare_documents(
+                            [name for name, _ in usable], [text for _, text in usable],
+                            lambda done, total: job.update(0.8 + 0.2 * done / total, f"Indexed {done}/{total} documents")
+                        )
+                        return {
+                            'files': [(f.name, len(text)) for f, text in zip(files, texts)],
+                            'names': [name for name, _ in usable],
+                            'refs': refs
+                        }
                     
-                    progress_bar.progress((i + 1) / len(uploaded_files))
+                    job = start_job('upload', f"Processing {len(files)} file(s)", extract_and_index)
+                    st.session_state.upload_key = upload_key
                 
-                if all_texts:
+                prepared = None
+                if job is not None and uploaded_files:
+                    if not job.done:
+                        show_job_progress(job.id)
+                    else:
+                        show_job_outcome(job)
+                        if job.status == jobs.DONE:
+                            prepared = job.result
+                            for name, chars in prepared['files']:
+                                if name in prepared['names']:
+                                    st.success(f"✅ {name} ({chars:,} chars)")
+                                else:
+                                    st.warning(f"⚠️ {name} - Content too short or extraction failed")
+                
+                if (prepared and prepared['names']) or long_pdfs:
                     if st.button("🚀 Process Documents", type="primary", use_container_width=True):
-                        st.session_state.assistant.document_texts = all_texts
-                        st.session_state.assistant.documents = processed_files
-                        st.session_state.documents_loaded = True
-                        st.success(f"✅ Successfully processed {len(processed_files)} documents!")
-                        st.balloons()
+                        # Only documents not loaded yet are indexed, reusing the job's chunks and embeddings
+                        names = prepared['names'] if prepared else []
+                        texts = [ref.text for ref in prepared['refs']] if prepared else []
+                        added = st.session_state.assistant.add_documents(names, texts)
+                        for uploaded_file in long_pdfs:
+                            if st.session_state.assistant.add_pdf_progressively(uploaded_file.name,
+                                                                                uploaded_file.getvalue()):
+                                added.append(uploaded_file.name)
+                        st.session_state.documents_loaded = bool(st.session_state.assistant.documents)
+                        if added:
+                            st.success(f"✅ Successfully processed {len(added)} documents!")
+                            st.balloons()
+                        else:
+                            st.info("All of these documents are already loaded.")
+            
+            if st.session_state.documents_loaded and st.session_state.assistant.documents:
+                st.markdown("**📚 Loaded documents**")
+                for doc_id, (name, ref) in enumerate(zip(st.session_state.assistant.documents,
+                                                         st.session_state.assistant.document_refs)):
+                    col1, col2 = st.columns([6, 1])
+                    with col1:
+                        st.caption(f"{name} ({ref.chars:,} chars)")
+                    with col2:
+                        in_use = st.session_state.assistant.document_in_use(doc_id)
+                        if st.button("🗑️", key=f"remove_{ref.doc_hash}", disabled=in_use,
+                                     help=f"{name} is in use by a running job" if in_use else f"Remove {name}"):
+                            st.session_state.assistant.remove_document(doc_id)
+                            st.session_state.documents_loaded = bool(st.session_state.assistant.documents)
+                            st.rerun()
+                if st.session_state.assistant.pending_documents():
+                    show_pending_extraction()
+                topics = st.session_state.assistant.suggest_topics(limit=15)
+                if topics:
+                    st.caption("🏷️ Topics covered: " + ", ".join(topics))
             
             st.markdown('</div>', unsafe_allow_html=True)
         
@@ -512,7 +502,7 @@ def main():
         with tab2:
             st.header("📝 Document Summarizer")
             
-            if st.session_state.documents_loaded and st.session_state.assistant.document_texts:
+            if st.session_state.documents_loaded and st.session_state.assistant.document_refs:
                 # Let user select which document to summarize
                 if len(st.session_state.assistant.documents) > 1:
                     selected_doc = st.selectbox(
@@ -520,16 +510,41 @@ def main():
                         st.session_state.assistant.documents
                     )
                     doc_index = st.session_state.assistant.documents.index(selected_doc)
-                    sample_text = st.session_state.assistant.document_texts[doc_index][:5000]
                 else:
-                    sample_text = st.session_state.assistant.document_texts[0][:5000]
+                    doc_index = 0
+                doc_name = st.session_state.assistant.documents[doc_index]
+                sample_text = st.session_state.assistant.document_refs[doc_index].text
+                
+                regenerate_summary = st.checkbox("🔄 Regenerate (ignore cached summary)", key="regenerate_summary")
                 
                 if st.button("Generate Comprehensive Summary", type="primary", use_container_width=True):
-                    with st.spinner("🔍 Analyzing document and generating summary..."):
-                        summary = st.session_state.assistant.summarize_document(sample_text)
-                        
+                    assistant = st.session_state.assistant
+                    
+                    def summarize(job: jobs.Job) -> str:
+                        job.update(0.0, "🔍 Analyzing document...")
+                        pieces = []
+                        with assistant.using_documents([doc_index]):
+                            for piece in assistant.summarize_document_stream(
+                                sample_text, regenerate_summary,
+                                lambda done, total: job.update(0.9 * done / max(total, 1),
+                                                               f"Summarized {done}/{total} sections")
+                            ):
+                                pieces.append(piece)
+                                job.update(message="✍️ Writing summary...", output="".join(pieces))
+                        return "".join(pieces)
+                    
+                    start_job('summary', f"Summary of {doc_name}", summarize)
+                
+                # The summary keeps running in the background if you switch tabs or change a widget
+                job = session_job('summary')
+                if job is not None and not job.done:
+                    show_job_progress(job.id, show_output=st.session_state.stream_responses)
+                elif job is not None:
+                    show_job_outcome(job)
+                    summary = job.result
+                    if summary:
                         st.markdown('<div class="success-box">', unsafe_allow_html=True)
-                        st.subheader("📋 Document Summary")
+                        st.subheader(f"📋 {job.label}")
                         st.markdown(summary)
                         st.markdown('</div>', unsafe_allow_html=True)
                         
@@ -552,41 +567,96 @@ def main():
         with tab3:
             st.header("❓ Generate Exam Questions")
             
-            if st.session_state.documents_loaded and st.session_state.assistant.document_texts:
-                col1, col2 = st.columns(2)
+            if st.session_state.documents_loaded and st.session_state.assistant.document_refs:
+                question_scope = st.radio(
+                    "Question source",
+                    ["Quick set (first document)", "Question bank (all documents)"],
+                    horizontal=True
+                )
+                whole_corpus = question_scope.startswith("Question bank")
+                
+                col1, col2, col3 = st.columns(3)
                 with col1:
-                    num_questions = st.slider("Number of questions", 3, 10, 5)
+                    if whole_corpus:
+                        num_questions = st.slider("Number of questions", 10, 200, 50, step=10)
+                    else:
+                        num_questions = st.slider("Number of questions", 3, 10, 5)
                 with col2:
                     question_type = st.selectbox(
                         "Question type",
                         ["Mixed", "Multiple Choice", "Short Answer", "Problem Solving"]
                     )
+                with col3:
+                    difficulty = st.selectbox("Difficulty", ("Any",) + QUESTION_DIFFICULTIES)
+                    difficulty = None if difficulty == "Any" else difficulty
+                
+                focus_topics = []
+                if whole_corpus:
+                    focus_topics = st.multiselect(
+                        "Focus on topics (optional)",
+                        st.session_state.assistant.suggest_topics(limit=100),
+                        placeholder="All topics"
+                    )
+                
+                # Questions generated before (in any session) are served from the persistent question bank
+                doc_ids = None if whole_corpus else [0]
+                bank_size = st.session_state.assistant.question_bank_size(doc_ids)
+                if bank_size:
+                    scope = "these documents" if whole_corpus else "this document"
+                    st.caption(f"🗃️ {bank_size} questions banked for {scope}: matching ones are served "
+                               "instantly and only the shortfall is generated")
+                elif st.session_state.assistant.corpus_store is None:
+                    st.caption("🗃️ Set STUDY_ASSISTANT_CORPUS_DB to keep generated questions in a bank across sessions")
+                
+                regenerate_questions = st.checkbox("🔄 Regenerate (ignore banked questions)", key="regenerate_questions")
                 
                 if st.button("Generate Practice Questions", type="primary", use_container_width=True):
-                    with st.spinner("🎯 Generating exam questions..."):
-                        sample_text = st.session_state.assistant.document_texts[0][:4000]
-                        questions = st.session_state.assistant.generate_questions(
-                            sample_text, 
-                            num_questions,
-                            question_type
-                        )
+                    if whole_corpus:
+                        assistant = st.session_state.assistant
                         
-                        for i, q in enumerate(questions, 1):
-                            if 'error' in q:
-                                st.error(q['error'])
-                                continue
-                                
-                            with st.expander(f"📝 Question {i} | {q.get('type', 'N/A')} | {q.get('difficulty', 'N/A')} | Topic: {q.get('topic', 'N/A')}"):
-                                st.markdown(f"**{q.get('question', '')}**")
-                                
-                                if q.get('options'):
-                                    st.write("**Options:**")
-                                    for opt in q['options']:
-                                        st.write(f"- {opt}")
-                                
-                                if q.get('answer'):
-                                    st.markdown("---")
-                                    st.success(f"**Answer:** {q['answer']}")
+                        def build_question_bank(job: jobs.Job) -> list:
+                            return assistant.generate_questions_from_corpus(
+                                num_questions,
+                                question_type,
+                                regenerate_questions,
+                                lambda done, total: job.update(done / total, f"Generated {done}/{total} batches"),
+                                topics=focus_topics,
+                                difficulty=difficulty
+                            )
+                        
+                        start_job('questions', f"{num_questions}-question bank", build_question_bank)
+                    else:
+                        with st.spinner("🎯 Generating exam questions..."):
+                            questions = st.session_state.assistant.generate_questions_from_corpus(
+                                num_questions,
+                                question_type,
+                                regenerate_questions,
+                                difficulty=difficulty,
+                                doc_ids=doc_ids
+                            )
+                        # Kept across reruns while the first document stays the same
+                        st.session_state.quick_questions = (st.session_state.assistant.document_refs[0].doc_hash, questions)
+                
+                quick_doc_hash, quick_questions = st.session_state.get('quick_questions', (None, []))
+                if not whole_corpus and quick_doc_hash == st.session_state.assistant.document_refs[0].doc_hash:
+                    show_questions(quick_questions)
+                
+                # Question banks are built in the background and shown here when ready
+                job = session_job('questions')
+                if whole_corpus and job is not None:
+                    if not job.done:
+                        show_job_progress(job.id)
+                    else:
+                        show_job_outcome(job)
+                        questions = job.result or []
+                        if questions and 'error' not in questions[0]:
+                            st.download_button(
+                                label="📥 Download Question Bank (JSON)",
+                                data=json.dumps(questions, indent=2),
+                                file_name="question_bank.json",
+                                mime="application/json"
+                            )
+                        show_questions(questions)
             else:
                 st.markdown('<div class="warning-box">', unsafe_allow_html=True)
                 st.info("📌 Please upload documents first to generate questions")
@@ -596,17 +666,32 @@ def main():
         with tab4:
             st.header("💡 Topic Explainer")
             
-            topic = st.text_input("Enter a topic you want explained (e.g., 'Machine Learning', 'Quantum Mechanics', 'Thermodynamics'):")
+            # Topics found in the documents autocomplete as you type; any other topic can be entered too
+            topic = st.selectbox(
+                "Enter a topic you want explained (e.g., 'Machine Learning', 'Quantum Mechanics', 'Thermodynamics'):",
+                st.session_state.assistant.suggest_topics(limit=200) if st.session_state.documents_loaded else [],
+                index=None,
+                accept_new_options=True,
+                placeholder="Type a topic..."
+            ) or ""
             
             if topic:
+                regenerate_explanation = st.checkbox("🔄 Regenerate (ignore cached explanation)", key="regenerate_explanation")
+                
                 if st.button("Explain This Topic", type="primary", use_container_width=True):
-                    with st.spinner(f"🧠 Explaining '{topic}' in simple terms..."):
-                        explanation = st.session_state.assistant.explain_topic(topic)
-                        
+                    if st.session_state.stream_responses:
                         st.markdown('<div class="success-box">', unsafe_allow_html=True)
                         st.subheader(f"📚 Explanation: {topic}")
-                        st.markdown(explanation)
+                        st.write_stream(st.session_state.assistant.explain_topic_stream(topic, regenerate_explanation))
                         st.markdown('</div>', unsafe_allow_html=True)
+                    else:
+                        with st.spinner(f"🧠 Explaining '{topic}' in simple terms..."):
+                            explanation = st.session_state.assistant.explain_topic(topic, regenerate_explanation)
+                            
+                            st.markdown('<div class="success-box">', unsafe_allow_html=True)
+                            st.subheader(f"📚 Explanation: {topic}")
+                            st.markdown(explanation)
+                            st.markdown('</div>', unsafe_allow_html=True)
         
         # Tab 5: Chat with Documents
         with tab5:
@@ -627,9 +712,13 @@ def main():
                     st.markdown(f'<div class="chat-message-user">👤 **You:** {prompt}</div>', unsafe_allow_html=True)
                     
                     # Get response
-                    with st.spinner("🤔 Searching documents..."):
-                        response = st.session_state.assistant.search_in_documents(prompt)
-                        st.markdown(f'<div class="chat-message-assistant">🤖 **Assistant:** {response}</div>', unsafe_allow_html=True)
+                    if st.session_state.stream_responses:
+                        st.markdown("🤖 **Assistant:**")
+                        response = st.write_stream(st.session_state.assistant.search_in_documents_stream(prompt))
+                    else:
+                        with st.spinner("🤔 Searching documents..."):
+                            response = st.session_state.assistant.search_in_documents(prompt)
+                            st.markdown(f'<div class="chat-message-assistant">🤖 **Assistant:** {response}</div>', unsafe_allow_html=True)
                     
                     # Add assistant message
                     st.session_state.messages.append({"role": "assistant", "content": response})
@@ -638,6 +727,7 @@ def main():
                 if st.session_state.messages:
                     if st.button("Clear Chat History", use_container_width=True):
                         st.session_state.messages = []
+                        st.session_state.assistant.chat_memory.clear()
                         st.rerun()
             else:
                 st.markdown('<div class="warning-box">', unsafe_allow_html=True)
@@ -697,4 +787,6 @@ def main():
         """)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
+    if metrics.METRICS_FILE:
+        get_process_metrics().write_prometheus(metrics.METRICS_FILE)
\ No newline at end of file
@@ -0,0 +1,191 @@
+"""Headless batch processing: turn a folder of notes into summaries and question banks.
+
+Usage:
+    python batch.py notes/ --out study_output/
+    python batch.py notes/ --out study_output/ --questions 100 --question-type "Multiple Choice" --workers 8
+    python batch.py notes/ --metrics run_metrics.json       # per-stage timings (.prom for Prometheus text)
+    STUDY_ASSISTANT_LLM_BACKEND=fake python batch.py notes/ --out /tmp/out   # offline dry run
+
+For every supported file (PDF, DOCX, TXT, MD) the run writes
+<name>.summary.md and <name>.questions.json to the output folder. Text is
+extracted on a process pool and documents are summarized and turned into
+questions concurrently; all model calls share one rate-limited client.
+Streamlit is never imported.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
+import ingestion
+import corpus_store
+import llm_client
+import metrics
+from study_assistant import (
+    StudyAssistant, ExtractionCache, ResponseCache, MODEL_NAME, LLM_WORKERS, QUESTION_TYPE_INSTRUCTIONS,
+    EXTRACTION_CACHE_DIR, RESPONSE_CACHE_DIR, CORPUS_DB_PATH
+)
+
+DEFAULT_DOCUMENT_WORKERS = 4
+
+
+class NoteFile:
+    """A file on disk that looks like a Streamlit upload (name + getvalue)"""
+    def __init__(self, path: str, name: Optional[str] = None):
+        self.path = path
+        self.name = name or os.path.basename(path)
+
+    def getvalue(self) -> bytes:
+        with open(self.path, 'rb') as file:
+            return file.read()
+
+
+def find_notes(directory: str, recursive: bool = False) -> List[str]:
+    """Supported note files in directory, sorted by path"""
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        if not recursive:
+            dirs.clear()
+        for name in files:
+            if name.split('.')[-1].lower() in ingestion.SUPPORTED_EXTENSIONS:
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+
+def output_stem(path: str, directory: str) -> str:
+    # Keep sub-folder names so notes with the same file name do not collide
+    relative = os.path.relpath(path, directory)
+    return relative.replace(os.sep, "__")
+
+
+def process_document(assistant: StudyAssistant, name: str, text: str, out_dir: str, stem: str,
+                     summaries: bool, question_count: int, question_type: str) -> Dict:
+    """Summarize one document and build its question bank, writing the results to out_dir"""
+    result = {'file': name, 'chars': len(text), 'errors': []}
+    started = time.perf_counter()
+    assistant.documents = [name]
+    assistant.document_texts = [text]
+
+    if summaries:
+        summary = assistant.summarize_document(text)
+        if summary.startswith("Error generating summary"):
+            result['errors'].append(summary)
+        else:
+            with open(os.path.join(out_dir, f"{stem}.summary.md"), 'w', encoding='utf-8') as f:
+                f.write(f"# Summary of {name}\n\n{summary}\n")
+
+    if question_count:
+        questions = assistant.generate_questions_from_corpus(question_count, question_type)
+        if questions and 'error' in questions[0]:
+            result['errors'].append(questions[0]['error'])
+        else:
+            with open(os.path.join(out_dir, f"{stem}.questions.json"), 'w', encoding='utf-8') as f:
+                json.dump({'source': name, 'question_type': question_type, 'questions': questions}, f, indent=2)
+            result['questions'] = len(questions)
+
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+
+def run_batch(directory: str, out_dir: str, question_count: int = 50, question_type: str = "Mixed",
+              summaries: bool = True, workers: int = DEFAULT_DOCUMENT_WORKERS, recursive: bool = False,
+              backend: Optional[str] = None, api_key: str = "", log=print,
+              run_metrics: Optional[metrics.Metrics] = None) -> List[Dict]:
+    """Process every note in directory and return one result dict per file.
+
+    Stage timings and counters of every document are aggregated into run_metrics when given.
+    """
+    paths = find_notes(directory, recursive)
+    if not paths:
+        log(f"No supported files ({', '.join(ingestion.SUPPORTED_EXTENSIONS)}) in {directory}")
+        return []
+    os.makedirs(out_dir, exist_ok=True)
+
+    client = llm_client.ModelClient(
+        llm_client.make_backend(backend or llm_client.LLM_BACKEND, MODEL_NAME, api_key),
+        llm_client.RateLimiter(),
+        max_workers=LLM_WORKERS
+    )
+    extraction_cache = ExtractionCache(cache_dir=EXTRACTION_CACHE_DIR or None)
+    response_cache = ResponseCache(cache_dir=RESPONSE_CACHE_DIR or None)
+    store = corpus_store.CorpusStore(CORPUS_DB_PATH) if CORPUS_DB_PATH else None
+
+    def make_assistant() -> StudyAssistant:
+        return StudyAssistant(api_key, extraction_cache, store, response_cache, client=client, on_error=log,
+                              process_metrics=run_metrics)
+
+    log(f"Extracting {len(paths)} file(s)...")
+    files = [NoteFile(path, os.path.relpath(path, directory)) for path in paths]
+    texts = make_assistant().process_uploaded_files(files)
+
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {}
+        for path, note, text in zip(paths, files, texts):
+            if not text.strip():
+                results.append({'file': note.name, 'chars': 0, 'errors': ["No text could be extracted"]})
+                log(f"[{len(results)}/{len(paths)}] {note.name}: skipped, no text could be extracted")
+                continue
+            future = pool.submit(
+                process_document, make_assistant(), note.name, text, out_dir,
+                output_stem(path, directory), summaries, question_count, question_type
+            )
+            futures[future] = note.name
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'file': futures[future], 'errors': [str(e)]}
+            results.append(result)
+            status = "failed: " + "; ".join(result['errors']) if result['errors'] else "done"
+            log(f"[{len(results)}/{len(paths)}] {result['file']}: {status}")
+
+    log(f"{client.calls} model call(s), {client.retries} retried, "
+        f"response cache {response_cache.hits} hits / {response_cache.misses} misses")
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", help="folder of PDF/DOCX/TXT/MD notes")
+    parser.add_argument("--out", default="study_output", help="folder for summaries and question banks")
+    parser.add_argument("--questions", type=int, default=50, help="questions per document (0 = none)")
+    parser.add_argument("--question-type", default="Mixed",
+                        choices=["Mixed", *QUESTION_TYPE_INSTRUCTIONS])
+    parser.add_argument("--no-summaries", action="store_true", help="only build question banks")
+    parser.add_argument("--workers", type=int, default=DEFAULT_DOCUMENT_WORKERS,
+                        help="documents processed at the same time")
+    parser.add_argument("--recursive", action="store_true", help="include sub-folders")
+    parser.add_argument("--backend", choices=["gemini", "fake"], help="model backend (default: from environment)")
+    parser.add_argument("--metrics", dest="metrics_path",
+                        help="write per-stage timings here (Prometheus text for .prom, otherwise JSON)")
+    parser.add_argument("--api-key", default=os.environ.get("GOOGLE_API_KEY", ""),
+                        help="Gemini API key (default: $GOOGLE_API_KEY)")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.directory):
+        print(f"Not a directory: {args.directory}", file=sys.stderr)
+        return 2
+    if (args.backend or llm_client.LLM_BACKEND) != "fake" and not args.api_key:
+        print("A Gemini API key is required (--api-key or GOOGLE_API_KEY)", file=sys.stderr)
+        return 2
+
+    run_metrics = metrics.Metrics()
+    results = run_batch(args.directory, args.out, args.questions, args.question_type,
+                        not args.no_summaries, args.workers, args.recursive, args.backend, args.api_key,
+                        run_metrics=run_metrics)
+    if args.metrics_path:
+        if args.metrics_path.endswith(".prom"):
+            run_metrics.write_prometheus(args.metrics_path, scope="batch")
+        else:
+            with open(args.metrics_path, 'w', encoding='utf-8') as f:
+                f.write(run_metrics.to_json())
+    failed = [result for result in results if result['errors']]
+    print(f"Processed {len(results) - len(failed)}/{len(results)} file(s) into {args.out}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
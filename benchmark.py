@@ -0,0 +1,285 @@
+"""Microbenchmarks for extraction, chunking, indexing and retrieval against an offline fake model.
+
+Usage:
+    python benchmark.py                          # 10 and 100 pages, compare with the saved baseline
+    python benchmark.py --pages 10,100,1000      # larger inputs
+    python benchmark.py --save-baseline          # record the current numbers as the baseline
+
+A run exits with status 1 when any stage is slower (p50) or uses more peak
+memory than its baseline by more than --threshold, or when an off-topic
+question retrieves context from the synthetic documents.
+"""
+import gc
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+import numpy as np
+import ingestion
+import chunking
+import llm_client
+import synthetic_docs
+import study_assistant
+
+DEFAULT_BASELINE_PATH = "benchmark_baseline.json"
+DEFAULT_THRESHOLD = 0.25
+# Differences smaller than this are treated as timer noise
+MIN_REGRESSION_MS = 1.0
+QUERY_TOPICS = synthetic_docs.TOPICS
+# Questions sharing no word with the synthetic documents; each must retrieve nothing
+OFF_TOPIC_QUERIES = [
+    "who won the world cup in 2018", "meaning of life", "how do I bake bread",
+    "What is the capital of France?", "recipe for banana bread", "best pizza in new york",
+    "how tall is mount everest", "who painted the mona lisa", "what is the weather tomorrow",
+    "how to train a puppy", "latest iphone price", "translate hello into spanish",
+    "how many players on a soccer team", "when did world war two end", "how to fix a flat tire",
+    "what do cats eat", "favorite movies of 2020", "how to grow tomatoes", "who is the president"
+]
+
+
+def percentile(samples: List[float], q: float) -> float:
+    return float(np.percentile(samples, q)) if samples else 0.0
+
+
+def measure(stage: str, func: Callable[[], object], repeat: int = 3, work_units: float = 1.0,
+            unit: str = "MB/s") -> Dict:
+    """Time func over repeat calls after one warm-up call, then once more under tracemalloc for peak memory.
+
+    work_units is the amount of work one call performs (e.g. megabytes of
+    input), so throughput is work_units per second.
+    """
+    # The warm-up call pays one-off costs such as lazy imports
+    func()
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    p50 = percentile(timings, 50)
+    return {
+        'stage': stage,
+        'runs': repeat,
+        'p50_ms': p50 * 1000,
+        'p95_ms': percentile(timings, 95) * 1000,
+        'p99_ms': percentile(timings, 99) * 1000,
+        'throughput': work_units / p50 if p50 else 0.0,
+        'unit': unit,
+        'peak_mb': peak / 1e6
+    }
+
+
+def measure_queries(stage: str, func: Callable[[str], object], queries: List[str]) -> Dict:
+    """Time func once per query (latency percentiles per call), plus one traced pass for peak memory"""
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        func(query)
+        timings.append(time.perf_counter() - started)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        for query in queries:
+            func(query)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    total = sum(timings)
+    return {
+        'stage': stage,
+        'runs': len(timings),
+        'p50_ms': percentile(timings, 50) * 1000,
+        'p95_ms': percentile(timings, 95) * 1000,
+        'p99_ms': percentile(timings, 99) * 1000,
+        'throughput': len(timings) / total if total else 0.0,
+        'unit': "queries/s",
+        'peak_mb': peak / 1e6
+    }
+
+
+def make_assistant():
+    """A StudyAssistant wired to the deterministic fake backend, with no persistent store"""
+    client = llm_client.ModelClient(llm_client.FakeBackend(), llm_client.RateLimiter(0, 0))
+    return study_assistant.StudyAssistant(
+        "benchmark",
+        extraction_cache=study_assistant.ExtractionCache(cache_dir=""),
+        response_cache=study_assistant.ResponseCache(cache_dir=""),
+        client=client
+    )
+
+
+def run_benchmarks(page_counts: List[int], formats: List[str], repeat: int = 3,
+                   query_count: int = 20, log: Callable[[str], None] = print) -> List[Dict]:
+    """Run every stage for every document size and return one result dict per stage"""
+    assistant = make_assistant()
+    queries = [f"explain {QUERY_TOPICS[i % len(QUERY_TOPICS)]} boundary condition {i}" for i in range(query_count)]
+    results = []
+
+    def record(result: Dict):
+        results.append(result)
+        log(format_result(result))
+
+    for pages in page_counts:
+        text = ""
+        for file_extension in formats:
+            data = synthetic_docs.make_document(file_extension, pages)
+            megabytes = len(data) / 1e6
+            record(measure(
+                f"extract/{file_extension}/{pages}p",
+                lambda: "".join(ingestion.iter_text(data, file_extension)),
+                repeat, megabytes
+            ))
+            if file_extension == 'pdf' and pages > ingestion.PDF_PAGES_PER_TASK:
+                record(measure(
+                    f"extract_parallel/pdf/{pages}p",
+                    lambda: ingestion.extract_files_parallel([(data, 'pdf')]),
+                    repeat, megabytes
+                ))
+            if not text:
+                text = "".join(ingestion.iter_text(data, file_extension))
+        if not text:
+            text = "\n\n".join(synthetic_docs.make_pages(pages))
+
+        text_megabytes = len(text) / 1e6
+        record(measure(f"chunk/{pages}p", lambda: assistant.split_text_into_chunks(text), repeat, text_megabytes))
+        page_segments = list(enumerate(synthetic_docs.make_pages(pages), start=1))
+        record(measure(
+            f"chunk_stream/{pages}p",
+            lambda: sum(1 for _ in chunking.chunk_stream(page_segments)),
+            repeat, text_megabytes
+        ))
+
+        assistant.documents = [f"synthetic-{pages}p.txt"]
+        assistant.document_texts = [text]
+        record(measure(f"index/{pages}p", assistant.index_documents, repeat, text_megabytes))
+
+        record(measure_queries(f"retrieve/{pages}p", lambda query: assistant.retriever.search(query, 3), queries))
+        record(measure_queries(f"explain_context/{pages}p", assistant._explain_prompt, queries))
+        # Retrieval and context packing only: going through search_in_documents would also
+        # time the chat memory, which grows (and gets summarized) from one query to the next
+        record(measure_queries(
+            f"search_context/{pages}p",
+            lambda query: assistant._pack_context(assistant._retrieve(query), study_assistant.CONTEXT_BUDGET_TOKENS),
+            queries
+        ))
+    return results
+
+
+def find_off_topic_matches(pages: int = 30, queries: List[str] = OFF_TOPIC_QUERIES) -> List[str]:
+    """Return the off-topic queries that retrieve any context from a synthetic document"""
+    assistant = make_assistant()
+    assistant.documents = [f"synthetic-{pages}p.txt"]
+    assistant.document_texts = ["\n\n".join(synthetic_docs.make_pages(pages))]
+    assistant.index_documents()
+    return [query for query in queries if assistant._retrieve(query)]
+
+
+def format_result(result: Dict) -> str:
+    return (
+        f"{result['stage']:<30} runs={result['runs']:<4} p50={result['p50_ms']:9.2f}ms "
+        f"p95={result['p95_ms']:9.2f}ms p99={result['p99_ms']:9.2f}ms "
+        f"{result['throughput']:10.2f} {result['unit']:<10} peak={result['peak_mb']:8.2f}MB"
+    )
+
+
+def load_baseline(path: str) -> Optional[Dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baseline(path: str, results: List[Dict]):
+    baseline = {
+        'created_at': time.time(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'stages': {result['stage']: result for result in results}
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def find_regressions(results: List[Dict], baseline: Dict, threshold: float) -> List[str]:
+    """Describe every stage whose p50 latency or peak memory grew by more than threshold"""
+    regressions = []
+    for result in results:
+        base = baseline.get('stages', {}).get(result['stage'])
+        if not base:
+            continue
+        if (result['p50_ms'] > base['p50_ms'] * (1 + threshold)
+                and result['p50_ms'] - base['p50_ms'] > MIN_REGRESSION_MS):
+            regressions.append(
+                f"{result['stage']}: p50 {base['p50_ms']:.2f}ms -> {result['p50_ms']:.2f}ms"
+            )
+        if base['peak_mb'] and result['peak_mb'] > base['peak_mb'] * (1 + threshold):
+            regressions.append(
+                f"{result['stage']}: peak memory {base['peak_mb']:.2f}MB -> {result['peak_mb']:.2f}MB"
+            )
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", default="10,100", help="comma-separated document sizes in pages")
+    parser.add_argument("--formats", default="pdf,docx,txt", help="comma-separated document types")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per bulk stage")
+    parser.add_argument("--queries", type=int, default=20, help="queries per retrieval stage")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed relative slowdown / memory growth before failing")
+    parser.add_argument("--json", dest="json_path", help="also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    page_counts = [int(pages) for pages in args.pages.split(",") if pages]
+    formats = [fmt.strip().lower() for fmt in args.formats.split(",") if fmt.strip()]
+    results = run_benchmarks(page_counts, formats, args.repeat, args.queries)
+    off_topic_matches = find_off_topic_matches()
+    if off_topic_matches:
+        print("Off-topic queries that retrieved context:")
+        for query in off_topic_matches:
+            print(f"  {query}")
+        return 1
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    baseline = load_baseline(args.baseline)
+    if baseline is None:
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one")
+        return 0
+    regressions = find_regressions(results, baseline, args.threshold)
+    if regressions:
+        print(f"Regressions beyond {args.threshold:.0%}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""Bounded multi-turn chat memory: recent turns verbatim plus a rolling summary of older ones"""
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+from llm_client import estimate_tokens
+from chunking import CHARS_PER_TOKEN
+
+logger = logging.getLogger(__name__)
+
+# Estimated tokens of conversation history added to each chat prompt
+HISTORY_BUDGET_TOKENS = 800
+# Turns always kept verbatim (budget permitting); older ones are summarized
+RECENT_TURNS = 3
+SUMMARY_MAX_TOKENS = 250
+# Turns kept verbatim while summaries keep failing; past this the oldest are dropped unsummarized
+MAX_TURNS = 50
+# Summaries are written off the request path by a small pool shared by every session
+SUMMARY_WORKERS = 2
+
+_summary_pool: Optional[ThreadPoolExecutor] = None
+_summary_pool_lock = threading.Lock()
+
+
+def _get_summary_pool() -> ThreadPoolExecutor:
+    global _summary_pool
+    with _summary_pool_lock:
+        if _summary_pool is None:
+            _summary_pool = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS, thread_name_prefix="chat-summary")
+        return _summary_pool
+
+
+def clip_tokens(text: str, max_tokens: int) -> str:
+    """Shorten text to about max_tokens, keeping the start"""
+    max_chars = max(max_tokens, 0) * CHARS_PER_TOKEN
+    return text if len(text) <= max_chars else text[:max_chars].rstrip() + " …"
+
+
+def format_turns(turns: List[Tuple[str, str]]) -> str:
+    return "\n".join(f"Student: {question}\nAssistant: {answer}" for question, answer in turns)
+
+
+class ChatMemory:
+    """Conversation history whose rendered size never exceeds a fixed token budget.
+
+    summarize(previous_summary, older_turns_text) returns the new rolling
+    summary; it runs in the background, so a turn never waits for it.
+    """
+    def __init__(self, summarize: Callable[[str, str], str], budget_tokens: int = HISTORY_BUDGET_TOKENS,
+                 recent_turns: int = RECENT_TURNS, summary_max_tokens: int = SUMMARY_MAX_TOKENS,
+                 executor: Optional[ThreadPoolExecutor] = None, max_turns: int = MAX_TURNS):
+        self.summarize = summarize
+        self.budget_tokens = budget_tokens
+        self.recent_turns = recent_turns
+        self.summary_max_tokens = summary_max_tokens
+        self.executor = executor
+        self.max_turns = max(max_turns, recent_turns)
+        self.summary = ""
+        self.turns: List[Tuple[str, str]] = []
+        self._pending = None
+        # Bumped by clear() so a summary finishing afterwards is dropped
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def add_turn(self, question: str, answer: str):
+        """Record a completed turn and compact older turns in the background when needed"""
+        with self._lock:
+            self.turns.append((question, answer))
+            self._maybe_compact()
+
+    def _turn_tokens(self, turns: List[Tuple[str, str]]) -> int:
+        return estimate_tokens(format_turns(turns)) if turns else 0
+
+    def _maybe_compact(self):
+        if self._pending is not None:
+            return
+        verbatim_budget = self.budget_tokens - self.summary_max_tokens
+        overflow = 0
+        while (overflow < len(self.turns) - 1
+               and (len(self.turns) - overflow > self.recent_turns
+                    or self._turn_tokens(self.turns[overflow:]) > verbatim_budget)):
+            overflow += 1
+        if not overflow:
+            return
+        older = self.turns[:overflow]
+        self._pending = (self._generation, overflow)
+        executor = self.executor or _get_summary_pool()
+        executor.submit(self._compact, self.summary, older, self._generation, overflow)
+
+    def _compact(self, previous_summary: str, older: List[Tuple[str, str]], generation: int, overflow: int):
+        try:
+            summary = self.summarize(previous_summary, format_turns(older))
+        except Exception as e:
+            # Keep the turns verbatim; rendering still respects the budget by dropping the oldest
+            logger.warning("Chat summary failed: %s", e)
+            summary = None
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._pending = None
+            if summary is not None:
+                self.summary = clip_tokens(summary.strip(), self.summary_max_tokens)
+                del self.turns[:overflow]
+                self._maybe_compact()
+            elif len(self.turns) > self.max_turns:
+                del self.turns[:len(self.turns) - self.max_turns]
+
+    def render(self) -> str:
+        """Summary plus the newest turns that fit the budget, oldest first"""
+        with self._lock:
+            summary, turns = self.summary, list(self.turns)
+        parts = []
+        remaining = self.budget_tokens
+        if summary:
+            parts.append(f"Summary of the earlier conversation: {summary}")
+            remaining -= estimate_tokens(parts[0])
+        kept = []
+        for question, answer in reversed(turns):
+            # Only the newest turn is ever clipped; older ones are kept whole or not at all
+            if not kept:
+                question = clip_tokens(question, remaining // 3)
+                answer = clip_tokens(answer, remaining - estimate_tokens(question) - 8)
+            cost = self._turn_tokens([(question, answer)])
+            if cost > remaining:
+                break
+            kept.append((question, answer))
+            remaining -= cost
+        if kept:
+            parts.append(format_turns(kept[::-1]))
+        return "\n".join(parts)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until no summary is being written, e.g. before reading self.summary"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if self._pending is None:
+                    return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.summary = ""
+            self.turns = []
+            self._pending = None
+
+    def __len__(self) -> int:
+        return len(self.turns)
@@ -0,0 +1,158 @@
+"""Single-pass, token-aware text chunking with character offsets and page numbers"""
+import re
+import bisect
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+from llm_client import estimate_tokens
+from ingestion import PAGE_BREAK
+
+CHARS_PER_TOKEN = 4
+# A unit ends after a paragraph break, a sentence end followed by whitespace, or a line break
+UNIT_BOUNDARY = re.compile(r"\n[ \t]*\n\s*|(?<=[.!?])\s+|\n")
+# A chunk that is at least this full is closed at the next paragraph break
+PARAGRAPH_CUT_FILL = 0.75
+
+# Segments are plain strings or (page number, text) pairs
+Segment = Union[str, Tuple[Optional[int], str]]
+
+
+class Chunk(NamedTuple):
+    """A chunk of a document and where it came from"""
+    text: str
+    doc_id: int
+    start: int
+    end: int
+    page: Optional[int]
+
+
+def _split_long_unit(unit: str, max_chars: int) -> List[str]:
+    # A "sentence" longer than a whole chunk is cut at whitespace near max_chars
+    pieces = []
+    start = 0
+    while len(unit) - start > max_chars:
+        cut = unit.rfind(" ", start + max_chars // 2, start + max_chars)
+        cut = cut + 1 if cut != -1 else start + max_chars
+        pieces.append(unit[start:cut])
+        start = cut
+    pieces.append(unit[start:])
+    return pieces
+
+
+def iter_units(segments: Iterable[Segment], max_chars: int) -> Iterator[Tuple[str, int, Optional[int], bool]]:
+    """Yield (text, start offset, page, ends a paragraph) for each sentence or line of a text stream.
+
+    Only the unfinished tail of the stream is buffered, and that tail is
+    capped at max_chars, so every character is scanned a bounded number of
+    times regardless of document size.
+    """
+    carry = ""
+    carry_start = 0
+    # Start offsets and pages of the segments that overlap the buffered tail
+    mark_starts: List[int] = []
+    mark_pages: List[Optional[int]] = []
+
+    def page_at(offset: int) -> Optional[int]:
+        return mark_pages[bisect.bisect_right(mark_starts, offset) - 1]
+
+    for segment in segments:
+        page, text = segment if isinstance(segment, tuple) else (None, segment)
+        if not text:
+            continue
+        base = carry_start
+        mark_starts.append(base + len(carry))
+        mark_pages.append(page)
+        buffer = carry + text
+        position = 0
+        # The tail holds no boundary except possibly trailing whitespace, so resume the scan there
+        for match in UNIT_BOUNDARY.finditer(buffer, max(len(carry.rstrip()) - 1, 0)):
+            end = match.end()
+            if end == len(buffer):
+                # The separator may continue in the next segment
+                break
+            paragraph = match.group().count("\n") > 1
+            pieces = _split_long_unit(buffer[position:end], max_chars)
+            for i, piece in enumerate(pieces):
+                yield piece, base + position, page_at(base + position), paragraph and i == len(pieces) - 1
+                position += len(piece)
+        carry = buffer[position:]
+        carry_start = base + position
+        if len(carry) > max_chars:
+            # No boundary for a long stretch: release all but the last window
+            pieces = _split_long_unit(carry, max_chars)
+            for piece in pieces[:-1]:
+                yield piece, carry_start, page_at(carry_start), False
+                carry_start += len(piece)
+            carry = pieces[-1]
+        keep = bisect.bisect_right(mark_starts, carry_start) - 1
+        del mark_starts[:keep], mark_pages[:keep]
+    if carry:
+        yield carry, carry_start, page_at(carry_start), True
+
+
+def chunk_stream(segments: Iterable[Segment], doc_id: int = 0, max_tokens: int = 250,
+                 overlap_tokens: int = 50, count_tokens: Callable[[str], int] = estimate_tokens
+                 ) -> Iterator[Chunk]:
+    """Chunk a stream of text segments in a single pass.
+
+    Chunks are built from whole sentences/lines, stay within max_tokens,
+    close early at a paragraph break once mostly full, and start with up to
+    overlap_tokens of the previous chunk's trailing sentences. Every chunk
+    contains at least one sentence the previous chunk did not, so chunking
+    always terminates.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    overlap_tokens = min(overlap_tokens, max_tokens // 2)
+    units: List[Tuple[str, int, Optional[int], int]] = []
+    tokens = 0
+    fresh = 0
+
+    def build() -> Chunk:
+        text = "".join(unit[0] for unit in units)
+        return Chunk(text, doc_id, units[0][1], units[0][1] + len(text), units[0][2])
+
+    def keep_overlap():
+        nonlocal units, tokens, fresh
+        kept, kept_tokens = [], 0
+        for unit in reversed(units):
+            if kept_tokens + unit[3] > overlap_tokens:
+                break
+            kept.append(unit)
+            kept_tokens += unit[3]
+        units, tokens, fresh = kept[::-1], kept_tokens, 0
+
+    for text, start, page, paragraph in iter_units(segments, max_chars):
+        unit_tokens = count_tokens(text)
+        if fresh and tokens + unit_tokens > max_tokens:
+            chunk = build()
+            if chunk.text.strip():
+                yield chunk
+            keep_overlap()
+            if tokens + unit_tokens > max_tokens:
+                units, tokens = [], 0
+        units.append((text, start, page, unit_tokens))
+        tokens += unit_tokens
+        fresh += 1
+        if paragraph and tokens >= max_tokens * PARAGRAPH_CUT_FILL:
+            chunk = build()
+            if chunk.text.strip():
+                yield chunk
+            keep_overlap()
+
+    if fresh:
+        chunk = build()
+        if chunk.text.strip():
+            yield chunk
+
+
+def page_segments(text: str) -> List[Segment]:
+    """Split a PDF's text at its page breaks into (page number, text) segments; other text is one segment"""
+    if PAGE_BREAK not in text:
+        return [text]
+    return [
+        (page_number, (PAGE_BREAK if page_number > 1 else "") + piece)
+        for page_number, piece in enumerate(text.split(PAGE_BREAK), 1)
+    ]
+
+
+def chunk_text(text: str, doc_id: int = 0, max_tokens: int = 250, overlap_tokens: int = 50) -> List[Chunk]:
+    """Chunk a document that is already in memory; PDF page numbers are recovered from its page breaks"""
+    return list(chunk_stream(page_segments(text), doc_id, max_tokens, overlap_tokens))
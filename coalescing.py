@@ -0,0 +1,233 @@
+"""Process-wide sharing of model calls: identical in-flight prompts and small-prompt micro-batches.
+
+When a class opens the app at once, many sessions send the same prompt at
+the same moment. SingleFlight lets them share one in-flight call (streamed
+replies are fanned out piece by piece). MicroBatcher optionally waits a few
+milliseconds to pack small, independent prompts into one model call.
+"""
+import os
+import threading
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import llm_client
+
+# Requests joining an open micro-batch within this many milliseconds share one call (0 disables batching)
+BATCH_WINDOW_SECONDS = float(os.environ.get("STUDY_ASSISTANT_BATCH_WINDOW_MS", "0") or 0) / 1000
+BATCH_MAX_PROMPTS = 8
+# Only prompts up to this size are batched; larger ones gain little and slow the whole batch
+BATCH_MAX_PROMPT_TOKENS = 3000
+
+
+class _Flight:
+    """One in-flight call whose reply pieces every waiting caller reads"""
+    __slots__ = ('pieces', 'done', 'error', 'condition')
+
+    def __init__(self):
+        self.pieces: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.condition = threading.Condition()
+
+    def add(self, piece: str):
+        with self.condition:
+            self.pieces.append(piece)
+            self.condition.notify_all()
+
+    def finish(self, error: Optional[BaseException] = None):
+        with self.condition:
+            self.done = True
+            self.error = error
+            self.condition.notify_all()
+
+    def follow(self) -> Iterator[str]:
+        """Pieces produced so far, then new ones as they arrive; re-raises the call's error"""
+        index = 0
+        while True:
+            with self.condition:
+                while index >= len(self.pieces) and not self.done:
+                    self.condition.wait()
+                pieces = self.pieces[index:]
+                done, error = self.done, self.error
+            index += len(pieces)
+            yield from pieces
+            if done:
+                if error is not None:
+                    raise error
+                return
+
+    def result(self) -> str:
+        return "".join(self.follow())
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share the first caller's call and reply"""
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.shared = 0
+
+    def _join(self, key: str) -> Tuple[_Flight, bool]:
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.shared += 1
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            self.calls += 1
+            return flight, True
+
+    def _finish(self, key: str, flight: _Flight, error: Optional[BaseException] = None):
+        # Later callers start a new call (or, usually, find the reply in the response cache)
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.finish(error)
+
+    def do(self, key: str, call: Callable[[], str]) -> Tuple[str, bool]:
+        """call()'s result, or that of an identical call already in flight; True when it was shared"""
+        flight, leader = self._join(key)
+        if not leader:
+            return flight.result(), True
+        try:
+            text = call()
+        except BaseException as e:
+            self._finish(key, flight, e)
+            raise
+        flight.add(text)
+        self._finish(key, flight)
+        return text, False
+
+    def stream(self, key: str, start: Callable[[], Iterator[str]]) -> Tuple[Iterator[str], bool]:
+        """Pieces of start()'s reply, or of an identical call already in flight; True when it was shared.
+
+        The call runs on its own thread, so it completes (and can be cached)
+        even if the caller that started it stops reading.
+        """
+        flight, leader = self._join(key)
+        if leader:
+            threading.Thread(target=self._produce, args=(key, flight, start),
+                             name="singleflight-stream", daemon=True).start()
+        return flight.follow(), not leader
+
+    def _produce(self, key: str, flight: _Flight, start: Callable[[], Iterator[str]]):
+        try:
+            for piece in start():
+                flight.add(piece)
+        except BaseException as e:
+            self._finish(key, flight, e)
+        else:
+            self._finish(key, flight)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'calls': self.calls, 'shared': self.shared, 'in_flight': len(self._flights)}
+
+
+class _Request:
+    __slots__ = ('prompt', 'reply', 'error', 'ready')
+
+    def __init__(self, prompt: str):
+        self.prompt = prompt
+        self.reply: Optional[str] = None
+        self.error: Optional[BaseException] = None
+        self.ready = threading.Event()
+
+
+class _Batch:
+    __slots__ = ('requests', 'full')
+
+    def __init__(self):
+        self.requests: List[_Request] = []
+        self.full = threading.Event()
+
+
+class MicroBatcher:
+    """Packs small generation requests arriving within a short window into one model call.
+
+    The first request of a batch waits up to window_seconds (less if the
+    batch fills up) and then sends the whole batch through its own client, so
+    share one batcher only between sessions using the same API key. Replies
+    that cannot be split back apart are re-requested one by one.
+    """
+    def __init__(self, window_seconds: float = BATCH_WINDOW_SECONDS, max_prompts: int = BATCH_MAX_PROMPTS,
+                 max_prompt_tokens: int = BATCH_MAX_PROMPT_TOKENS):
+        self.window_seconds = window_seconds
+        self.max_prompts = max_prompts
+        self.max_prompt_tokens = max_prompt_tokens
+        self._open: Optional[_Batch] = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.batched_prompts = 0
+        self.fallbacks = 0
+
+    def accepts(self, prompt: str, generation_config: Optional[Dict] = None) -> bool:
+        """Only plain-text requests with small prompts are batched"""
+        return not generation_config and llm_client.estimate_tokens(prompt) <= self.max_prompt_tokens
+
+    def generate(self, prompt: str, client: llm_client.ModelClient,
+                 on_event: Optional[Callable[[str, float], None]] = None) -> str:
+        request = _Request(prompt)
+        with self._lock:
+            batch = self._open
+            first = batch is None
+            if first:
+                batch = self._open = _Batch()
+            batch.requests.append(request)
+            if len(batch.requests) >= self.max_prompts:
+                self._open = None
+                batch.full.set()
+        if first:
+            batch.full.wait(self.window_seconds)
+            with self._lock:
+                if self._open is batch:
+                    self._open = None
+            self._send(batch.requests, client, on_event)
+        request.ready.wait()
+        if request.error is not None:
+            raise request.error
+        if request.reply is None:
+            return client.generate(prompt, on_event=on_event)
+        return request.reply
+
+    def _send(self, requests: List[_Request], client: llm_client.ModelClient,
+              on_event: Optional[Callable[[str, float], None]]):
+        try:
+            if len(requests) == 1:
+                replies = [client.generate(requests[0].prompt, on_event=on_event)]
+            else:
+                try:
+                    replies = client.generate_batch([request.prompt for request in requests], on_event)
+                except ValueError:
+                    # Malformed packed reply: every waiting caller sends its own prompt instead
+                    replies = [None] * len(requests)
+                    with self._lock:
+                        self.fallbacks += 1
+                with self._lock:
+                    self.batches += 1
+                    self.batched_prompts += len(requests)
+        except Exception as e:
+            for request in requests:
+                request.error = e
+        else:
+            for request, reply in zip(requests, replies):
+                request.reply = reply
+        finally:
+            for request in requests:
+                request.ready.set()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'batches': self.batches, 'batched_prompts': self.batched_prompts, 'fallbacks': self.fallbacks}
+
+
+_default_single_flight: Optional[SingleFlight] = None
+_default_lock = threading.Lock()
+
+
+def default_single_flight() -> SingleFlight:
+    """The process-wide SingleFlight every StudyAssistant shares unless given another"""
+    global _default_single_flight
+    with _default_lock:
+        if _default_single_flight is None:
+            _default_single_flight = SingleFlight()
+        return _default_single_flight
@@ -0,0 +1,97 @@
+"""Fill a prompt's context budget with the best-ranked, non-overlapping document passages"""
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+from llm_client import estimate_tokens
+from ingestion import PAGE_BREAK
+
+# Passages of one document this close together are merged into one span
+MERGE_GAP_CHARS = 80
+
+
+class Candidate(NamedTuple):
+    """A retrieved chunk; start/end are -1 when its offsets in the document are unknown"""
+    score: float
+    doc_id: int
+    start: int
+    end: int
+    page: Optional[int]
+    text: str
+
+
+class Passage(NamedTuple):
+    doc_id: int
+    start: int
+    end: int
+    page: Optional[int]
+    text: str
+    # Best rank (0 = most relevant) among the chunks merged into this passage
+    rank: int
+
+
+def pack_passages(candidates: Sequence[Candidate], budget_tokens: int,
+                  document_slice: Callable[[int, int, int], str],
+                  count_tokens: Callable[[str], int] = estimate_tokens) -> List[Passage]:
+    """Greedily add candidates, best first, while the packed context fits in budget_tokens.
+
+    document_slice(doc_id, start, end) returns that span of a document's text.
+
+    Overlapping or nearly adjacent chunks of the same document are merged into
+    one span, so shared overlap text is paid for once. Passages come back in
+    rank order; weak matches are cut before this, at retrieval.
+    """
+    if not candidates:
+        return []
+    # doc_id -> [start, end, page, rank, tokens] of every span chosen so far
+    spans: Dict[int, List[list]] = {}
+    loose: List[Passage] = []
+    used = 0
+    for rank, candidate in enumerate(candidates):
+        if used >= budget_tokens:
+            break
+        if candidate.start < 0:
+            cost = count_tokens(candidate.text)
+            if used + cost <= budget_tokens:
+                loose.append(Passage(candidate.doc_id, -1, -1, candidate.page, candidate.text, rank))
+                used += cost
+            continue
+
+        doc_spans = spans.setdefault(candidate.doc_id, [])
+        touching = [
+            span for span in doc_spans
+            if span[0] - MERGE_GAP_CHARS <= candidate.end and candidate.start <= span[1] + MERGE_GAP_CHARS
+        ]
+        if any(span[0] <= candidate.start and candidate.end <= span[1] for span in touching):
+            continue
+        start = min([candidate.start] + [span[0] for span in touching])
+        end = max([candidate.end] + [span[1] for span in touching])
+        cost = count_tokens(document_slice(candidate.doc_id, start, end))
+        freed = sum(span[4] for span in touching)
+        if used - freed + cost > budget_tokens:
+            continue
+        first = min(touching + [[candidate.start, candidate.end, candidate.page]], key=lambda span: span[0])
+        for span in touching:
+            doc_spans.remove(span)
+        doc_spans.append([start, end, first[2], min([rank] + [span[3] for span in touching]), cost])
+        used += cost - freed
+
+    passages = loose + [
+        Passage(doc_id, start, end, page, document_slice(doc_id, start, end), rank)
+        for doc_id, doc_spans in spans.items()
+        for start, end, page, rank, _ in doc_spans
+    ]
+    return sorted(passages, key=lambda passage: passage.rank)
+
+
+def format_passages(passages: List[Passage], names: Sequence[str]) -> str:
+    """Passages separated by blank lines, each headed by its source document (and pages when known)"""
+    blocks = []
+    for passage in passages:
+        source = names[passage.doc_id] if passage.doc_id < len(names) else f"Document {passage.doc_id + 1}"
+        text = passage.text.strip()
+        if passage.page is not None:
+            # Passages running over a page break cite the whole page range
+            last_page = passage.page + text.count(PAGE_BREAK)
+            pages = f"pp. {passage.page}-{last_page}" if last_page > passage.page else f"p. {passage.page}"
+            source = f"{source}, {pages}"
+        blocks.append(f"[{source}]\n{text}")
+    return "\n\n".join(blocks)
+
@@ -0,0 +1,254 @@
+"""Process-wide, deduplicated document texts shared by every session.
+
+Sessions hold DocumentRef handles instead of their own copies of each text,
+so 200 students with the same course notes cost one copy. Large texts live in
+memory-mapped temporary files and are decoded on demand through a small hot
+cache, or just the requested slice; documents no session references any more
+are evicted oldest first.
+"""
+import os
+import mmap
+from array import array
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Optional
+import corpus_store
+
+# Texts at least this long are kept memory-mapped on disk instead of on the heap (0 disables)
+MMAP_MIN_CHARS = int(os.environ.get("STUDY_ASSISTANT_MMAP_CHARS", "1000000"))
+# Unreferenced documents kept around for re-uploads before they are evicted
+IDLE_MAX_CHARS = int(os.environ.get("STUDY_ASSISTANT_IDLE_CORPUS_CHARS", "50000000"))
+# Decoded copies of memory-mapped texts kept for repeated reads
+HOT_MAX_CHARS = 20_000_000
+# Memory-mapped texts record the byte offset of every this many characters, so a slice
+# decodes at most this much extra text
+SLICE_INDEX_CHARS = 4096
+
+
+class _Entry:
+    __slots__ = ('doc_hash', 'chars', 'text', 'file', 'buffer', 'offsets', 'refs', 'derived')
+
+    def __init__(self, doc_hash: str, chars: int):
+        self.doc_hash = doc_hash
+        self.chars = chars
+        self.text = None
+        self.file = None
+        self.buffer = None
+        # Byte offset of every SLICE_INDEX_CHARS-th character; None when the text is ASCII
+        self.offsets = None
+        self.refs = 0
+        self.derived = {}
+
+    def close(self):
+        if self.buffer is not None:
+            self.buffer.close()
+            self.file.close()
+        self.text = self.file = self.buffer = self.offsets = None
+        self.derived = {}
+
+
+class DocumentRef:
+    """A session's handle on one shared document; the reference is released when the handle goes away"""
+    __slots__ = ('doc_hash', 'chars', '_memory', '_finalizer', '__weakref__')
+
+    def __init__(self, memory: "CorpusMemory", doc_hash: str, chars: int):
+        self.doc_hash = doc_hash
+        self.chars = chars
+        self._memory = memory
+        # Streamlit sessions end without a callback, so garbage collection releases the reference too
+        self._finalizer = weakref.finalize(self, memory._schedule_release, doc_hash)
+
+    @property
+    def text(self) -> str:
+        return self._memory.text(self.doc_hash)
+
+    def slice(self, start: int, end: int) -> str:
+        """text[start:end] without decoding the rest of a memory-mapped text"""
+        return self._memory.slice(self.doc_hash, start, end)
+
+    def release(self):
+        """Drop this reference now instead of waiting for garbage collection"""
+        if self._finalizer.detach() is not None:
+            self._memory._schedule_release(self.doc_hash)
+            self._memory.collect()
+
+    def __len__(self) -> int:
+        return self.chars
+
+
+class CorpusMemory:
+    """Reference-counted, content-addressed document texts"""
+    def __init__(self, mmap_min_chars: int = MMAP_MIN_CHARS, idle_max_chars: int = IDLE_MAX_CHARS,
+                 hot_max_chars: int = HOT_MAX_CHARS):
+        self.mmap_min_chars = mmap_min_chars
+        self.idle_max_chars = idle_max_chars
+        self.hot_max_chars = hot_max_chars
+        self._entries: Dict[str, _Entry] = {}
+        self._idle: "OrderedDict[str, None]" = OrderedDict()
+        self._idle_chars = 0
+        self._hot: "OrderedDict[str, str]" = OrderedDict()
+        self._hot_chars = 0
+        # Finalizers may run inside any locked section, so they only queue the release
+        self._pending_releases = deque()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def acquire(self, text: str, doc_hash: Optional[str] = None) -> DocumentRef:
+        """Intern text and return a new reference to the shared copy"""
+        doc_hash = doc_hash or corpus_store.content_hash(text)
+        with self._lock:
+            self._drain_releases()
+            entry = self._entries.get(doc_hash)
+        if entry is None:
+            # Building a memory-mapped copy can take a while; do it outside the lock
+            entry = self._make_entry(doc_hash, text)
+        with self._lock:
+            existing = self._entries.get(doc_hash)
+            if existing is None:
+                self.misses += 1
+                self._entries[doc_hash] = existing = entry
+            else:
+                self.hits += 1
+                if entry is not existing:
+                    # Another session interned the same text first
+                    entry.close()
+                if doc_hash in self._idle:
+                    del self._idle[doc_hash]
+                    self._idle_chars -= existing.chars
+            existing.refs += 1
+            return DocumentRef(self, doc_hash, existing.chars)
+
+    def _make_entry(self, doc_hash: str, text: str) -> _Entry:
+        entry = _Entry(doc_hash, len(text))
+        if not self.mmap_min_chars or len(text) < self.mmap_min_chars:
+            entry.text = text
+            return entry
+        encoded = text.encode('utf-8')
+        if len(encoded) != len(text):
+            entry.offsets = array('q', [0])
+            for start in range(0, len(text) - SLICE_INDEX_CHARS, SLICE_INDEX_CHARS):
+                entry.offsets.append(entry.offsets[-1] + len(text[start:start + SLICE_INDEX_CHARS].encode('utf-8')))
+        entry.file = tempfile.TemporaryFile(prefix="study-corpus-")
+        entry.file.write(encoded)
+        del encoded
+        entry.file.flush()
+        entry.buffer = mmap.mmap(entry.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return entry
+
+    def text(self, doc_hash: str) -> str:
+        """The document's text; memory-mapped texts are decoded once and kept in the hot cache"""
+        with self._lock:
+            entry = self._entries[doc_hash]
+            if entry.text is not None:
+                return entry.text
+            text = self._hot.get(doc_hash)
+            if text is not None:
+                self._hot.move_to_end(doc_hash)
+                return text
+            buffer = entry.buffer
+        # Callers hold a reference, so the mapping cannot be evicted while it is decoded
+        text = str(buffer, 'utf-8')
+        with self._lock:
+            if doc_hash not in self._hot:
+                self._hot[doc_hash] = text
+                self._hot_chars += len(text)
+                while self._hot_chars > self.hot_max_chars and len(self._hot) > 1:
+                    _, evicted = self._hot.popitem(last=False)
+                    self._hot_chars -= len(evicted)
+        return text
+
+    def slice(self, doc_hash: str, start: int, end: int) -> str:
+        """text(doc_hash)[start:end]; memory-mapped texts not in the hot cache decode only the blocks it spans"""
+        start = max(start, 0)
+        with self._lock:
+            entry = self._entries[doc_hash]
+            text = entry.text if entry.text is not None else self._hot.get(doc_hash)
+            if text is not None:
+                return text[start:end]
+            buffer, offsets = entry.buffer, entry.offsets
+            end = min(end, entry.chars)
+        if start >= end:
+            return ""
+        if offsets is None:
+            # ASCII: one byte per character
+            return str(buffer[start:end], 'ascii')
+        first_block = start // SLICE_INDEX_CHARS
+        end_block = -(-end // SLICE_INDEX_CHARS)
+        byte_end = offsets[end_block] if end_block < len(offsets) else len(buffer)
+        text = str(buffer[offsets[first_block]:byte_end], 'utf-8')
+        base = first_block * SLICE_INDEX_CHARS
+        return text[start - base:end - base]
+
+    def derived(self, doc_hash: str, key: str, build: Callable[[], object]):
+        """A value computed from a document (e.g. its chunk list), built once and shared while it is held"""
+        with self._lock:
+            entry = self._entries.get(doc_hash)
+            if entry is not None and key in entry.derived:
+                return entry.derived[key]
+        value = build()
+        with self._lock:
+            entry = self._entries.get(doc_hash)
+            if entry is not None:
+                value = entry.derived.setdefault(key, value)
+        return value
+
+    def _schedule_release(self, doc_hash: str):
+        self._pending_releases.append(doc_hash)
+
+    def _drain_releases(self):
+        while self._pending_releases:
+            doc_hash = self._pending_releases.popleft()
+            entry = self._entries.get(doc_hash)
+            if entry is None:
+                continue
+            entry.refs -= 1
+            if entry.refs == 0:
+                self._idle[doc_hash] = None
+                self._idle_chars += entry.chars
+        while self._idle and self._idle_chars > self.idle_max_chars:
+            doc_hash, _ = self._idle.popitem(last=False)
+            entry = self._entries.pop(doc_hash)
+            self._idle_chars -= entry.chars
+            if doc_hash in self._hot:
+                self._hot_chars -= len(self._hot.pop(doc_hash))
+            entry.close()
+            self.evictions += 1
+
+    def collect(self):
+        """Apply pending releases and evict unreferenced documents over the idle budget"""
+        with self._lock:
+            self._drain_releases()
+
+    def stats(self) -> Dict:
+        self.collect()
+        with self._lock:
+            entries = list(self._entries.values())
+            return {
+                'documents': len(entries),
+                'referenced': sum(1 for entry in entries if entry.refs),
+                'references': sum(entry.refs for entry in entries),
+                'heap_chars': sum(entry.chars for entry in entries if entry.text is not None),
+                'mapped_chars': sum(entry.chars for entry in entries if entry.buffer is not None),
+                'hot_chars': self._hot_chars,
+                'idle_chars': self._idle_chars,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+_default_memory: Optional[CorpusMemory] = None
+_default_lock = threading.Lock()
+
+
+def default_corpus_memory() -> CorpusMemory:
+    """The process-wide CorpusMemory every StudyAssistant shares unless given another"""
+    global _default_memory
+    with _default_lock:
+        if _default_memory is None:
+            _default_memory = CorpusMemory()
+        return _default_memory
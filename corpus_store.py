@@ -0,0 +1,289 @@
+"""Persistent SQLite store for extracted documents, their chunks, chunk embeddings and a question bank"""
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import retrieval
+import chunking
+
+# SQLite limits the number of bound parameters per statement
+_LOOKUP_BATCH = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_hash TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    text TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS document_owners (
+    doc_hash TEXT NOT NULL REFERENCES documents(doc_hash),
+    owner TEXT NOT NULL,
+    name TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (owner, doc_hash)
+);
+CREATE TABLE IF NOT EXISTS sources (
+    upload_key TEXT PRIMARY KEY,
+    doc_hash TEXT NOT NULL REFERENCES documents(doc_hash)
+);
+CREATE TABLE IF NOT EXISTS document_chunks (
+    doc_hash TEXT NOT NULL REFERENCES documents(doc_hash),
+    chunker TEXT NOT NULL,
+    chunk_hashes TEXT NOT NULL,
+    PRIMARY KEY (doc_hash, chunker)
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    chunk_hash TEXT PRIMARY KEY,
+    text TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS derived (
+    chunk_hash TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (chunk_hash, kind)
+);
+CREATE TABLE IF NOT EXISTS embeddings (
+    chunk_hash TEXT NOT NULL,
+    embedder TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    PRIMARY KEY (chunk_hash, embedder)
+);
+CREATE TABLE IF NOT EXISTS questions (
+    question_hash TEXT PRIMARY KEY,
+    chunk_hash TEXT NOT NULL,
+    doc_hash TEXT NOT NULL,
+    type TEXT NOT NULL,
+    difficulty TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    data TEXT NOT NULL,
+    served INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS questions_by_chunk ON questions (chunk_hash, type, difficulty);
+CREATE INDEX IF NOT EXISTS questions_by_document ON questions (doc_hash);
+"""
+
+
+def content_hash(text: str) -> str:
+    """Stable identifier for a piece of text"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def owner_key(api_key: str) -> str:
+    """Owner id for documents saved by the holder of an API key (the key itself is not stored)"""
+    return content_hash(f"owner:{api_key}")
+
+
+def question_hash(question: Dict) -> str:
+    """Identifier of a banked question: its text, ignoring case and spacing"""
+    return content_hash(" ".join(question['question'].lower().split()))
+
+
+class CorpusStore:
+    """Content-addressed document/chunk/embedding store shared by every session.
+
+    Everything is keyed by hashes, so re-ingesting an unchanged file is a
+    no-op and an edited file only adds the chunks (and embeddings) that
+    actually changed. Saved documents are only listed and readable by the
+    owners (see owner_key) who stored them.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def _select_in(self, sql: str, keys: List[str], *params) -> list:
+        rows = []
+        for start in range(0, len(keys), _LOOKUP_BATCH):
+            batch = keys[start:start + _LOOKUP_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            rows.extend(self._conn.execute(sql.format(placeholders), (*batch, *params)).fetchall())
+        return rows
+
+    def find_upload(self, upload_key: str) -> Optional[str]:
+        """Return the extracted text previously stored for an upload key"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT d.text FROM sources s JOIN documents d ON d.doc_hash = s.doc_hash "
+                "WHERE s.upload_key = ?", (upload_key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put_document(self, name: str, text: str, upload_key: Optional[str] = None,
+                     owner: Optional[str] = None) -> str:
+        """Store a document (idempotent), saving it for owner when given, and return its content hash"""
+        doc_hash = content_hash(text)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO documents (doc_hash, name, text, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(doc_hash) DO UPDATE SET name = excluded.name, updated_at = excluded.updated_at",
+                (doc_hash, name, text, now)
+            )
+            if owner:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO document_owners (doc_hash, owner, name, updated_at) VALUES (?, ?, ?, ?)",
+                    (doc_hash, owner, name, now)
+                )
+            if upload_key:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sources (upload_key, doc_hash) VALUES (?, ?)",
+                    (upload_key, doc_hash)
+                )
+        return doc_hash
+
+    def list_documents(self, owner: str) -> List[Dict]:
+        """Documents saved by owner, most recently updated first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT o.doc_hash, o.name, length(d.text), o.updated_at FROM document_owners o "
+                "JOIN documents d ON d.doc_hash = o.doc_hash WHERE o.owner = ? ORDER BY o.updated_at DESC",
+                (owner,)
+            ).fetchall()
+        return [{'doc_hash': h, 'name': n, 'chars': c, 'updated_at': u} for h, n, c, u in rows]
+
+    def get_text(self, doc_hash: str, owner: str) -> Optional[str]:
+        """Text of a document saved by owner; None for documents owner never saved"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT d.text FROM document_owners o JOIN documents d ON d.doc_hash = o.doc_hash "
+                "WHERE o.owner = ? AND o.doc_hash = ?", (owner, doc_hash)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_chunks(self, doc_hash: str, chunker: str, doc_id: int = 0) -> Optional[List[chunking.Chunk]]:
+        """Return a document's chunks for the given chunker settings, if already stored"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT chunk_hashes FROM document_chunks WHERE doc_hash = ? AND chunker = ?",
+                (doc_hash, chunker)
+            ).fetchone()
+            if row is None:
+                return None
+            # Each entry is [chunk_hash, start, end, page]
+            entries = json.loads(row[0])
+            chunk_hashes = sorted({entry[0] for entry in entries})
+            texts = dict(self._select_in("SELECT chunk_hash, text FROM chunks WHERE chunk_hash IN ({})", chunk_hashes))
+        if len(texts) < len(chunk_hashes):
+            return None
+        return [chunking.Chunk(texts[h], doc_id, start, end, page) for h, start, end, page in entries]
+
+    def put_chunks(self, doc_hash: str, chunker: str, chunks: List[chunking.Chunk]):
+        """Record a document's chunk list and spans, inserting only chunks not already stored"""
+        chunk_hashes = [content_hash(chunk.text) for chunk in chunks]
+        entries = [[h, chunk.start, chunk.end, chunk.page] for h, chunk in zip(chunk_hashes, chunks)]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO chunks (chunk_hash, text) VALUES (?, ?)",
+                zip(chunk_hashes, (chunk.text for chunk in chunks))
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO document_chunks (doc_hash, chunker, chunk_hashes) VALUES (?, ?, ?)",
+                (doc_hash, chunker, json.dumps(entries))
+            )
+
+    def get_derived(self, chunk_hashes: List[str], kind: str) -> Dict[str, str]:
+        """Look up per-chunk results (e.g. partial summaries) of the given kind"""
+        with self._lock:
+            rows = self._select_in(
+                "SELECT chunk_hash, value FROM derived WHERE chunk_hash IN ({}) AND kind = ?",
+                sorted(set(chunk_hashes)), kind
+            )
+        return dict(rows)
+
+    def put_derived(self, kind: str, values: Dict[str, str]):
+        """Save per-chunk results of the given kind, replacing older values"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO derived (chunk_hash, kind, value) VALUES (?, ?, ?)",
+                ((chunk_hash, kind, value) for chunk_hash, value in values.items())
+            )
+
+    def put_questions(self, entries: List[Tuple[str, str, Dict]]) -> int:
+        """Bank (chunk_hash, doc_hash, question) entries, skipping questions already banked; returns how many were new"""
+        rows = [
+            (question_hash(question), chunk_hash, doc_hash,
+             question.get('type', ''), question.get('difficulty', ''), question.get('topic', ''),
+             json.dumps(question), time.time())
+            for chunk_hash, doc_hash, question in entries
+        ]
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO questions "
+                "(question_hash, chunk_hash, doc_hash, type, difficulty, topic, data, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            return self._conn.total_changes - before
+
+    def find_questions(self, chunk_hashes: List[str], question_type: Optional[str] = None,
+                       difficulty: Optional[str] = None) -> List[Dict]:
+        """Banked questions drawn from any of chunk_hashes, optionally of one type and difficulty.
+
+        Least served questions come first, so repeated practice rotates
+        through the whole bank.
+        """
+        sql = ("SELECT question_hash, chunk_hash, doc_hash, topic, data, served, created_at FROM questions "
+               "WHERE chunk_hash IN ({})")
+        params = []
+        if question_type:
+            sql += " AND type = ?"
+            params.append(question_type)
+        if difficulty:
+            sql += " AND difficulty = ?"
+            params.append(difficulty)
+        with self._lock:
+            rows = self._select_in(sql, sorted(set(chunk_hashes)), *params)
+        rows.sort(key=lambda row: (row[5], row[6]))
+        return [
+            {'question_hash': h, 'chunk_hash': c, 'doc_hash': d, 'topic': t, 'question': json.loads(data)}
+            for h, c, d, t, data, _, _ in rows
+        ]
+
+    def mark_questions_served(self, question_hashes: List[str]):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE questions SET served = served + 1 WHERE question_hash = ?",
+                ((h,) for h in question_hashes)
+            )
+
+    def count_questions(self, chunk_hashes: List[str]) -> int:
+        """Banked questions drawn from any of chunk_hashes"""
+        with self._lock:
+            rows = self._select_in("SELECT COUNT(*) FROM questions WHERE chunk_hash IN ({})", sorted(set(chunk_hashes)))
+        return sum(row[0] for row in rows)
+
+    def embed_chunks(self, chunks: List[str], embedder) -> np.ndarray:
+        """Return embeddings for chunks, computing and saving only the ones not stored yet"""
+        chunk_hashes = [content_hash(chunk) for chunk in chunks]
+        with self._lock:
+            rows = self._select_in(
+                "SELECT chunk_hash, vector FROM embeddings WHERE chunk_hash IN ({}) AND embedder = ?",
+                sorted(set(chunk_hashes)), embedder.name
+            )
+        vectors = {h: np.frombuffer(blob, dtype=np.float32) for h, blob in rows}
+
+        missing = list(dict.fromkeys(h for h in chunk_hashes if h not in vectors))
+        if missing:
+            texts = {h: chunk for h, chunk in zip(chunk_hashes, chunks)}
+            new_vectors = retrieval.embed_texts(embedder, [texts[h] for h in missing])
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (chunk_hash, embedder, vector) VALUES (?, ?, ?)",
+                    ((h, embedder.name, vector.astype(np.float32).tobytes()) for h, vector in zip(missing, new_vectors))
+                )
+            vectors.update(zip(missing, new_vectors))
+
+        if not chunk_hashes:
+            return np.zeros((0, embedder.dim), dtype=np.float32)
+        return np.stack([vectors[h] for h in chunk_hashes]).astype(np.float32, copy=False)
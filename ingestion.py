@@ -0,0 +1,209 @@
+"""Streamlit-free text extraction helpers that can run inside worker processes"""
+import io
+import os
+import codecs
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Iterator, List, Optional, Tuple, Union
+
+# Large PDFs are split into page ranges of this size so one book can use several cores
+PDF_PAGES_PER_TASK = 25
+# 0 means "one worker per CPU"
+INGEST_WORKERS = int(os.environ.get("STUDY_ASSISTANT_INGEST_WORKERS", "0") or 0)
+# TXT/MD uploads are decoded in blocks of this many bytes
+TXT_BLOCK_SIZE = 64 * 1024
+SUPPORTED_EXTENSIONS = ['pdf', 'docx', 'txt', 'md']
+# PDF text keeps its page boundaries: pages (empty ones included) are separated
+# by a form feed, so the page holding any offset is one more than the breaks before it
+PAGE_BREAK = "\f"
+# PyPDF2 and python-docx are imported by the functions that need them, so
+# importing this module (and spawning extraction workers) stays cheap
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+def default_worker_count() -> int:
+    """Number of worker processes used when no explicit count is given"""
+    return INGEST_WORKERS or os.cpu_count() or 1
+
+
+def _as_stream(data: Buffer) -> io.BytesIO:
+    # BytesIO shares the upload's bytes instead of copying them until written to
+    return io.BytesIO(data if isinstance(data, bytes) else memoryview(data).tobytes())
+
+
+def count_pdf_pages(data: Buffer) -> int:
+    """Return the number of pages in a PDF without extracting any text"""
+    import PyPDF2
+    return len(PyPDF2.PdfReader(_as_stream(data)).pages)
+
+
+def page_piece(page_number: int, page_text: str) -> str:
+    """The part of a PDF's joined text that one page contributes (see PAGE_BREAK)"""
+    page_text = page_text.replace(PAGE_BREAK, "\n")
+    return (PAGE_BREAK if page_number > 1 else "") + (page_text + "\n" if page_text else "")
+
+
+def join_pages(page_texts: List[str]) -> str:
+    """A PDF's text from the text of every page, in order, empty pages included"""
+    return "".join(page_piece(page_number, page_text) for page_number, page_text in enumerate(page_texts, 1))
+
+
+def iter_numbered_pdf_pages(data: Buffer, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+    """Yield (1-based page number, text) for pages [start, end); empty pages yield an empty string"""
+    import PyPDF2
+    pdf_reader = PyPDF2.PdfReader(_as_stream(data))
+    page_count = len(pdf_reader.pages)
+    for page_number in range(start, page_count if end is None else min(end, page_count)):
+        yield page_number + 1, pdf_reader.pages[page_number].extract_text() or ""
+
+
+def extract_pdf_pages(data: Buffer, start: int, end: int) -> List[str]:
+    """Extract text for pages [start, end) of a PDF, one entry per page (empty pages as "")"""
+    return [page_text for _, page_text in iter_numbered_pdf_pages(data, start, end)]
+
+
+def iter_docx_paragraphs(data: Buffer) -> Iterator[str]:
+    """Yield DOCX paragraphs so that joining the pieces gives newline-separated text"""
+    import docx
+    doc = docx.Document(_as_stream(data))
+    for i, paragraph in enumerate(doc.paragraphs):
+        yield ("\n" if i else "") + paragraph.text
+
+
+def iter_txt_blocks(data: Buffer, block_size: int = TXT_BLOCK_SIZE) -> Iterator[str]:
+    """Decode UTF-8 TXT/MD bytes block by block without materialising the whole string"""
+    view = memoryview(data)
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    for offset in range(0, len(view), block_size):
+        block = decoder.decode(view[offset:offset + block_size])
+        if block:
+            yield block
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def iter_text(data: Buffer, file_extension: str) -> Iterator[str]:
+    """Stream extracted text from an in-memory upload; "".join() gives the full document"""
+    for _, text in iter_page_segments(data, file_extension):
+        yield text
+
+
+def iter_page_segments(data: Buffer, file_extension: str) -> Iterator[Tuple[Optional[int], str]]:
+    """Like iter_text, but yield (page number, text) pairs; the page is None for non-PDF files"""
+    if file_extension == 'pdf':
+        for page_number, page_text in iter_numbered_pdf_pages(data):
+            yield page_number, page_piece(page_number, page_text)
+    elif file_extension == 'docx':
+        for paragraph in iter_docx_paragraphs(data):
+            yield None, paragraph
+    elif file_extension in ['txt', 'md']:
+        for block in iter_txt_blocks(data):
+            yield None, block
+    else:
+        raise ValueError(f"Unsupported file type: {file_extension}")
+
+
+def _extract_whole_file(data: Buffer, file_extension: str) -> List[str]:
+    if file_extension == 'pdf':
+        return extract_pdf_pages(data, 0, count_pdf_pages(data))
+    return ["".join(iter_text(data, file_extension))]
+
+
+def _join_parts(parts: List[str], file_extension: str) -> str:
+    if file_extension == 'pdf':
+        return join_pages(parts)
+    return "".join(parts)
+
+
+def _plan_file_tasks(data: bytes, file_extension: str, split: bool = True) -> List[Tuple[Callable, tuple]]:
+    """Split one file into independent extraction tasks, in output order"""
+    if split and file_extension == 'pdf':
+        page_count = count_pdf_pages(data)
+        if page_count > PDF_PAGES_PER_TASK:
+            return [
+                (extract_pdf_pages, (data, start, start + PDF_PAGES_PER_TASK))
+                for start in range(0, page_count, PDF_PAGES_PER_TASK)
+            ]
+    return [(_extract_whole_file, (data, file_extension))]
+
+
+def extract_files_parallel(files: List[Tuple[bytes, str]], max_workers: Optional[int] = None,
+                           progress_callback: Optional[Callable[[int, float, float], None]] = None
+                           ) -> List[Tuple[str, str]]:
+    """Extract text from (data, extension) pairs using a process pool.
+
+    Work fans out across files and across page ranges of large PDFs; page
+    ranges are reassembled in page order. Returns one (text, error) pair per
+    input file, where error is an empty string on success. progress_callback
+    receives (file_index, file_fraction_done, overall_fraction_done).
+    """
+    results = [("", "")] * len(files)
+    parts = [[] for _ in files]
+    task_counts = [0] * len(files)
+    remaining = [0] * len(files)
+    planned = []
+    workers = max_workers or default_worker_count()
+
+    for file_index, (data, file_extension) in enumerate(files):
+        try:
+            # Page ranges only pay off when they can run on separate cores
+            tasks = _plan_file_tasks(data, file_extension, split=workers > 1)
+        except Exception as e:
+            results[file_index] = ("", str(e))
+            continue
+        parts[file_index] = [[] for _ in tasks]
+        task_counts[file_index] = remaining[file_index] = len(tasks)
+        for part_index, task in enumerate(tasks):
+            planned.append((file_index, part_index, task))
+
+    total_tasks = len(planned)
+    completed = 0
+
+    def record(file_index: int, part_index: int, value: List[str], error: str = ""):
+        nonlocal completed
+        completed += 1
+        remaining[file_index] -= 1
+        if error and not results[file_index][1]:
+            results[file_index] = ("", error)
+        elif not results[file_index][1]:
+            parts[file_index][part_index] = value
+            if remaining[file_index] == 0:
+                flat = [text for chunk in parts[file_index] for text in chunk]
+                results[file_index] = (_join_parts(flat, files[file_index][1]), "")
+        if remaining[file_index] == 0:
+            parts[file_index] = []
+        if progress_callback:
+            file_done = task_counts[file_index] - remaining[file_index]
+            progress_callback(file_index, file_done / task_counts[file_index], completed / total_tasks)
+
+    if total_tasks <= 1 or workers <= 1:
+        # Not worth spinning up worker processes
+        for file_index, part_index, (func, args) in planned:
+            try:
+                record(file_index, part_index, func(*args))
+            except Exception as e:
+                record(file_index, part_index, [], str(e) or type(e).__name__)
+        return results
+
+    # spawn avoids forking the multi-threaded Streamlit server
+    mp_context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, total_tasks), mp_context=mp_context) as pool:
+        futures = {
+            pool.submit(func, *args): (file_index, part_index)
+            for file_index, part_index, (func, args) in planned
+        }
+        try:
+            for future in as_completed(futures):
+                file_index, part_index = futures[future]
+                try:
+                    record(file_index, part_index, future.result())
+                except Exception as e:
+                    record(file_index, part_index, [], str(e) or type(e).__name__)
+        except BaseException:
+            # e.g. the progress callback cancelled the work: skip the page ranges not started yet
+            for future in futures:
+                future.cancel()
+            raise
+    return results
@@ -0,0 +1,194 @@
+"""Background jobs for long-running work: extraction, indexing, summaries and question banks.
+
+Jobs run on a process-wide thread pool outside Streamlit's rerun cycle, so a
+widget interaction no longer abandons them. The UI polls a job for its
+progress, can cancel it, and picks up the result whenever the user returns.
+"""
+import os
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.environ.get("STUDY_ASSISTANT_JOB_WORKERS", "4") or 4)
+# Finished jobs are forgotten this long after they end
+FINISHED_JOB_TTL_SECONDS = 60 * 60
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = (DONE, FAILED, CANCELLED)
+
+_current = threading.local()
+
+
+class JobCancelled(BaseException):
+    """Raised inside a job once it is cancelled.
+
+    Like asyncio.CancelledError it is not an Exception, so code that turns
+    errors into messages (e.g. summarize_document) does not swallow it.
+    """
+
+
+class Job:
+    """One unit of background work and what the UI needs to show about it"""
+    def __init__(self, kind: str, label: str, owner: str = ""):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.label = label
+        self.owner = owner
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = ""
+        # Partial output (e.g. a summary streamed so far) shown while the job runs
+        self.output = ""
+        self.result = None
+        self.error = ""
+        # User-facing messages reported while the job ran (see report_error)
+        self.warnings: List[str] = []
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._cancel = threading.Event()
+        self._finished = threading.Event()
+        self._future = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+
+    def check(self):
+        """Raise JobCancelled if cancellation was requested; call between steps of long work"""
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def update(self, fraction: Optional[float] = None, message: Optional[str] = None,
+               output: Optional[str] = None):
+        """Report progress from inside the job; raises JobCancelled once it is cancelled"""
+        self.check()
+        if fraction is not None:
+            self.progress = min(max(fraction, 0.0), 1.0)
+        if message is not None:
+            self.message = message
+        if output is not None:
+            self.output = output
+
+    def cancel(self):
+        """Ask the job to stop; a job still queued never starts"""
+        self._cancel.set()
+        if self._future is not None and self._future.cancel():
+            self.status = CANCELLED
+            self.finished_at = time.time()
+            self._finished.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until the job has finished; False on timeout"""
+        return self._finished.wait(timeout)
+
+
+def current_job() -> Optional[Job]:
+    """The job running on this thread, if any"""
+    return getattr(_current, 'job', None)
+
+
+def report_error(message: str, fallback: Callable[[str], None]):
+    """Send a user-facing error to the running job's warnings, or to fallback outside jobs"""
+    job = current_job()
+    if job is not None:
+        job.warnings.append(message)
+    else:
+        fallback(message)
+
+
+class JobRunner:
+    """Thread pool plus a registry of jobs by id, shared by every session"""
+    def __init__(self, max_workers: int = JOB_WORKERS, finished_ttl: float = FINISHED_JOB_TTL_SECONDS):
+        self.finished_ttl = finished_ttl
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, label: str, func: Callable[[Job], object], owner: str = "") -> Job:
+        """Run func(job) in the background; its return value becomes job.result"""
+        job = Job(kind, label, owner)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        job._future = self._pool.submit(self._run, job, func)
+        return job
+
+    def _run(self, job: Job, func: Callable[[Job], object]):
+        if job.cancel_requested:
+            job.status = CANCELLED
+            job.finished_at = time.time()
+            job._finished.set()
+            return
+        job.status = RUNNING
+        job.started_at = time.time()
+        _current.job = job
+        try:
+            result = func(job)
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            logger.exception("Job %s (%s) failed", job.id, job.label)
+            job.error = str(e) or type(e).__name__
+            job.status = FAILED
+        else:
+            job.result = result
+            job.progress = 1.0
+            job.status = DONE
+        finally:
+            _current.job = None
+            job.finished_at = time.time()
+            job._finished.set()
+
+    def get(self, job_id: Optional[str]) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id) if job_id else None
+
+    def jobs(self, owner: Optional[str] = None) -> List[Job]:
+        """Known jobs, newest first, optionally only those of one owner"""
+        with self._lock:
+            self._prune()
+            found = [job for job in self._jobs.values() if owner is None or job.owner == owner]
+        return sorted(found, key=lambda job: -job.created_at)
+
+    def _prune(self):
+        cutoff = time.time() - self.finished_ttl
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.done and job.finished_at is not None and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def shutdown(self, cancel: bool = True):
+        """Stop accepting jobs and join the pool threads; with cancel, pending jobs are cancelled first"""
+        if cancel:
+            for job in self.jobs():
+                job.cancel()
+        self._pool.shutdown(wait=True, cancel_futures=cancel)
+
+
+_default_runner: Optional[JobRunner] = None
+_default_lock = threading.Lock()
+
+
+def default_runner() -> JobRunner:
+    """The process-wide JobRunner shared by every session"""
+    global _default_runner
+    with _default_lock:
+        if _default_runner is None:
+            _default_runner = JobRunner()
+            # An atexit hook would run only after the pool's own exit hook has run every queued
+            # job to completion; this one runs first, so exit waits at most for the next job.check()
+            threading._register_atexit(_default_runner.shutdown)
+        return _default_runner
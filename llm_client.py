@@ -0,0 +1,346 @@
+"""Model client layer: pluggable backends, rate limiting, retries and concurrent fan-out"""
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterator, List, Optional
+
+# "gemini" calls the real API; "fake" is a deterministic offline stand-in
+LLM_BACKEND = os.environ.get("STUDY_ASSISTANT_LLM_BACKEND", "gemini")
+# Simulated per-call latency of the fake backend, for load tests
+FAKE_LATENCY_SECONDS = float(os.environ.get("STUDY_ASSISTANT_FAKE_LATENCY", "0") or 0)
+# Quota guards shared by every caller of one client (0 disables a limit)
+REQUESTS_PER_MINUTE = int(os.environ.get("STUDY_ASSISTANT_RPM", "60") or 0)
+TOKENS_PER_MINUTE = int(os.environ.get("STUDY_ASSISTANT_TPM", "1000000") or 0)
+MAX_RETRIES = 4
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+# Error class names that signal a retryable, transient failure
+TRANSIENT_ERRORS = {
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "DeadlineExceeded",
+    "InternalServerError", "Aborted", "TimeoutError", "ConnectionError"
+}
+# Several independent prompts packed into one call are answered as a JSON array of strings
+BATCH_HEADER = "Answer each of the following independent requests separately."
+BATCH_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": {"type": "array", "items": {"type": "string"}}
+}
+BATCH_REQUEST_PATTERN = re.compile(r"^<<<REQUEST (\d+)>>>\n(.*?)\n<<<END REQUEST \1>>>$", re.S | re.M)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for English text)"""
+    return len(text) // 4 + 1
+
+
+def pack_prompts(prompts: List[str]) -> str:
+    """One prompt asking for the answers to several independent prompts"""
+    requests = "\n\n".join(
+        f"<<<REQUEST {i}>>>\n{prompt}\n<<<END REQUEST {i}>>>" for i, prompt in enumerate(prompts, 1)
+    )
+    return (
+        f"{BATCH_HEADER}\nReturn a JSON array of exactly {len(prompts)} strings: element i is your complete "
+        f"answer to request i, formatted exactly as that request asks, as if it had been sent on its own.\n\n"
+        f"{requests}"
+    )
+
+
+def unpack_prompts(packed: str) -> List[str]:
+    """The prompts packed by pack_prompts, in order"""
+    return [prompt for _, prompt in BATCH_REQUEST_PATTERN.findall(packed)]
+
+
+def unpack_replies(reply: str, count: int) -> List[str]:
+    """Split a packed reply back into count answers; ValueError when it is malformed"""
+    answers = json.loads(reply)
+    if not isinstance(answers, list) or len(answers) != count or not all(isinstance(a, str) for a in answers):
+        raise ValueError(f"expected a JSON array of {count} strings")
+    return answers
+
+
+def is_transient_error(error: Exception) -> bool:
+    """True for quota, timeout and server-side errors that are worth retrying"""
+    return any(cls.__name__ in TRANSIENT_ERRORS for cls in type(error).__mro__)
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at rate_per_minute"""
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_second)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Take amount tokens and return how long the caller must wait before using them"""
+        with self._lock:
+            self._refill()
+            # Requests larger than the bucket may only wait for a full bucket
+            amount = min(amount, self.capacity)
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate_per_second
+
+    def acquire(self, amount: float = 1.0):
+        """Block until amount tokens are available"""
+        wait = self.reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
+
+    def debit(self, amount: float):
+        """Charge tokens after the fact (e.g. response tokens) without waiting"""
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits applied together"""
+    def __init__(self, requests_per_minute: int = REQUESTS_PER_MINUTE,
+                 tokens_per_minute: int = TOKENS_PER_MINUTE):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def reserve(self, prompt_tokens: int) -> float:
+        waits = [0.0]
+        if self.requests is not None:
+            waits.append(self.requests.reserve(1))
+        if self.tokens is not None:
+            waits.append(self.tokens.reserve(prompt_tokens))
+        return max(waits)
+
+    def acquire(self, prompt_tokens: int) -> float:
+        """Block until the request fits both limits and return the seconds waited"""
+        wait = self.reserve(prompt_tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def record_response(self, response_tokens: int):
+        if self.tokens is not None:
+            self.tokens.debit(response_tokens)
+
+
+class GeminiBackend:
+    """Backend that calls the Gemini API through google.generativeai"""
+    def __init__(self, model_name: str, api_key: Optional[str] = None):
+        import google.generativeai as genai
+        if api_key:
+            genai.configure(api_key=api_key)
+        self.name = model_name
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt: str, generation_config: Optional[Dict] = None) -> str:
+        if generation_config:
+            return self.model.generate_content(prompt, generation_config=generation_config).text
+        return self.model.generate_content(prompt).text
+
+    def stream(self, prompt: str, generation_config: Optional[Dict] = None) -> Iterator[str]:
+        if generation_config:
+            response = self.model.generate_content(prompt, generation_config=generation_config, stream=True)
+        else:
+            response = self.model.generate_content(prompt, stream=True)
+        for chunk in response:
+            try:
+                piece = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. the final finish-reason chunk)
+                continue
+            if piece:
+                yield piece
+
+
+class FakeBackend:
+    """Deterministic offline backend for tests, benchmarks and load tests.
+
+    The same prompt always produces the same reply. JSON requests (e.g.
+    question batches) get a reply shaped like the requested schema, and
+    anything else echoes the prompt's markdown headings.
+    """
+    def __init__(self, latency_seconds: float = 0.0, seconds_per_chunk: float = 0.0):
+        self.name = "fake"
+        self.latency_seconds = latency_seconds
+        self.seconds_per_chunk = seconds_per_chunk
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _seed(prompt: str) -> str:
+        return hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:8]
+
+    def _requested_count(self, prompt: str, default: int = 5) -> int:
+        match = re.search(r"Generate (\d+)", prompt)
+        return int(match.group(1)) if match else default
+
+    def _from_schema(self, schema: Dict, seed: str, index: int = 0, count: int = 1):
+        kind = str(schema.get("type", "string")).lower()
+        if kind == "array":
+            return [self._from_schema(schema.get("items", {}), seed, i) for i in range(count)]
+        if kind == "object":
+            return {
+                name: self._from_schema(prop, f"{seed}-{name}", index, 4)
+                for name, prop in schema.get("properties", {}).items()
+            }
+        if "enum" in schema:
+            return schema["enum"][index % len(schema["enum"])]
+        if kind in ("integer", "number"):
+            return index
+        if kind == "boolean":
+            return index % 2 == 0
+        return f"{seed} item {index + 1}"
+
+    def _reply(self, prompt: str, generation_config: Optional[Dict]) -> str:
+        if prompt.startswith(BATCH_HEADER):
+            # Answer packed prompts exactly as if they had been sent one by one
+            return json.dumps([self._reply(part, None) for part in unpack_prompts(prompt)])
+        seed = self._seed(prompt)
+        if generation_config and generation_config.get("response_mime_type") == "application/json":
+            schema = generation_config.get("response_schema") or {"type": "string"}
+            return json.dumps(self._from_schema(schema, seed, count=self._requested_count(prompt)))
+        headings = [line.strip() for line in prompt.splitlines() if line.strip().startswith("## ")]
+        if not headings:
+            return f"Fake response {seed}."
+        return "\n\n".join(f"{heading}\nFake content for this section ({seed})." for heading in headings)
+
+    def generate(self, prompt: str, generation_config: Optional[Dict] = None) -> str:
+        with self._lock:
+            self.calls += 1
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        return self._reply(prompt, generation_config)
+
+    def stream(self, prompt: str, generation_config: Optional[Dict] = None) -> Iterator[str]:
+        text = self.generate(prompt, generation_config)
+        for piece in re.findall(r"\S+\s*", text):
+            if self.seconds_per_chunk:
+                time.sleep(self.seconds_per_chunk)
+            yield piece
+
+
+def make_backend(name: str, model_name: str, api_key: Optional[str] = None):
+    """Build the configured backend ('gemini' or 'fake')"""
+    if name == "fake":
+        return FakeBackend(latency_seconds=FAKE_LATENCY_SECONDS)
+    return GeminiBackend(model_name, api_key)
+
+
+class ModelClient:
+    """Rate-limited, retrying front end to a backend with thread pool fan-out"""
+    def __init__(self, backend, limiter: Optional[RateLimiter] = None, max_retries: int = MAX_RETRIES,
+                 backoff_base: float = BACKOFF_BASE_SECONDS, max_workers: int = 4):
+        self.backend = backend
+        self.limiter = limiter or RateLimiter()
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.max_workers = max_workers
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    @property
+    def model_name(self) -> str:
+        return self.backend.name
+
+    def _count(self, field: str):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter keeps many retrying workers from hitting the API in lockstep
+        return random.uniform(0, min(BACKOFF_MAX_SECONDS, self.backoff_base * 2 ** attempt))
+
+    @staticmethod
+    def _emit(on_event: Optional[Callable[[str, float], None]], name: str, amount: float):
+        if on_event and amount:
+            on_event(name, amount)
+
+    def generate(self, prompt: str, generation_config: Optional[Dict] = None,
+                 on_event: Optional[Callable[[str, float], None]] = None) -> str:
+        """Generate a reply, waiting for quota and retrying transient errors with backoff.
+
+        on_event(name, amount) is told about 'retries' and 'rate_limit_wait_seconds'.
+        """
+        attempt = 0
+        while True:
+            self._emit(on_event, 'rate_limit_wait_seconds', self.limiter.acquire(estimate_tokens(prompt)))
+            self._count('calls')
+            try:
+                text = self.backend.generate(prompt, generation_config)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_transient_error(e):
+                    self._count('failures')
+                    raise
+                self._count('retries')
+                self._emit(on_event, 'retries', 1)
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+            self.limiter.record_response(estimate_tokens(text))
+            return text
+
+    def generate_batch(self, prompts: List[str],
+                       on_event: Optional[Callable[[str, float], None]] = None) -> List[str]:
+        """Answer several small, independent prompts with one model call (ValueError if the reply can't be split)"""
+        reply = self.generate(pack_prompts(prompts), BATCH_GENERATION_CONFIG, on_event)
+        return unpack_replies(reply, len(prompts))
+
+    def stream(self, prompt: str, generation_config: Optional[Dict] = None,
+               on_event: Optional[Callable[[str, float], None]] = None) -> Iterator[str]:
+        """Stream a reply; transient errors are retried only before the first piece arrives"""
+        attempt = 0
+        while True:
+            self._emit(on_event, 'rate_limit_wait_seconds', self.limiter.acquire(estimate_tokens(prompt)))
+            self._count('calls')
+            produced = 0
+            try:
+                for piece in self.backend.stream(prompt, generation_config):
+                    produced += len(piece)
+                    yield piece
+            except Exception as e:
+                if produced or attempt >= self.max_retries or not is_transient_error(e):
+                    self._count('failures')
+                    raise
+                self._count('retries')
+                self._emit(on_event, 'retries', 1)
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+            self.limiter.record_response(produced // 4 + 1)
+            return
+
+    def map(self, func: Callable, items: List, on_done: Optional[Callable] = None) -> List:
+        """Run func over items on a bounded thread pool, returning results in input order.
+
+        on_done(index, result) is called from the calling thread as each item finishes.
+        If it (or func) raises, items not started yet are dropped instead of
+        spending quota on a result nobody will read.
+        """
+        results = [None] * len(items)
+        if not items:
+            return results
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(items))) as pool:
+            futures = {pool.submit(func, item): i for i, item in enumerate(items)}
+            try:
+                for future in as_completed(futures):
+                    i = futures[future]
+                    results[i] = future.result()
+                    if on_done:
+                        on_done(i, results[i])
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+        return results
@@ -0,0 +1,327 @@
+"""Headless multi-session load test: N concurrent Streamlit sessions against the offline fake model.
+
+Every session runs the real app script through Streamlit's AppTest: it
+validates an API key, uploads synthetic documents, processes them and then
+chats. Sessions share one process, so process-wide caches and the corpus
+store are shared exactly as they are under `streamlit run`.
+
+Usage:
+    python load_test.py --sessions 8 --turns 5 --pages 50
+    python load_test.py --sessions 20 --model-latency 0.5 --unique-docs --json report.json
+"""
+import os
+import sys
+import json
+import time
+import types
+import argparse
+import resource
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+import numpy as np
+import jobs
+import synthetic_docs
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+MIME_TYPES = {
+    'pdf': "application/pdf",
+    'docx': "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    'txt': "text/plain",
+    'md': "text/markdown"
+}
+# Objects that never belong to a single session
+_SKIPPED_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType)
+
+
+def configure_environment(model_latency: float, requests_per_minute: int, corpus_db: str):
+    """Point the app at the fake backend; must run before app/llm_client are imported"""
+    os.environ["STUDY_ASSISTANT_LLM_BACKEND"] = "fake"
+    os.environ["STUDY_ASSISTANT_FAKE_LATENCY"] = str(model_latency)
+    os.environ["STUDY_ASSISTANT_RPM"] = str(requests_per_minute)
+    os.environ["STUDY_ASSISTANT_CORPUS_DB"] = corpus_db
+    import streamlit.logger
+    # Bare-mode AppTests warn about the missing script run context on every run
+    streamlit.logger.set_log_level("error")
+    _share_script_bytecode()
+    _share_runtime()
+
+
+def _share_script_bytecode():
+    """Compile the app script once for all sessions.
+
+    AppTest compiles the script on every run, and CPython's compiler is not
+    safe to call from several threads at once, so concurrent sessions share
+    one compiled copy instead.
+    """
+    from streamlit.runtime.scriptrunner import script_cache
+    original = script_cache.ScriptCache.get_bytecode
+    if getattr(original, 'shared', False):
+        return
+    lock = threading.Lock()
+    compiled = {}
+
+    def get_bytecode(self, script_path: str):
+        with lock:
+            if script_path not in compiled:
+                compiled[script_path] = original(self, script_path)
+            return compiled[script_path]
+
+    get_bytecode.shared = True
+    script_cache.ScriptCache.get_bytecode = get_bytecode
+
+
+def _share_runtime():
+    """Keep a runtime visible to every session's script thread.
+
+    AppTest installs a mock Runtime for each run and clears the global when
+    the run ends, so one session finishing would pull it from under another
+    session's script (or one of its background jobs) still running.
+    Sessions fall back to the most recently installed runtime instead.
+    """
+    from streamlit.runtime import Runtime
+    if getattr(Runtime.instance, 'shared', False):
+        return
+    original = Runtime.instance
+    latest = []
+
+    def instance(cls):
+        if cls._instance is not None:
+            latest[:] = [cls._instance]
+        elif latest:
+            return latest[0]
+        return original()
+
+    def exists(cls) -> bool:
+        return cls._instance is not None or bool(latest)
+
+    instance.shared = True
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(exists)
+
+
+def object_sizes(root) -> Dict[int, int]:
+    """Approximate bytes held by every object reachable from root, keyed by object id.
+
+    NumPy arrays count their buffers and FAISS indexes their stored vectors;
+    modules, classes and functions are not followed.
+    """
+    sizes: Dict[int, int] = {}
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in sizes or isinstance(obj, _SKIPPED_TYPES):
+            continue
+        if isinstance(obj, np.ndarray):
+            sizes[id(obj)] = obj.nbytes
+            continue
+        if hasattr(obj, 'ntotal') and hasattr(obj, 'd'):
+            # FAISS flat index: one float32 vector per entry
+            sizes[id(obj)] = int(obj.ntotal) * int(obj.d) * 4
+            continue
+        sizes[id(obj)] = sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)) or type(obj).__name__ == 'deque':
+            stack.extend(obj)
+        elif hasattr(obj, '__dict__'):
+            stack.append(vars(obj))
+    return sizes
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1e6 if sys.platform == 'darwin' else 1e3)
+
+
+def run_session(index: int, files: List[tuple], turns: int, timeout: float) -> Dict:
+    """Drive one session through the app and return its timings and final session objects"""
+    from streamlit.testing.v1 import AppTest
+
+    result = {'session': index, 'errors': [], 'chat_latencies': [], 'model_calls': 0}
+    started = time.perf_counter()
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    at.run()
+
+    def check(step: str):
+        if at.exception:
+            result['errors'].append(f"{step}: {at.exception[0].value}")
+
+    [box for box in at.text_input if "API Key" in box.label][0].input(f"load-test-key-{index}").run()
+    [button for button in at.button if button.label == "Validate API Key"][0].click().run()
+    check("validate")
+
+    upload_started = time.perf_counter()
+    at.file_uploader[0].set_value(files).run()
+    check("upload")
+    # Extraction runs as a background job; if the page showed its progress, wait for it and rerun
+    # as the page's progress fragment would
+    if any(button.label == "⏹️ Cancel" for button in at.button):
+        upload_job = jobs.default_runner().get(at.session_state["job_ids"].get("upload"))
+        if upload_job is not None:
+            upload_job.wait(timeout)
+        at.run()
+    check("extraction")
+    process_buttons = [button for button in at.button if "Process Documents" in button.label]
+    if process_buttons:
+        process_buttons[0].click().run()
+        check("process")
+    else:
+        result['errors'].append("process: button not shown")
+    result['ingest_seconds'] = time.perf_counter() - upload_started
+
+    for turn in range(turns):
+        topic = synthetic_docs.TOPICS[(index + turn) % len(synthetic_docs.TOPICS)]
+        turn_started = time.perf_counter()
+        at.chat_input[0].set_value(f"What does the material say about {topic}? (session {index}, turn {turn})").run()
+        result['chat_latencies'].append(time.perf_counter() - turn_started)
+        check(f"chat turn {turn}")
+
+    result['total_seconds'] = time.perf_counter() - started
+    assistant = at.session_state["assistant"] if "assistant" in at.session_state else None
+    result['state'] = {
+        'assistant': assistant,
+        'messages': at.session_state["messages"] if "messages" in at.session_state else []
+    }
+    if assistant is not None:
+        result['model_calls'] = assistant.client.calls
+        result['documents'] = len(assistant.documents)
+    return result
+
+
+def run_load_test(sessions: int = 4, turns: int = 5, pages: int = 20, file_extension: str = 'pdf',
+                  files_per_session: int = 1, unique_docs: bool = False, timeout: float = 300.0) -> Dict:
+    """Run the sessions concurrently and summarise throughput, latency and memory"""
+    rss_before = peak_rss_mb()
+    shared_files = None
+    session_files = []
+    for index in range(sessions):
+        if unique_docs or shared_files is None:
+            files = [
+                (f"notes-{index if unique_docs else 0}-{n}.{file_extension}",
+                 synthetic_docs.make_document(file_extension, pages, seed=(index if unique_docs else 0) * 100 + n),
+                 MIME_TYPES[file_extension])
+                for n in range(files_per_session)
+            ]
+            if not unique_docs:
+                shared_files = files
+        session_files.append(files if unique_docs else shared_files)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        results = list(pool.map(lambda i: run_session(i, session_files[i], turns, timeout), range(sessions)))
+    wall_seconds = time.perf_counter() - started
+
+    # Objects reachable from several sessions (shared caches, the corpus store) are reported separately
+    session_sizes = [object_sizes(result.pop('state')) for result in results]
+    owners: Dict[int, int] = {}
+    for sizes in session_sizes:
+        for object_id in sizes:
+            owners[object_id] = owners.get(object_id, 0) + 1
+    shared_bytes = {}
+    for sizes in session_sizes:
+        for object_id, size in sizes.items():
+            if owners[object_id] > 1:
+                shared_bytes[object_id] = size
+    for result, sizes in zip(results, session_sizes):
+        result['session_mb'] = sum(size for object_id, size in sizes.items() if owners[object_id] == 1) / 1e6
+
+    # Document texts live in the process-wide corpus memory, which sessions only reference
+    import corpus_memory
+    corpus = corpus_memory.default_corpus_memory().stats()
+    import coalescing
+    flights = coalescing.default_single_flight().stats()
+
+    latencies = [latency for result in results for latency in result['chat_latencies']]
+    chat_turns = len(latencies)
+    model_calls = sum(result['model_calls'] for result in results)
+    session_mb = [result['session_mb'] for result in results]
+    return {
+        'sessions': sessions,
+        'turns_per_session': turns,
+        'document': f"{files_per_session} x {pages}-page {file_extension}",
+        'wall_seconds': wall_seconds,
+        'chat_turns_per_second': chat_turns / wall_seconds if wall_seconds else 0.0,
+        'model_calls_per_second': model_calls / wall_seconds if wall_seconds else 0.0,
+        'chat_p50_seconds': float(np.percentile(latencies, 50)) if latencies else 0.0,
+        'chat_p95_seconds': float(np.percentile(latencies, 95)) if latencies else 0.0,
+        'ingest_p95_seconds': float(np.percentile([r['ingest_seconds'] for r in results], 95)),
+        'session_mb_mean': float(np.mean(session_mb)),
+        'session_mb_max': float(np.max(session_mb)),
+        'shared_mb': sum(shared_bytes.values()) / 1e6,
+        'corpus_documents': corpus['documents'],
+        'corpus_references': corpus['references'],
+        'corpus_heap_mb': (corpus['heap_chars'] + corpus['hot_chars']) / 1e6,
+        'corpus_mapped_mb': corpus['mapped_chars'] / 1e6,
+        'coalesced_requests': flights['shared'],
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_rss_growth_mb': peak_rss_mb() - rss_before,
+        'errors': [error for result in results for error in result['errors']],
+        'per_session': results
+    }
+
+
+def format_report(report: Dict) -> str:
+    lines = [
+        f"Sessions: {report['sessions']} x {report['turns_per_session']} chat turns, {report['document']} each",
+        f"Wall time: {report['wall_seconds']:.2f}s",
+        f"Throughput: {report['chat_turns_per_second']:.2f} chat turns/s, "
+        f"{report['model_calls_per_second']:.2f} model calls/s",
+        f"Chat latency: p50 {report['chat_p50_seconds'] * 1000:.0f}ms, p95 {report['chat_p95_seconds'] * 1000:.0f}ms",
+        f"Ingest latency (upload + process): p95 {report['ingest_p95_seconds']:.2f}s",
+        f"Per-session memory: mean {report['session_mb_mean']:.2f}MB, max {report['session_mb_max']:.2f}MB "
+        f"(+{report['shared_mb']:.2f}MB shared between sessions)",
+        f"Shared corpus: {report['corpus_documents']} distinct documents for {report['corpus_references']} "
+        f"session references, ~{report['corpus_heap_mb']:.2f}MB on the heap + "
+        f"{report['corpus_mapped_mb']:.2f}MB memory-mapped",
+        f"Coalesced model requests: {report['coalesced_requests']} shared an identical in-flight call",
+        f"Process peak RSS: {report['peak_rss_mb']:.1f}MB (+{report['peak_rss_growth_mb']:.1f}MB during the run)",
+    ]
+    for result in report['per_session']:
+        lines.append(
+            f"  session {result['session']:>3}: {result.get('documents', 0)} docs, "
+            f"{result['session_mb']:.2f}MB, ingest {result['ingest_seconds']:.2f}s, "
+            f"chat p95 {float(np.percentile(result['chat_latencies'], 95)) * 1000 if result['chat_latencies'] else 0:.0f}ms, "
+            f"{result['model_calls']} model calls"
+        )
+    if report['errors']:
+        lines.append(f"Errors ({len(report['errors'])}):")
+        lines.extend(f"  {error}" for error in report['errors'])
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=4, help="concurrent sessions")
+    parser.add_argument("--turns", type=int, default=5, help="chat turns per session")
+    parser.add_argument("--pages", type=int, default=20, help="pages per synthetic document")
+    parser.add_argument("--format", dest="file_extension", default="pdf", choices=sorted(MIME_TYPES))
+    parser.add_argument("--files", type=int, default=1, help="documents uploaded per session")
+    parser.add_argument("--unique-docs", action="store_true",
+                        help="give every session different documents instead of the same notes")
+    parser.add_argument("--model-latency", type=float, default=0.0, help="seconds per fake model call")
+    parser.add_argument("--rpm", type=int, default=0, help="requests-per-minute limit per API key (0 = off)")
+    parser.add_argument("--corpus-db", default=None,
+                        help="corpus SQLite path (default: a temporary file; empty string disables)")
+    parser.add_argument("--timeout", type=float, default=300.0, help="seconds allowed per script run")
+    parser.add_argument("--json", dest="json_path", help="also write the report to this JSON file")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus_db = args.corpus_db if args.corpus_db is not None else os.path.join(tmp_dir, "corpus.db")
+        configure_environment(args.model_latency, args.rpm, corpus_db)
+        report = run_load_test(args.sessions, args.turns, args.pages, args.file_extension,
+                               args.files, args.unique_docs, args.timeout)
+
+    print(format_report(report))
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 1 if report['errors'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""Lightweight per-stage instrumentation with JSON and Prometheus text exports"""
+import os
+import json
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+# Recent samples kept per stage for percentiles
+SAMPLES_KEPT = 1000
+PROMETHEUS_PREFIX = "study_assistant"
+# Stages in the order they happen for one request
+STAGES = ["extraction", "chunking", "indexing", "topics", "retrieval", "prompt_assembly", "generate"]
+# Optional Prometheus textfile the app rewrites after every script run (disabled when empty)
+METRICS_FILE = os.environ.get("STUDY_ASSISTANT_METRICS_FILE", "")
+
+
+def _percentile(sorted_samples: List[float], q: float) -> float:
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, max(0, round(q / 100 * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+class StageStats:
+    """Call count, error count and wall time of one stage"""
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.samples = deque(maxlen=SAMPLES_KEPT)
+
+    def observe(self, seconds: float, error: bool = False):
+        self.count += 1
+        self.errors += int(error)
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.samples.append(seconds)
+
+    def snapshot(self) -> Dict:
+        ordered = sorted(self.samples)
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'total_seconds': self.total_seconds,
+            'mean_seconds': self.total_seconds / self.count if self.count else 0.0,
+            'p50_seconds': _percentile(ordered, 50),
+            'p95_seconds': _percentile(ordered, 95),
+            'max_seconds': self.max_seconds
+        }
+
+
+class Metrics:
+    """Thread-safe stage timers and counters.
+
+    A session's Metrics can forward everything to a process-wide parent, so
+    one call records both the per-session and the process-wide view.
+    """
+    def __init__(self, parent: Optional["Metrics"] = None):
+        self.parent = parent
+        self.started_at = time.time()
+        self._stages: Dict[str, StageStats] = {}
+        self._counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float, error: bool = False):
+        """Record one completed call of stage"""
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = StageStats()
+            stats.observe(seconds, error)
+        if self.parent is not None:
+            self.parent.observe(stage, seconds, error)
+
+    def increment(self, counter: str, amount: float = 1):
+        """Add amount to a counter (e.g. tokens, cache hits, retries)"""
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + amount
+        if self.parent is not None:
+            self.parent.increment(counter, amount)
+
+    @contextmanager
+    def timed(self, stage: str) -> Iterator[None]:
+        """Time the enclosed block as one call of stage; exceptions are counted as errors"""
+        started = time.perf_counter()
+        error = False
+        try:
+            yield
+        except Exception:
+            error = True
+            raise
+        finally:
+            # A stream closed early by its consumer (GeneratorExit) is not an error
+            self.observe(stage, time.perf_counter() - started, error)
+
+    def snapshot(self) -> Dict:
+        """Point-in-time copy of every stage and counter"""
+        with self._lock:
+            stages = {name: stats.snapshot() for name, stats in self._stages.items()}
+            counters = dict(self._counters)
+        ordered = sorted(stages, key=lambda name: (STAGES.index(name) if name in STAGES else len(STAGES), name))
+        return {
+            'started_at': self.started_at,
+            'uptime_seconds': time.time() - self.started_at,
+            'stages': {name: stages[name] for name in ordered},
+            'counters': dict(sorted(counters.items()))
+        }
+
+    def stage_rows(self) -> List[Dict]:
+        """One display row per stage, times in milliseconds"""
+        return [
+            {
+                'stage': stage,
+                'calls': stats['count'],
+                'errors': stats['errors'],
+                'total ms': round(stats['total_seconds'] * 1000, 1),
+                'p50 ms': round(stats['p50_seconds'] * 1000, 1),
+                'p95 ms': round(stats['p95_seconds'] * 1000, 1),
+                'max ms': round(stats['max_seconds'] * 1000, 1)
+            }
+            for stage, stats in self.snapshot()['stages'].items()
+        ]
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, scope: str = "process") -> str:
+        """Render the metrics in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        prefix = PROMETHEUS_PREFIX
+        lines = [
+            f"# HELP {prefix}_stage_seconds Wall time spent in each pipeline stage.",
+            f"# TYPE {prefix}_stage_seconds summary"
+        ]
+        for stage, stats in snapshot['stages'].items():
+            labels = f'scope="{scope}",stage="{stage}"'
+            lines.append(f'{prefix}_stage_seconds{{{labels},quantile="0.5"}} {stats["p50_seconds"]:.6f}')
+            lines.append(f'{prefix}_stage_seconds{{{labels},quantile="0.95"}} {stats["p95_seconds"]:.6f}')
+            lines.append(f'{prefix}_stage_seconds_sum{{{labels}}} {stats["total_seconds"]:.6f}')
+            lines.append(f'{prefix}_stage_seconds_count{{{labels}}} {stats["count"]}')
+        lines.append(f"# HELP {prefix}_stage_errors_total Stage calls that raised an exception.")
+        lines.append(f"# TYPE {prefix}_stage_errors_total counter")
+        for stage, stats in snapshot['stages'].items():
+            lines.append(f'{prefix}_stage_errors_total{{scope="{scope}",stage="{stage}"}} {stats["errors"]}')
+        for counter, value in snapshot['counters'].items():
+            name = f"{prefix}_{counter}_total"
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f'{name}{{scope="{scope}"}} {value:g}')
+        lines.append(f"# TYPE {prefix}_uptime_seconds gauge")
+        lines.append(f'{prefix}_uptime_seconds{{scope="{scope}"}} {snapshot["uptime_seconds"]:.3f}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str, scope: str = "process"):
+        """Atomically write the Prometheus text to path (e.g. for a node_exporter textfile collector)"""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus(scope))
+        os.replace(tmp_path, path)
@@ -0,0 +1,223 @@
+"""Page-addressable PDFs: opened lazily, each page extracted once, on demand or in the background.
+
+A long book no longer has to be extracted in full before anything can
+happen. Pages that are needed first are extracted first, every page's text
+is cached, and the text seen so far keeps its page breaks
+(ingestion.PAGE_BREAK), so chunks carry page numbers before extraction ends.
+Background extraction runs page ranges in worker processes, so it neither
+holds the GIL nor waits for a single core.
+"""
+import hashlib
+import multiprocessing
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+import ingestion
+
+# Recently opened PDFs (with their extracted pages) kept for reruns and other sessions
+OPEN_DOCUMENTS = 4
+# Background extraction works in aligned page ranges of this size (1-25, 26-50, ...)
+RANGE_PAGES = ingestion.PDF_PAGES_PER_TASK
+# Page references in a question ("page 212", "pp. 40-45"); a range reference covers at most RANGE_PAGES pages
+PAGE_REFERENCE = re.compile(r"\b(?:pages?|pp?\.|pgs?\.?)\s*(\d+)(?:\s*(?:-|–|to)\s*(\d+))?", re.IGNORECASE)
+
+
+def referenced_pages(text: str, page_count: int) -> List[int]:
+    """Pages of a page_count-page document that text refers to, in the order mentioned"""
+    pages = []
+    for match in PAGE_REFERENCE.finditer(text):
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+        for page_number in range(first, min(last, first + RANGE_PAGES - 1, page_count) + 1):
+            if page_number >= 1 and page_number not in pages:
+                pages.append(page_number)
+    return pages
+
+
+# The PDF a background extraction worker process was started for
+_worker_reader = None
+
+
+def _open_in_worker(data: bytes):
+    global _worker_reader
+    import PyPDF2
+    _worker_reader = PyPDF2.PdfReader(ingestion._as_stream(data))
+
+
+def _extract_range(first: int, last: int) -> List[str]:
+    # Runs in a worker process: pages first..last of the PDF it was started for
+    return [_worker_reader.pages[page_number - 1].extract_text() or "" for page_number in range(first, last + 1)]
+
+
+class PdfDocument:
+    """One PDF whose pages are extracted lazily and cached; thread-safe"""
+    def __init__(self, data: bytes):
+        self._data = data
+        self._reader = None
+        self._page_count: Optional[int] = None
+        self._pages: Dict[int, str] = {}
+        # Pages asked for ahead of page order, then the next range in page order
+        self._wanted: List[int] = []
+        self._next_range = 1
+        # First pages of the ranges handed to worker processes
+        self._claimed: Set[int] = set()
+        self._worker: Optional[threading.Thread] = None
+        self.error = ""
+        # PyPDF2 readers are not thread-safe, so one page is extracted at a time
+        self._reader_lock = threading.Lock()
+        self._state = threading.Condition()
+
+    def _open_reader(self):
+        if self._reader is None:
+            import PyPDF2
+            self._reader = PyPDF2.PdfReader(ingestion._as_stream(self._data))
+        return self._reader
+
+    @property
+    def page_count(self) -> int:
+        if self._page_count is None:
+            with self._reader_lock:
+                self._page_count = len(self._open_reader().pages)
+        return self._page_count
+
+    @property
+    def extracted_pages(self) -> int:
+        with self._state:
+            return len(self._pages)
+
+    @property
+    def complete(self) -> bool:
+        return self.extracted_pages == self.page_count
+
+    def page_range(self, page_number: int) -> Tuple[int, int]:
+        """First and last page of the aligned range holding page_number"""
+        first = (page_number - 1) // RANGE_PAGES * RANGE_PAGES + 1
+        return first, min(first + RANGE_PAGES - 1, self.page_count)
+
+    def extracted_ranges(self) -> List[Tuple[int, int]]:
+        """(first, last) page of every range whose pages are all extracted, in page order"""
+        page_count = self.page_count
+        with self._state:
+            return [
+                (first, min(first + RANGE_PAGES - 1, page_count))
+                for first in range(1, page_count + 1, RANGE_PAGES)
+                if all(page_number in self._pages for page_number in range(first, min(first + RANGE_PAGES, page_count + 1)))
+            ]
+
+    def page(self, page_number: int) -> str:
+        """Text of one page (1-based), extracted now unless it already was"""
+        with self._state:
+            if page_number in self._pages:
+                return self._pages[page_number]
+        if not 1 <= page_number <= self.page_count:
+            raise IndexError(f"page {page_number} of {self.page_count}")
+        with self._reader_lock:
+            with self._state:
+                # Another thread may have extracted it while we waited for the reader
+                if page_number in self._pages:
+                    return self._pages[page_number]
+            text = self._open_reader().pages[page_number - 1].extract_text() or ""
+        with self._state:
+            self._pages[page_number] = text
+            self._state.notify_all()
+        return text
+
+    def iter_pages(self, start: int = 1, end: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        """Yield (page number, text) for pages start..end (inclusive), extracting those not cached yet"""
+        for page_number in range(start, min(end or self.page_count, self.page_count) + 1):
+            yield page_number, self.page(page_number)
+
+    def prefetch(self, page_numbers: Iterable[int] = ()):
+        """Extract pages in the background: the ranges of page_numbers first, then every remaining range in order"""
+        with self._state:
+            self._wanted[:0] = [number for number in page_numbers if number not in self._pages]
+            if self._worker is None and not self.error:
+                self._worker = threading.Thread(target=self._extract_remaining, name="pdf-pages", daemon=True)
+                self._worker.start()
+
+    def _claim(self, first: int, page_count: int) -> Optional[Tuple[int, int]]:
+        last = min(first + RANGE_PAGES - 1, page_count)
+        if first in self._claimed or all(number in self._pages for number in range(first, last + 1)):
+            return None
+        self._claimed.add(first)
+        return first, last
+
+    def _claim_next_range(self) -> Optional[Tuple[int, int]]:
+        """The next range to extract: the ranges of wanted pages first, then the next one in page order"""
+        page_count = self.page_count
+        with self._state:
+            while self._wanted:
+                page_number = self._wanted.pop(0)
+                if 1 <= page_number <= page_count:
+                    page_range = self._claim(self.page_range(page_number)[0], page_count)
+                    if page_range:
+                        return page_range
+            while self._next_range <= page_count:
+                page_range = self._claim(self._next_range, page_count)
+                self._next_range += RANGE_PAGES
+                if page_range:
+                    return page_range
+            return None
+
+    def _extract_remaining(self):
+        workers = ingestion.default_worker_count()
+        try:
+            page_range = self._claim_next_range()
+            if page_range is None:
+                return
+            # spawn avoids forking the multi-threaded Streamlit server; each worker parses the PDF once
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                     initializer=_open_in_worker, initargs=(self._data,)) as pool:
+                running = {pool.submit(_extract_range, *page_range): page_range}
+                while True:
+                    # Only a few ranges are queued at a time, so newly wanted pages do not wait behind the rest
+                    while len(running) < workers:
+                        page_range = self._claim_next_range()
+                        if page_range is None:
+                            break
+                        running[pool.submit(_extract_range, *page_range)] = page_range
+                    if not running:
+                        break
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        first, _ = running.pop(future)
+                        texts = future.result()
+                        with self._state:
+                            for page_number, text in enumerate(texts, first):
+                                self._pages.setdefault(page_number, text)
+                            self._state.notify_all()
+        except Exception as e:
+            with self._state:
+                self.error = str(e) or type(e).__name__
+        finally:
+            with self._state:
+                self._worker = None
+                self._state.notify_all()
+
+    def wait_for_pages(self, page_numbers: Iterable[int], timeout: Optional[float] = None) -> bool:
+        """Block until these pages are extracted (or extraction failed); False on timeout or failure"""
+        page_numbers = list(page_numbers)
+        with self._state:
+            self._state.wait_for(lambda: all(number in self._pages for number in page_numbers) or self.error, timeout)
+            return all(number in self._pages for number in page_numbers)
+
+
+_open_documents: "OrderedDict[str, PdfDocument]" = OrderedDict()
+_open_lock = threading.Lock()
+
+
+def open_pdf(data: bytes, key: Optional[str] = None) -> PdfDocument:
+    """A PdfDocument for these bytes, shared with anyone who recently opened the same file"""
+    key = key or hashlib.sha256(data).hexdigest()
+    with _open_lock:
+        document = _open_documents.get(key)
+        if document is None:
+            document = _open_documents[key] = PdfDocument(data)
+            while len(_open_documents) > OPEN_DOCUMENTS:
+                # An evicted document still finishes any background extraction its holders started
+                _open_documents.popitem(last=False)
+        else:
+            _open_documents.move_to_end(key)
+        return document
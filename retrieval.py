@@ -0,0 +1,317 @@
+"""Chunk-level retrieval indexes used to find context for chat and explanations"""
+import math
+import re
+import heapq
+import zlib
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+# Chunks are embedded this many at a time so ingestion is vectorized
+EMBED_BATCH_SIZE = 256
+# Rank constant for reciprocal rank fusion of keyword and vector results
+RRF_K = 60
+# Indexes are rebuilt from their live chunks once this share of chunks has been removed
+COMPACT_REMOVED_FRACTION = 0.3
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+# Very common words carry no retrieval signal and have huge postings lists
+STOPWORDS = frozenset("""
+a an and are as at be been but by can do does for from had has have how i if in into is it its
+me my no not of on or our so such than that the their them then there these they this to was
+we were what when where which who why will with you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens with stopwords removed"""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """Inverted index over text chunks scored with Okapi BM25"""
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.chunk_lengths: List[int] = []
+        self.total_length = 0
+        # Removed chunks keep their postings but never appear in results
+        self.removed = set()
+        # Live chunks containing each term (postings still list removed ones)
+        self.document_frequency: Counter = Counter()
+
+    def __len__(self) -> int:
+        return len(self.chunk_lengths) - len(self.removed)
+
+    def add_chunks(self, chunks: List[str]):
+        """Tokenize and index chunks, assigning them the next sequential ids"""
+        for chunk in chunks:
+            chunk_id = len(self.chunk_lengths)
+            term_counts = Counter(tokenize(chunk))
+            for term, count in term_counts.items():
+                self.postings[term].append((chunk_id, count))
+            self.document_frequency.update(term_counts.keys())
+            length = sum(term_counts.values())
+            self.chunk_lengths.append(length)
+            self.total_length += length
+
+    def remove_chunks(self, chunk_ids: List[int], chunks: List[str]):
+        """Exclude chunks (given with their texts) from results and statistics without touching any postings"""
+        for chunk_id, chunk in zip(chunk_ids, chunks):
+            if chunk_id not in self.removed:
+                self.removed.add(chunk_id)
+                self.total_length -= self.chunk_lengths[chunk_id]
+                self.document_frequency.subtract(set(tokenize(chunk)))
+
+    def search(self, query: str, top_k: int = 3) -> List[Tuple[float, int]]:
+        """Return up to top_k (score, chunk_id) pairs, best first.
+
+        Only the postings of the query terms are visited, so the cost grows
+        with how common the terms are rather than with corpus size.
+        """
+        chunk_count = len(self)
+        if not chunk_count:
+            return []
+        average_length = self.total_length / chunk_count or 1.0
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            document_frequency = self.document_frequency[term]
+            if not postings or document_frequency <= 0:
+                continue
+            idf = math.log(1 + (chunk_count - document_frequency + 0.5) / (document_frequency + 0.5))
+            for chunk_id, term_frequency in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.chunk_lengths[chunk_id] / average_length)
+                scores[chunk_id] += idf * term_frequency * (self.k1 + 1) / (term_frequency + norm)
+        for chunk_id in self.removed:
+            scores.pop(chunk_id, None)
+        return heapq.nlargest(top_k, ((score, chunk_id) for chunk_id, score in scores.items()))
+
+
+class HashingEmbedder:
+    """Fully offline embedder: signed feature hashing of words and word bigrams"""
+    # Vectors only encode the query's words, so a match that shares no word with it is a hash collision
+    lexical = True
+
+    def __init__(self, dim: int = 512):
+        self.name = f"hashing-{dim}"
+        self.dim = dim
+        self._features: Dict[str, Tuple[int, float]] = {}
+
+    def _feature(self, feature: str) -> Tuple[int, float]:
+        cached = self._features.get(feature)
+        if cached is None:
+            # crc32 is stable across processes, unlike hash()
+            digest = zlib.crc32(feature.encode('utf-8'))
+            cached = (digest % self.dim, 1.0 if digest & 0x80000000 else -1.0)
+            if len(self._features) < 500_000:
+                self._features[feature] = cached
+        return cached
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Embed a batch of texts into L2-normalised float32 rows"""
+        rows, cols, signs = [], [], []
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            for feature in features:
+                col, sign = self._feature(feature)
+                rows.append(row)
+                cols.append(col)
+                signs.append(sign)
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(matrix, (np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)),
+                  np.array(signs, dtype=np.float32))
+        # Sublinear term frequency keeps long chunks from dominating
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self.embed([text])
+
+
+class GeminiEmbedder:
+    """Embedder backed by the Gemini embedding API (needs network and a configured key)"""
+    lexical = False
+
+    def __init__(self, model: str = "models/text-embedding-004", dim: int = 768):
+        self.name = model
+        self.model = model
+        self.dim = dim
+
+    def _embed(self, texts: List[str], task_type: str) -> np.ndarray:
+        import google.generativeai as genai
+        result = genai.embed_content(model=self.model, content=texts, task_type=task_type)
+        matrix = np.asarray(result['embedding'], dtype=np.float32).reshape(len(texts), -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return self._embed(texts, "retrieval_document")
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self._embed([text], "retrieval_query")
+
+
+def make_embedder(name: str):
+    """Build an embedder from its configured name ('hashing' or 'gemini')"""
+    if name == "gemini":
+        return GeminiEmbedder()
+    return HashingEmbedder()
+
+
+def embed_texts(embedder, texts: List[str]) -> np.ndarray:
+    """Embed texts in batches of EMBED_BATCH_SIZE and stack the results"""
+    if not texts:
+        return np.zeros((0, embedder.dim), dtype=np.float32)
+    return np.vstack([
+        embedder.embed(texts[start:start + EMBED_BATCH_SIZE])
+        for start in range(0, len(texts), EMBED_BATCH_SIZE)
+    ]).astype(np.float32, copy=False)
+
+
+def distinct_mask(texts: List[str], threshold: float = 0.85) -> List[bool]:
+    """Flag texts to keep, dropping any whose hashed embedding is a near-duplicate of an earlier one"""
+    if not texts:
+        return []
+    vectors = HashingEmbedder().embed(texts)
+    keep = [False] * len(texts)
+    kept_rows: List[int] = []
+    for row in range(len(texts)):
+        if not np.any(vectors[row]):
+            keep[row] = True
+            continue
+        if kept_rows and float(np.max(vectors[kept_rows] @ vectors[row])) >= threshold:
+            continue
+        keep[row] = True
+        kept_rows.append(row)
+    return keep
+
+
+class VectorIndex:
+    """Exact inner-product FAISS index over normalised chunk embeddings"""
+    def __init__(self, embedder):
+        import faiss
+        self.embedder = embedder
+        self.index = faiss.IndexFlatIP(embedder.dim)
+
+    def __len__(self) -> int:
+        return self.index.ntotal
+
+    def add_chunks(self, chunks: List[str], vectors: Optional[np.ndarray] = None):
+        """Append chunks with the next sequential ids, embedding them unless vectors are given"""
+        if vectors is None:
+            vectors = embed_texts(self.embedder, chunks)
+        if len(vectors):
+            self.index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+
+    def search(self, query: str, top_k: int = 3) -> List[Tuple[float, int]]:
+        """Return up to top_k (cosine similarity, chunk_id) pairs, nearest first"""
+        if self.index.ntotal == 0:
+            return []
+        query_vector = np.ascontiguousarray(self.embedder.embed_query(query), dtype=np.float32)
+        scores, ids = self.index.search(query_vector, min(top_k, self.index.ntotal))
+        return [(float(score), int(chunk_id)) for score, chunk_id in zip(scores[0], ids[0]) if chunk_id != -1]
+
+
+def _relative_cut(results: List[Tuple[float, int]], min_relative_score: float) -> List[Tuple[float, int]]:
+    # results are best first
+    if not results or min_relative_score <= 0:
+        return results
+    floor = results[0][0] * min_relative_score
+    return [result for result in results if result[0] >= floor]
+
+
+class Retriever:
+    """Chunk store with keyword (BM25) and dense (FAISS) indexes fused by rank"""
+    def __init__(self, embedder=None, min_similarity: float = 0.0):
+        self.chunk_texts: List[str] = []
+        self.chunk_docs: List[int] = []
+        # (start, end, page) of each chunk within its document, when known
+        self.chunk_spans: List[Tuple[int, int, Optional[int]]] = []
+        self.keyword_index = BM25Index()
+        self.embedder = embedder
+        self.vector_index = VectorIndex(embedder) if embedder is not None else None
+        self.min_similarity = min_similarity
+        # Chunks of removed documents stay in the indexes (with chunk_docs -1) until compact()
+        self.removed_count = 0
+
+    def __len__(self) -> int:
+        return len(self.chunk_texts) - self.removed_count
+
+    def add_document(self, doc_id: int, chunks: List[str], vectors: Optional[np.ndarray] = None,
+                     spans: Optional[List[Tuple[int, int, Optional[int]]]] = None):
+        """Index every chunk of one document in both indexes, reusing precomputed vectors if given"""
+        self.chunk_texts.extend(chunks)
+        self.chunk_docs.extend([doc_id] * len(chunks))
+        self.chunk_spans.extend(spans if spans is not None else [(-1, -1, None)] * len(chunks))
+        self.keyword_index.add_chunks(chunks)
+        if self.vector_index is not None:
+            self.vector_index.add_chunks(chunks, vectors)
+
+    def set_document_spans(self, doc_id: int, spans: List[Tuple[int, int, Optional[int]]]):
+        """Move a document's chunks to new (start, end, page) spans, given in the order of their current offsets"""
+        chunk_ids = sorted((chunk_id for chunk_id, owner in enumerate(self.chunk_docs) if owner == doc_id),
+                           key=lambda chunk_id: self.chunk_spans[chunk_id][0])
+        for chunk_id, span in zip(chunk_ids, spans):
+            self.chunk_spans[chunk_id] = span
+
+    def remove_document(self, doc_id: int):
+        """Drop a document's chunks from results and shift later doc ids down by one.
+
+        Removal is a tombstone, so it costs no re-embedding; the indexes are
+        rebuilt from live chunks once removed ones pass COMPACT_REMOVED_FRACTION.
+        """
+        removed = [chunk_id for chunk_id, owner in enumerate(self.chunk_docs) if owner == doc_id]
+        self.keyword_index.remove_chunks(removed, [self.chunk_texts[chunk_id] for chunk_id in removed])
+        for chunk_id in removed:
+            self.chunk_texts[chunk_id] = ""
+        self.chunk_docs = [owner - 1 if owner > doc_id else (-1 if owner == doc_id else owner)
+                           for owner in self.chunk_docs]
+        self.removed_count += len(removed)
+        if self.removed_count > COMPACT_REMOVED_FRACTION * len(self.chunk_docs):
+            self.compact()
+
+    def compact(self):
+        """Rebuild both indexes from the live chunks, reusing their stored vectors"""
+        live = [chunk_id for chunk_id, owner in enumerate(self.chunk_docs) if owner >= 0]
+        vectors = None
+        if self.vector_index is not None and self.vector_index.index.ntotal:
+            vectors = self.vector_index.index.reconstruct_n(0, self.vector_index.index.ntotal)[live]
+        texts = [self.chunk_texts[chunk_id] for chunk_id in live]
+        docs = [self.chunk_docs[chunk_id] for chunk_id in live]
+        spans = [self.chunk_spans[chunk_id] for chunk_id in live]
+        self.chunk_texts, self.chunk_docs, self.chunk_spans = texts, docs, spans
+        self.removed_count = 0
+        self.keyword_index = BM25Index(self.keyword_index.k1, self.keyword_index.b)
+        self.keyword_index.add_chunks(texts)
+        if self.vector_index is not None:
+            self.vector_index = VectorIndex(self.embedder)
+            self.vector_index.add_chunks(texts, vectors)
+
+    def search(self, query: str, top_k: int = 3, min_relative_score: float = 0.0) -> List[Tuple[float, int]]:
+        """Return up to top_k (fused score, chunk_id) pairs using reciprocal rank fusion.
+
+        Chunks scoring below min_relative_score times the best BM25 / cosine
+        score of their own ranking are left out before fusing, since fused
+        ranks no longer say how much worse a match is. With a lexical embedder,
+        vector matches only count when BM25 matched the query too.
+        """
+        candidates = max(top_k * 4, 10)
+        keyword_results = _relative_cut(self.keyword_index.search(query, candidates), min_relative_score)
+        result_lists = [keyword_results]
+        if self.vector_index is not None and (keyword_results or not self.embedder.lexical):
+            # Over-fetch by the number of removed chunks, which may still be returned
+            result_lists.append(_relative_cut([
+                (score, chunk_id)
+                for score, chunk_id in self.vector_index.search(query, candidates + self.removed_count)
+                if score > self.min_similarity and self.chunk_docs[chunk_id] >= 0
+            ][:candidates], min_relative_score))
+        fused: Dict[int, float] = defaultdict(float)
+        for results in result_lists:
+            for rank, (_, chunk_id) in enumerate(results):
+                fused[chunk_id] += 1.0 / (RRF_K + rank + 1)
+        return heapq.nlargest(top_k, ((score, chunk_id) for chunk_id, score in fused.items()))
@@ -0,0 +1,1495 @@
+"""Streamlit-free study assistant core: extraction caches, retrieval-backed prompts and generation"""
+import os
+import hashlib
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from collections import Counter, OrderedDict, deque
+from typing import Callable, List, Dict, Iterator, Optional, Set, Tuple
+import ingestion
+import retrieval
+import corpus_store
+import llm_client
+import chunking
+import metrics
+import context_packer
+import chat_memory
+import topic_map
+import coalescing
+import pdf_pages
+from corpus_memory import CorpusMemory, DocumentRef, default_corpus_memory
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = 'gemini-2.5-flash'
+
+# Bump whenever extraction output changes so stale cache entries are ignored
+EXTRACTOR_VERSION = "2"
+EXTRACTION_CACHE_MAX_ENTRIES = 64
+EXTRACTION_CACHE_MAX_CHARS = 50_000_000
+# Optional on-disk tier shared across sessions and restarts (disabled when empty)
+EXTRACTION_CACHE_DIR = os.environ.get("STUDY_ASSISTANT_CACHE_DIR", "")
+RESPONSE_CACHE_MAX_ENTRIES = 512
+RESPONSE_CACHE_TTL_SECONDS = 24 * 60 * 60
+RESPONSE_CACHE_DIR = os.path.join(EXTRACTION_CACHE_DIR, "responses") if EXTRACTION_CACHE_DIR else ""
+# Recent per-call latency records kept per session
+GENERATION_TIMINGS_KEPT = 100
+
+# Persistent document/chunk/embedding store shared across sessions; opt-in (disabled when empty)
+CORPUS_DB_PATH = os.environ.get("STUDY_ASSISTANT_CORPUS_DB", "")
+# Retrieval chunks are sized in estimated tokens and overlap by whole sentences
+CHUNK_TOKENS = 250
+CHUNK_OVERLAP_TOKENS = 50
+# Stored chunk lists are only reused when the chunker settings match
+CHUNKER_SIGNATURE = f"tokens-{CHUNK_TOKENS}-{CHUNK_OVERLAP_TOKENS}"
+# Per-document keyphrase tables depend on the chunks they index
+TOPIC_SIGNATURE = f"phrases-{CHUNKER_SIGNATURE}-v1"
+CHUNK_HASH_SIGNATURE = f"hashes-{CHUNKER_SIGNATURE}"
+# Chunks of a matched topic put ahead of search results in explanation context
+TOPIC_CONTEXT_CHUNKS = 6
+
+# PDFs with more pages than this become searchable from their first pages while
+# the rest is extracted in the background; the index catches up in steps
+PROGRESSIVE_PDF_PAGES = 150
+PROGRESSIVE_REFRESH_PAGES = 100
+# How long a question naming pages not extracted yet ("page 212") waits for them
+PROGRESSIVE_QUERY_WAIT_SECONDS = 10
+
+# Estimated tokens of retrieved passages packed into chat / explanation prompts
+CONTEXT_BUDGET_TOKENS = int(os.environ.get("STUDY_ASSISTANT_CONTEXT_TOKENS", "2000"))
+# Ranked chunks considered for packing, and the share of the best keyword / vector score
+# a chunk needs in that ranking to be considered at all
+CONTEXT_CANDIDATES = 24
+CONTEXT_MIN_RELATIVE_SCORE = 0.3
+# "hashing" works fully offline; "gemini" uses the Gemini embedding API
+EMBEDDER = os.environ.get("STUDY_ASSISTANT_EMBEDDER", "hashing")
+# Vector matches below this cosine similarity are ignored. With the hashing embedder, short
+# unrelated questions still reach ~0.17 through hash collisions, so the retriever also drops
+# its vector matches when no keyword matched; dense API embeddings need a higher value here.
+MIN_VECTOR_SIMILARITY = float(os.environ.get("STUDY_ASSISTANT_MIN_SIMILARITY", "0.1"))
+
+# Concurrent model calls for map-reduce summaries and batch question generation
+LLM_WORKERS = 4
+# Documents longer than this are summarized map-reduce style instead of truncated
+SUMMARY_SINGLE_PASS_CHARS = 5000
+SUMMARY_CHUNK_TOKENS = 3000
+# Combined partial summaries are reduced in groups until they fit this budget
+SUMMARY_REDUCE_CHARS = 20000
+# Bump when the map prompt changes so stored partial summaries are regenerated
+SUMMARY_MAP_VERSION = "1"
+
+# Whole-corpus question generation: questions requested per model call and
+# the context each call sees
+QUESTIONS_PER_BATCH = 10
+QUESTION_CONTEXT_TOKENS = 600
+CHUNKS_PER_QUESTION_BATCH = max(1, QUESTION_CONTEXT_TOKENS // CHUNK_TOKENS)
+# Over-generate to make up for near-duplicates removed afterwards
+QUESTION_OVERGENERATION = 1.25
+QUESTION_DUPLICATE_SIMILARITY = 0.85
+QUESTION_DIFFICULTIES = ("Easy", "Medium", "Hard")
+# Generation rounds spent filling a question request the bank cannot serve
+# (more than one when the model ignores part of a type/difficulty filter)
+QUESTION_FILL_ROUNDS = 3
+QUESTION_TYPE_INSTRUCTIONS = {
+    "Multiple Choice": "Focus on multiple choice questions with 4 options.",
+    "Short Answer": "Focus on short answer questions (2-3 sentences).",
+    "Problem Solving": "Focus on problem-solving questions with step-by-step solutions."
+}
+QUESTION_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "question": {"type": "string"},
+            "type": {"type": "string"},
+            "difficulty": {"type": "string", "enum": ["Easy", "Medium", "Hard"]},
+            "topic": {"type": "string"},
+            "options": {"type": "array", "items": {"type": "string"}},
+            "answer": {"type": "string"}
+        },
+        "required": ["question", "type", "difficulty", "topic", "answer"]
+    }
+}
+
+class ExtractionCache:
+    """Content-addressed cache of extracted text with an in-memory LRU and optional disk tier.
+
+    The in-memory tier holds references into corpus memory rather than its own
+    copies, so a cached text is the one copy sessions share (memory-mapped when large).
+    """
+    def __init__(self, max_entries: int = EXTRACTION_CACHE_MAX_ENTRIES,
+                 max_chars: int = EXTRACTION_CACHE_MAX_CHARS, cache_dir: Optional[str] = None,
+                 corpus_memory: Optional[CorpusMemory] = None):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.cache_dir = cache_dir or None
+        self.corpus_memory = corpus_memory if corpus_memory is not None else default_corpus_memory()
+        self._entries: "OrderedDict[str, DocumentRef]" = OrderedDict()
+        self._total_chars = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+    
+    @staticmethod
+    def make_key(data: bytes, file_extension: str) -> str:
+        """Build a cache key from the upload bytes, file type and extractor version"""
+        digest = hashlib.sha256(data).hexdigest()
+        return f"v{EXTRACTOR_VERSION}-{file_extension}-{digest}"
+    
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.txt")
+    
+    def get(self, key: str) -> Optional[str]:
+        """Return cached text for key, promoting disk hits into memory"""
+        with self._lock:
+            ref = self._entries.get(key)
+            if ref is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if ref is not None:
+            return ref.text
+        
+        if self.cache_dir:
+            try:
+                with open(self._disk_path(key), 'r', encoding='utf-8') as file:
+                    text = file.read()
+            except OSError:
+                text = None
+            if text is not None:
+                self._remember(key, text)
+                with self._lock:
+                    self.hits += 1
+                return text
+        
+        with self._lock:
+            self.misses += 1
+        return None
+    
+    def put(self, key: str, text: str, doc_hash: Optional[str] = None):
+        """Store extracted text in memory and, if configured, on disk; doc_hash saves hashing a known text again"""
+        if not text:
+            return
+        self._remember(key, text, doc_hash)
+        if self.cache_dir:
+            path = self._disk_path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as file:
+                    file.write(text)
+                os.replace(tmp_path, path)
+            except OSError:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+    
+    def _remember(self, key: str, text: str, doc_hash: Optional[str] = None):
+        if len(text) > self.max_chars:
+            return
+        ref = self.corpus_memory.acquire(text, doc_hash)
+        released = []
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._total_chars -= previous.chars
+                released.append(previous)
+            self._entries[key] = ref
+            self._total_chars += ref.chars
+            while len(self._entries) > self.max_entries or self._total_chars > self.max_chars:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_chars -= evicted.chars
+                released.append(evicted)
+        # Evicted texts stay in corpus memory while any session still uses them
+        for evicted in released:
+            evicted.release()
+
+class ResponseCache:
+    """LRU + TTL cache of model responses with an optional on-disk tier shared across sessions"""
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS, cache_dir: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.cache_dir = cache_dir or None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+    
+    @staticmethod
+    def make_key(model_name: str, prompt: str, params: Optional[Dict] = None) -> str:
+        """Key on the model, the whitespace-normalised prompt and the generation parameters"""
+        normalized_prompt = " ".join(prompt.split())
+        payload = json.dumps([model_name, normalized_prompt, params or {}], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+    
+    def _expired(self, created_at: float) -> bool:
+        return time.time() - created_at > self.ttl_seconds
+    
+    def get(self, key: str) -> Optional[str]:
+        """Return a fresh cached response, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created_at, text = entry
+                if not self._expired(created_at):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return text
+                del self._entries[key]
+        
+        if self.cache_dir:
+            try:
+                with open(self._disk_path(key), 'r', encoding='utf-8') as file:
+                    entry = json.load(file)
+                created_at, text = entry['created_at'], entry['text']
+            except (OSError, ValueError, KeyError):
+                created_at, text = 0.0, None
+            if text is not None and not self._expired(created_at):
+                self._remember(key, created_at, text)
+                with self._lock:
+                    self.hits += 1
+                return text
+        
+        with self._lock:
+            self.misses += 1
+        return None
+    
+    def put(self, key: str, text: str):
+        """Cache a response in memory and, if configured, on disk"""
+        created_at = time.time()
+        self._remember(key, created_at, text)
+        if self.cache_dir:
+            path = self._disk_path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as file:
+                    json.dump({'created_at': created_at, 'text': text}, file)
+                os.replace(tmp_path, path)
+            except OSError:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+    
+    def _remember(self, key: str, created_at: float, text: str):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (created_at, text)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+class StudyAssistant:
+    def __init__(self, api_key: str, extraction_cache: Optional[ExtractionCache] = None,
+                 corpus_store: Optional[corpus_store.CorpusStore] = None,
+                 response_cache: Optional[ResponseCache] = None,
+                 client: Optional[llm_client.ModelClient] = None,
+                 rate_limiter: Optional[llm_client.RateLimiter] = None,
+                 on_error: Optional[Callable[[str], None]] = None,
+                 process_metrics: Optional[metrics.Metrics] = None,
+                 corpus_memory: Optional[CorpusMemory] = None,
+                 single_flight: Optional[coalescing.SingleFlight] = None,
+                 micro_batcher: Optional[coalescing.MicroBatcher] = None):
+        """Initialize the Study Assistant with Gemini API.
+
+        on_error receives user-facing error messages (the Streamlit app shows
+        them with st.error); by default they are logged. Stage timings and
+        counters go to self.metrics and, when given, also to process_metrics.
+        Document texts are held as references into corpus_memory (by default
+        the process-wide one), so sessions with the same notes share one copy.
+        Identical prompts already in flight in any session are shared through
+        single_flight; micro_batcher, when given, packs small prompts together.
+        """
+        self.api_key = api_key
+        if client is None:
+            backend = llm_client.make_backend(llm_client.LLM_BACKEND, MODEL_NAME, api_key)
+            client = llm_client.ModelClient(backend, rate_limiter, max_workers=LLM_WORKERS)
+        self.client = client
+        self.on_error = on_error or logger.error
+        self.corpus_memory = corpus_memory if corpus_memory is not None else default_corpus_memory()
+        self.documents = []
+        self.document_refs: List[DocumentRef] = []
+        self._documents_version = 0
+        self._indexed_version = None
+        self.extraction_cache = extraction_cache or ExtractionCache(corpus_memory=self.corpus_memory)
+        self.corpus_store = corpus_store
+        self.response_cache = response_cache or ResponseCache()
+        self.single_flight = single_flight if single_flight is not None else coalescing.default_single_flight()
+        self.micro_batcher = micro_batcher
+        self.generation_timings = deque(maxlen=GENERATION_TIMINGS_KEPT)
+        self.metrics = metrics.Metrics(parent=process_metrics)
+        self.embedder = retrieval.make_embedder(EMBEDDER)
+        self.retriever = retrieval.Retriever(self.embedder, MIN_VECTOR_SIMILARITY)
+        self.chat_memory = chat_memory.ChatMemory(self._summarize_conversation)
+        self._topic_map = None
+        self._topic_map_version = None
+        # Partial text hash of each PDF still being extracted -> (cache key, document, chunked ranges);
+        # chunked ranges maps the first page of each page range chunked so far to its chunks, in chunking order
+        self._pending_pdfs: Dict[str, tuple] = {}
+        # Background jobs read the loaded documents and indexes while the session changes them
+        self._documents_lock = threading.RLock()
+        # Hashes of documents background work is reading -> readers; these cannot be removed
+        self._documents_in_use: Counter = Counter()
+    
+    @property
+    def owner(self) -> str:
+        """Owner of the documents this assistant saves: saved documents are private to whoever holds the API key"""
+        return corpus_store.owner_key(self.api_key)
+    
+    @property
+    def document_texts(self) -> List[str]:
+        """Texts of the loaded documents, read from the shared corpus memory"""
+        return [ref.text for ref in self.document_refs]
+    
+    @document_texts.setter
+    def document_texts(self, texts: List[str]):
+        with self._documents_lock:
+            previous = self.document_refs
+            self.document_refs = [self.corpus_memory.acquire(text) for text in texts]
+            self._documents_version += 1
+        for ref in previous:
+            ref.release()
+    
+    def extract_text_from_pdf(self, file_path: str) -> str:
+        """Extract text from PDF file"""
+        import PyPDF2
+        try:
+            with open(file_path, 'rb') as file:
+                pdf_reader = PyPDF2.PdfReader(file)
+                pages = [page.extract_text() or "" for page in pdf_reader.pages]
+        except Exception as e:
+            self.on_error(f"Failed to extract text from PDF: {str(e)}")
+            return ""
+        return ingestion.join_pages(pages)
+    
+    def extract_text_from_docx(self, file_path: str) -> str:
+        """Extract text from DOCX file"""
+        import docx
+        try:
+            doc = docx.Document(file_path)
+            return "\n".join([paragraph.text for paragraph in doc.paragraphs])
+        except Exception as e:
+            self.on_error(f"Failed to extract text from DOCX: {str(e)}")
+            return ""
+    
+    def extract_text_from_txt(self, file_path: str) -> str:
+        """Extract text from TXT file"""
+        try:
+            with open(file_path, 'r', encoding='utf-8') as file:
+                return file.read()
+        except Exception as e:
+            self.on_error(f"Failed to read TXT file: {str(e)}")
+            return ""
+    
+    def _cached_text(self, cache_key: str) -> Optional[str]:
+        """Look up previously extracted text in memory, then in the persistent store"""
+        text = self.extraction_cache.get(cache_key)
+        if text is None and self.corpus_store is not None:
+            text = self.corpus_store.find_upload(cache_key)
+            if text is not None:
+                self.extraction_cache.put(cache_key, text)
+        return text
+    
+    def _remember_text(self, cache_key: str, name: str, text: str, doc_hash: Optional[str] = None):
+        self.extraction_cache.put(cache_key, text, doc_hash)
+        if self.corpus_store is not None and text:
+            self.corpus_store.put_document(name, text, cache_key, self.owner)
+    
+    def process_uploaded_file(self, uploaded_file) -> str:
+        """Process uploaded file and extract text"""
+        file_extension = uploaded_file.name.split('.')[-1].lower()
+        data = uploaded_file.getvalue()
+        
+        # Reruns and repeat uploads of identical bytes cost a hash, not a parse
+        cache_key = self.extraction_cache.make_key(data, file_extension)
+        cached_text = self._cached_text(cache_key)
+        if cached_text is not None:
+            self.metrics.increment('extraction_cache_hits')
+            return cached_text
+        
+        if file_extension not in ingestion.SUPPORTED_EXTENSIONS:
+            self.on_error(f"Unsupported file type: {file_extension}")
+            return ""
+        
+        try:
+            with self.metrics.timed('extraction'):
+                text = "".join(ingestion.iter_text(data, file_extension))
+        except Exception as e:
+            self.on_error(f"Failed to extract text from {uploaded_file.name}: {str(e)}")
+            return ""
+        self._remember_text(cache_key, uploaded_file.name, text)
+        return text
+    
+    def process_uploaded_files(self, uploaded_files, max_workers: Optional[int] = None,
+                               progress_callback=None) -> List[str]:
+        """Process several uploads in parallel, returning texts in upload order"""
+        texts = [""] * len(uploaded_files)
+        pending = []
+        for i, uploaded_file in enumerate(uploaded_files):
+            file_extension = uploaded_file.name.split('.')[-1].lower()
+            data = uploaded_file.getvalue()
+            cache_key = self.extraction_cache.make_key(data, file_extension)
+            cached_text = self._cached_text(cache_key)
+            if cached_text is not None:
+                self.metrics.increment('extraction_cache_hits')
+                texts[i] = cached_text
+                if progress_callback:
+                    progress_callback(i, 1.0)
+            else:
+                pending.append((i, cache_key, data, file_extension))
+        
+        if not pending:
+            return texts
+        
+        def on_progress(pending_index: int, file_fraction: float, overall_fraction: float):
+            if progress_callback:
+                progress_callback(pending[pending_index][0], file_fraction)
+        
+        with self.metrics.timed('extraction'):
+            results = ingestion.extract_files_parallel(
+                [(data, file_extension) for _, _, data, file_extension in pending],
+                max_workers=max_workers,
+                progress_callback=on_progress
+            )
+        for (i, cache_key, _, _), (text, error) in zip(pending, results):
+            if error:
+                self.on_error(f"Failed to extract text from {uploaded_files[i].name}: {error}")
+                continue
+            self._remember_text(cache_key, uploaded_files[i].name, text)
+            texts[i] = text
+        return texts
+    
+    def should_extract_progressively(self, uploaded_file) -> bool:
+        """True for long PDFs not extracted before, which are better indexed as their pages arrive"""
+        if not uploaded_file.name.lower().endswith('.pdf'):
+            return False
+        data = uploaded_file.getvalue()
+        cache_key = self.extraction_cache.make_key(data, 'pdf')
+        if self._cached_text(cache_key) is not None:
+            return False
+        try:
+            return pdf_pages.open_pdf(data, cache_key).page_count > PROGRESSIVE_PDF_PAGES
+        except Exception:
+            # Let the regular extraction path report unreadable files
+            return False
+    
+    def add_pdf_progressively(self, name: str, data: bytes) -> bool:
+        """Load a long PDF searchable from its first pages; the rest is extracted in the background.
+
+        Call refresh_pending_documents() to index pages extracted since; the
+        finished text is cached and stored like any other extraction.
+        """
+        cache_key = self.extraction_cache.make_key(data, 'pdf')
+        if any(pending[0] == cache_key for pending in self._pending_pdfs.values()):
+            # Already loaded and still being extracted
+            return False
+        try:
+            pdf = pdf_pages.open_pdf(data, cache_key)
+            with self.metrics.timed('extraction'):
+                for _ in pdf.iter_pages(*pdf.page_range(1)):
+                    pass
+        except Exception as e:
+            self.on_error(f"Failed to extract text from {name}: {str(e)}")
+            return False
+        chunked = {}
+        self._chunk_new_ranges(pdf, chunked)
+        ref, _ = self._progressive_ref(pdf, chunked, name, complete=False)
+        self._pending_pdfs[ref.doc_hash] = (cache_key, pdf, chunked)
+        added = self.add_documents([name], [ref.text])
+        ref.release()
+        if not added:
+            del self._pending_pdfs[ref.doc_hash]
+            return False
+        pdf.prefetch()
+        if pdf.complete:
+            self.refresh_pending_documents()
+        return True
+    
+    def _chunk_new_ranges(self, pdf: pdf_pages.PdfDocument, chunked: Dict[int, List[chunking.Chunk]]) -> Set[int]:
+        """Chunk the page ranges extracted in full since the last call, adding them to chunked; returns their first pages"""
+        new_ranges = set()
+        for first, last in pdf.extracted_ranges():
+            if first in chunked:
+                continue
+            # Offsets are relative to the range; _progressive_ref places them in the document
+            segments = [(page_number, ingestion.page_piece(page_number, pdf.page(page_number)))
+                        for page_number in range(first, last + 1)]
+            with self.metrics.timed('chunking'):
+                chunked[first] = list(chunking.chunk_stream(segments, 0, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS))
+            new_ranges.add(first)
+        return new_ranges
+    
+    def _progressive_ref(self, pdf: pdf_pages.PdfDocument, chunked: Dict[int, List[chunking.Chunk]], name: str,
+                         complete: bool) -> Tuple[DocumentRef, List[chunking.Chunk]]:
+        """A reference to the text of the chunked ranges (other pages empty), with their chunks attached.
+
+        Chunks never cross a range boundary, so the ranges chunked earlier are
+        only moved to their offsets in the new text, never chunked again.
+        """
+        pieces = []
+        range_offsets = {}
+        offset = 0
+        last_page = max((pdf.page_range(first)[1] for first in chunked), default=0)
+        for page_number in range(1, last_page + 1):
+            first = pdf.page_range(page_number)[0]
+            if page_number == first:
+                range_offsets[first] = offset
+            piece = ingestion.page_piece(page_number, pdf.page(page_number) if first in chunked else "")
+            pieces.append(piece)
+            offset += len(piece)
+        text = "".join(pieces)
+        chunks = [
+            chunk._replace(start=chunk.start + range_offsets[first], end=chunk.end + range_offsets[first])
+            for first, range_chunks in sorted(chunked.items()) for chunk in range_chunks
+        ]
+        ref = self.corpus_memory.acquire(text)
+        self.corpus_memory.derived(
+            ref.doc_hash, CHUNKER_SIGNATURE, lambda: self._document_chunks(0, text, complete, name, chunks)
+        )
+        return ref, chunks
+    
+    def pending_documents(self) -> List[tuple]:
+        """(name, pages extracted, page count) of each loaded PDF still being extracted"""
+        pending = []
+        for doc_id, ref in enumerate(self.document_refs):
+            if ref.doc_hash in self._pending_pdfs:
+                pdf = self._pending_pdfs[ref.doc_hash][1]
+                pending.append((self.documents[doc_id], pdf.extracted_pages, pdf.page_count))
+        return pending
+    
+    def refresh_pending_documents(self, min_new_pages: int = PROGRESSIVE_REFRESH_PAGES) -> List[str]:
+        """Index the page ranges of PDFs still being extracted once min_new_pages pages are ready; returns the names now complete"""
+        finished = []
+        with self._documents_lock:
+            for partial_hash, (cache_key, pdf, chunked) in list(self._pending_pdfs.items()):
+                doc_id = next((i for i, ref in enumerate(self.document_refs) if ref.doc_hash == partial_hash), None)
+                if doc_id is None:
+                    # Removed while it was being extracted
+                    del self._pending_pdfs[partial_hash]
+                    continue
+                if pdf.error:
+                    del self._pending_pdfs[partial_hash]
+                    self.on_error(f"Failed to extract text from {self.documents[doc_id]}: {pdf.error}")
+                    continue
+                complete = pdf.complete
+                new_pages = sum(last - first + 1 for first, last in pdf.extracted_ranges() if first not in chunked)
+                if not new_pages or (not complete and new_pages < min_new_pages):
+                    continue
+                name = self.documents[doc_id]
+                # Only the new ranges are chunked, embedded and indexed
+                new_ranges = self._chunk_new_ranges(pdf, chunked)
+                del self._pending_pdfs[partial_hash]
+                ref, chunks = self._progressive_ref(pdf, chunked, name, complete)
+                if complete:
+                    self._remember_text(cache_key, name, ref.text, ref.doc_hash)
+                    finished.append(name)
+                else:
+                    self._pending_pdfs[ref.doc_hash] = (cache_key, pdf, chunked)
+                self._extend_document(doc_id, ref, chunks, lambda chunk: pdf.page_range(chunk.page)[0] in new_ranges)
+        return finished
+    
+    def _extend_document(self, doc_id: int, ref: DocumentRef, chunks: List[chunking.Chunk],
+                         is_new: Callable[[chunking.Chunk], bool]):
+        """Swap in a longer version of a document (its chunks: the indexed ones plus new ones), indexing only the new"""
+        with self._documents_lock:
+            index_is_current = self._indexed_version == self._documents_version
+            self.document_refs[doc_id].release()
+            self.document_refs[doc_id] = ref
+            self._documents_version += 1
+            if index_is_current:
+                new_chunks = [chunk for chunk in chunks if is_new(chunk)]
+                texts = [chunk.text for chunk in new_chunks]
+                with self.metrics.timed('indexing'):
+                    vectors = None
+                    if self.corpus_store is not None:
+                        vectors = self.corpus_store.embed_chunks(texts, self.embedder)
+                    # Chunks indexed before keep their ids; earlier pages arriving late only move their offsets
+                    self.retriever.set_document_spans(
+                        doc_id, [(chunk.start, chunk.end, chunk.page) for chunk in chunks if not is_new(chunk)]
+                    )
+                    self.retriever.add_document(doc_id, texts, vectors,
+                                                [(chunk.start, chunk.end, chunk.page) for chunk in new_chunks])
+                self._indexed_version = self._documents_version
+    
+    def split_text_into_chunks(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
+        """Split text into overlapping chunks of roughly chunk_size characters at sentence boundaries"""
+        chunks = chunking.chunk_text(
+            text,
+            max_tokens=max(chunk_size // chunking.CHARS_PER_TOKEN, 1),
+            overlap_tokens=overlap // chunking.CHARS_PER_TOKEN
+        )
+        return [chunk.text for chunk in chunks]
+    
+    def index_documents(self):
+        """Chunk the loaded documents and build the keyword and vector search indexes"""
+        with self._documents_lock:
+            version = self._documents_version
+            retriever = retrieval.Retriever(self.embedder, MIN_VECTOR_SIMILARITY)
+            for doc_id, ref in enumerate(self.document_refs):
+                self._index_document(retriever, doc_id, ref)
+            self.retriever = retriever
+            self._indexed_version = version
+    
+    def _shared_chunks(self, doc_id: int, ref: DocumentRef, name: Optional[str] = None) -> List[chunking.Chunk]:
+        """A document's chunks; the list is shared by every session holding the same document"""
+        # Partly extracted PDFs are not worth storing: they are replaced as more pages arrive
+        persist = ref.doc_hash not in self._pending_pdfs
+        with self.metrics.timed('chunking'):
+            chunks = self.corpus_memory.derived(
+                ref.doc_hash, CHUNKER_SIGNATURE, lambda: self._document_chunks(doc_id, ref.text, persist, name)
+            )
+        if chunks and chunks[0].doc_id != doc_id:
+            chunks = [chunk._replace(doc_id=doc_id) for chunk in chunks]
+        return chunks
+    
+    def _document_phrases(self, doc_id: int, ref: DocumentRef, name: Optional[str] = None) -> topic_map.DocumentPhrases:
+        def build():
+            with self.metrics.timed('topics'):
+                chunks = self._shared_chunks(doc_id, ref, name)
+                return topic_map.document_phrases([chunk.text for chunk in chunks])
+        return self.corpus_memory.derived(ref.doc_hash, TOPIC_SIGNATURE, build)
+    
+    def prepare_documents(self, names: List[str], texts: List[str], progress_callback=None) -> List[DocumentRef]:
+        """Chunk, keyphrase and embed documents ahead of add_documents, e.g. on a background job.
+
+        The work is shared through corpus memory and the corpus store, so
+        add_documents only has to attach it. Keep the returned references
+        until then. Loaded documents are left untouched, so this is safe to run
+        while the session keeps using them.
+        """
+        refs = []
+        for i, (name, text) in enumerate(zip(names, texts)):
+            ref = self.corpus_memory.acquire(text)
+            refs.append(ref)
+            chunks = self._shared_chunks(0, ref, name)
+            self._document_phrases(0, ref, name)
+            if self.corpus_store is not None:
+                with self.metrics.timed('indexing'):
+                    self.corpus_store.embed_chunks([chunk.text for chunk in chunks], self.embedder)
+            if progress_callback:
+                progress_callback(i + 1, len(texts))
+        return refs
+    
+    def _index_document(self, retriever: retrieval.Retriever, doc_id: int, ref: DocumentRef):
+        chunks = self._shared_chunks(doc_id, ref)
+        # The keyphrase table is built at ingestion so topic lookups never scan the corpus
+        self._document_phrases(doc_id, ref)
+        texts = [chunk.text for chunk in chunks]
+        with self.metrics.timed('indexing'):
+            vectors = None
+            if self.corpus_store is not None:
+                # Only chunks never seen before are embedded
+                vectors = self.corpus_store.embed_chunks(texts, self.embedder)
+            retriever.add_document(doc_id, texts, vectors,
+                                   [(chunk.start, chunk.end, chunk.page) for chunk in chunks])
+    
+    def add_documents(self, names: List[str], texts: List[str]) -> List[str]:
+        """Add documents to the loaded corpus, indexing only the new ones.
+
+        Documents whose text is already loaded are skipped; returns the names added.
+        """
+        with self._documents_lock:
+            if not self.document_refs:
+                # Nothing loaded: start from an empty index instead of a stale one
+                self.retriever = retrieval.Retriever(self.embedder, MIN_VECTOR_SIMILARITY)
+                self._indexed_version = self._documents_version
+            loaded = {ref.doc_hash for ref in self.document_refs}
+            index_is_current = self._indexed_version == self._documents_version
+            added = []
+            for name, text in zip(names, texts):
+                ref = self.corpus_memory.acquire(text)
+                if ref.doc_hash in loaded:
+                    ref.release()
+                    continue
+                loaded.add(ref.doc_hash)
+                self.documents.append(name)
+                self.document_refs.append(ref)
+                if index_is_current:
+                    self._index_document(self.retriever, len(self.document_refs) - 1, ref)
+                added.append(name)
+            if added:
+                self._documents_version += 1
+                if index_is_current:
+                    self._indexed_version = self._documents_version
+        return added
+    
+    def document_in_use(self, doc_id: int) -> bool:
+        """Whether background work (e.g. a question bank job) is still reading this document"""
+        with self._documents_lock:
+            return self._documents_in_use[self.document_refs[doc_id].doc_hash] > 0
+    
+    @contextmanager
+    def using_documents(self, doc_ids: Optional[List[int]] = None):
+        """Mark the documents (all by default) as read by background work until the block ends; yields their hashes"""
+        with self._documents_lock:
+            in_use = [
+                ref.doc_hash for doc_id, ref in enumerate(self.document_refs) if doc_ids is None or doc_id in doc_ids
+            ]
+            self._documents_in_use.update(in_use)
+        try:
+            yield in_use
+        finally:
+            with self._documents_lock:
+                self._documents_in_use.subtract(in_use)
+                self._documents_in_use += Counter()
+    
+    def remove_document(self, doc_id: int):
+        """Remove one loaded document; its chunks are dropped from the indexes without a rebuild.
+
+        Raises ValueError while background work is reading the document.
+        """
+        with self._documents_lock:
+            if self.document_in_use(doc_id):
+                raise ValueError(f"{self.documents[doc_id]} is in use by a running background job")
+            index_is_current = self._indexed_version == self._documents_version
+            del self.documents[doc_id]
+            self.document_refs.pop(doc_id).release()
+            self._documents_version += 1
+            if index_is_current:
+                self.retriever.remove_document(doc_id)
+                self._indexed_version = self._documents_version
+    
+    def _document_chunks(self, doc_id: int, doc_text: str, persist: bool = True, name: Optional[str] = None,
+                         chunks: Optional[List[chunking.Chunk]] = None) -> List[chunking.Chunk]:
+        """Chunk a document (unless its chunks are given), reusing the stored chunk list when it is unchanged"""
+        if self.corpus_store is None or not persist:
+            if chunks is not None:
+                return chunks
+            return chunking.chunk_text(doc_text, doc_id, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS)
+        if name is None:
+            name = self.documents[doc_id] if doc_id < len(self.documents) else f"Document {doc_id + 1}"
+        doc_hash = self.corpus_store.put_document(name, doc_text, owner=self.owner)
+        stored = self.corpus_store.get_chunks(doc_hash, CHUNKER_SIGNATURE, doc_id)
+        if stored is not None:
+            return stored
+        if chunks is None:
+            chunks = chunking.chunk_text(doc_text, doc_id, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS)
+        self.corpus_store.put_chunks(doc_hash, CHUNKER_SIGNATURE, chunks)
+        return chunks
+    
+    def load_saved_documents(self, doc_hashes: List[str]) -> List[str]:
+        """Add documents from the persistent store without extracting, chunking or embedding again"""
+        saved = {doc['doc_hash']: doc for doc in self.corpus_store.list_documents(self.owner)}
+        names, texts = [], []
+        for doc_hash in doc_hashes:
+            text = self.corpus_store.get_text(doc_hash, self.owner)
+            if text is not None:
+                names.append(saved[doc_hash]['name'] if doc_hash in saved else doc_hash[:12])
+                texts.append(text)
+        return self.add_documents(names, texts)
+    
+    def _ensure_index(self):
+        # document_texts is replaced wholesale when new documents are processed
+        with self._documents_lock:
+            if self._indexed_version != self._documents_version:
+                self.index_documents()
+    
+    def _candidates(self, scored_chunk_ids) -> List[context_packer.Candidate]:
+        return [
+            context_packer.Candidate(score, self.retriever.chunk_docs[chunk_id], *self.retriever.chunk_spans[chunk_id],
+                                     self.retriever.chunk_texts[chunk_id])
+            for score, chunk_id in scored_chunk_ids
+        ]
+    
+    def _fetch_referenced_pages(self, query: str):
+        """Extract and index the pages a query names ("page 212") in PDFs still being extracted"""
+        waiting = []
+        for _, pdf, chunked in list(self._pending_pdfs.values()):
+            pages = [page_number for page_number in pdf_pages.referenced_pages(query, pdf.page_count)
+                     if pdf.page_range(page_number)[0] not in chunked]
+            if pages:
+                pdf.prefetch(pages)
+                waiting.append((pdf, pages))
+        for pdf, pages in waiting:
+            pdf.wait_for_pages(pages, PROGRESSIVE_QUERY_WAIT_SECONDS)
+        if waiting:
+            self.refresh_pending_documents(min_new_pages=1)
+    
+    def _retrieve(self, query: str,
+                  min_relative_score: float = CONTEXT_MIN_RELATIVE_SCORE) -> List[context_packer.Candidate]:
+        """The best-matching chunks for query across all documents, best first"""
+        if self._pending_pdfs:
+            self._fetch_referenced_pages(query)
+        with self._documents_lock:
+            self._ensure_index()
+            with self.metrics.timed('retrieval'):
+                results = self.retriever.search(query, CONTEXT_CANDIDATES, min_relative_score)
+            return self._candidates(results)
+    
+    def _pack_context(self, candidates: List[context_packer.Candidate], budget_tokens: int) -> str:
+        """Best non-overlapping passages that fit budget_tokens, labelled with their source"""
+        with self._documents_lock:
+            passages = context_packer.pack_passages(
+                candidates, budget_tokens, lambda doc_id, start, end: self.document_refs[doc_id].slice(start, end)
+            )
+            return context_packer.format_passages(passages, self.documents)
+    
+    def _record_timing(self, mode: str, started: float, first_token_at: Optional[float], cached: bool):
+        finished = time.perf_counter()
+        self.generation_timings.append({
+            'mode': mode,
+            'cached': cached,
+            'ttft': (first_token_at or finished) - started,
+            'total': finished - started
+        })
+    
+    def _generate(self, prompt: str, regenerate: bool = False, generation_config: Optional[Dict] = None) -> str:
+        """Call the model, serving identical earlier or in-flight prompts from the response cache / single flight.
+
+        regenerate always makes a fresh call (and caches its reply).
+        """
+        started = time.perf_counter()
+        cache_key = self.response_cache.make_key(self.client.model_name, prompt, generation_config)
+        if not regenerate:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                self.metrics.increment('response_cache_hits')
+                self._record_timing('blocking', started, None, True)
+                return cached
+        self.metrics.increment('response_cache_misses')
+        
+        def call() -> str:
+            self.metrics.increment('prompt_tokens', llm_client.estimate_tokens(prompt))
+            with self.metrics.timed('generate'):
+                if self.micro_batcher is not None and self.micro_batcher.accepts(prompt, generation_config):
+                    text = self.micro_batcher.generate(prompt, self.client, self._on_client_event)
+                else:
+                    text = self.client.generate(prompt, generation_config, on_event=self._on_client_event)
+            self.metrics.increment('response_tokens', llm_client.estimate_tokens(text))
+            self.response_cache.put(cache_key, text)
+            return text
+        
+        if regenerate:
+            # Joining an identical in-flight call would return the reply this is meant to replace
+            text, shared = call(), False
+        else:
+            # Keyed by owner too, so a call is only ever made with the caller's own API key and quota
+            text, shared = self.single_flight.do(f"{self.owner}:{cache_key}", call)
+        if shared:
+            self.metrics.increment('coalesced_requests')
+        self._record_timing('blocking', started, None, False)
+        return text
+    
+    def _generate_stream(self, prompt: str, regenerate: bool = False) -> Iterator[str]:
+        """Stream the model's reply piece by piece; complete replies are cached, in-flight ones shared"""
+        started = time.perf_counter()
+        cache_key = self.response_cache.make_key(self.client.model_name, prompt)
+        if not regenerate:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                self.metrics.increment('response_cache_hits')
+                self._record_timing('stream', started, None, True)
+                yield cached
+                return
+        
+        self.metrics.increment('response_cache_misses')
+        
+        def produce() -> Iterator[str]:
+            self.metrics.increment('prompt_tokens', llm_client.estimate_tokens(prompt))
+            pieces = []
+            with self.metrics.timed('generate'):
+                for piece in self.client.stream(prompt, on_event=self._on_client_event):
+                    pieces.append(piece)
+                    yield piece
+            text = "".join(pieces)
+            self.metrics.increment('response_tokens', llm_client.estimate_tokens(text))
+            self.response_cache.put(cache_key, text)
+        
+        if regenerate:
+            pieces, shared = produce(), False
+        else:
+            pieces, shared = self.single_flight.stream(f"{self.owner}:{cache_key}", produce)
+        if shared:
+            self.metrics.increment('coalesced_requests')
+        first_token_at = None
+        for piece in pieces:
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            yield piece
+        self._record_timing('stream', started, first_token_at, False)
+    
+    def _on_client_event(self, name: str, amount: float):
+        # Retries and rate-limit waits reported by the model client
+        self.metrics.increment(f"generate_{name}", amount)
+    
+    def _summary_prompt(self, text: str) -> str:
+        return f"""You are an expert study assistant. Please provide a comprehensive yet concise summary of the following study material. 
+            Focus on key concepts, important formulas, definitions, and main topics. Structure the summary with clear headings.
+
+            Document content:
+            {text}
+
+            Provide a structured summary with these sections:
+            ## 📌 Main Topics Covered
+            ## 🎯 Key Concepts
+            ## 📐 Important Formulas/Theorems (if any)
+            ## 💡 Study Recommendations
+            ## 🚀 Quick Revision Points
+            """
+    
+    def _map_prompt(self, chunk: str) -> str:
+        return f"""You are an expert study assistant. Summarize this section of a longer study document.
+            Keep every key concept, definition, formula and theorem it contains; skip filler.
+            Use short bullet points.
+
+            Section content:
+            {chunk}
+            """
+    
+    def _reduce_prompt(self, section_summaries: str, final: bool) -> str:
+        if not final:
+            return f"""Merge these consecutive section summaries of a study document into one concise
+            bullet-point summary. Keep every key concept, definition and formula; remove repetition.
+
+            Section summaries:
+            {section_summaries}
+            """
+        return f"""You are an expert study assistant. Below are summaries of every section of a study document, in order.
+            Combine them into a comprehensive yet concise summary of the whole document.
+            Focus on key concepts, important formulas, definitions, and main topics. Structure the summary with clear headings.
+
+            Section summaries:
+            {section_summaries}
+
+            Provide a structured summary with these sections:
+            ## 📌 Main Topics Covered
+            ## 🎯 Key Concepts
+            ## 📐 Important Formulas/Theorems (if any)
+            ## 💡 Study Recommendations
+            ## 🚀 Quick Revision Points
+            """
+    
+    def _run_concurrently(self, prompts: List[str], regenerate: bool = False,
+                          on_done=None, generation_config: Optional[Dict] = None) -> List[str]:
+        """Generate responses for prompts concurrently through the rate-limited client, preserving order"""
+        return self.client.map(
+            lambda prompt: self._generate(prompt, regenerate, generation_config), prompts, on_done
+        )
+    
+    def _map_summaries(self, text: str, regenerate: bool = False, progress_callback=None) -> List[str]:
+        """Summarize every chunk of a document concurrently, reusing stored partial summaries"""
+        chunks = [chunk.text for chunk in chunking.chunk_text(text, max_tokens=SUMMARY_CHUNK_TOKENS, overlap_tokens=0)]
+        chunk_hashes = [corpus_store.content_hash(chunk) for chunk in chunks]
+        kind = f"summary-map:{self.client.model_name}:v{SUMMARY_MAP_VERSION}"
+        partials = {}
+        if self.corpus_store is not None and not regenerate:
+            partials = self.corpus_store.get_derived(chunk_hashes, kind)
+        
+        todo = [h for h in dict.fromkeys(chunk_hashes) if h not in partials]
+        texts = dict(zip(chunk_hashes, chunks))
+        done = len(set(chunk_hashes)) - len(todo)
+        if progress_callback:
+            progress_callback(done, len(set(chunk_hashes)))
+        
+        def on_done(i: int, partial: str):
+            nonlocal done
+            partials[todo[i]] = partial
+            if self.corpus_store is not None:
+                self.corpus_store.put_derived(kind, {todo[i]: partial})
+            done += 1
+            if progress_callback:
+                progress_callback(done, len(set(chunk_hashes)))
+        
+        self._run_concurrently([self._map_prompt(texts[h]) for h in todo], regenerate, on_done)
+        return [partials[h] for h in chunk_hashes]
+    
+    def _summary_prompt_for(self, text: str, regenerate: bool = False, progress_callback=None) -> str:
+        """Return the final summary prompt, map-reducing documents too long for one call"""
+        if len(text) <= SUMMARY_SINGLE_PASS_CHARS:
+            with self.metrics.timed('prompt_assembly'):
+                return self._summary_prompt(text)
+        
+        partials = self._map_summaries(text, regenerate, progress_callback)
+        # Reduce hierarchically until every partial summary fits in one prompt
+        while len(partials) > 1 and sum(len(p) for p in partials) > SUMMARY_REDUCE_CHARS:
+            groups, current, size = [], [], 0
+            for partial in partials:
+                if current and size + len(partial) > SUMMARY_REDUCE_CHARS:
+                    groups.append(current)
+                    current, size = [], 0
+                current.append(partial)
+                size += len(partial)
+            groups.append(current)
+            if len(groups) == len(partials):
+                # Each partial is already at the budget; merge pairs so the loop still makes progress
+                groups = [partials[i:i + 2] for i in range(0, len(partials), 2)]
+            partials = self._run_concurrently(
+                [self._reduce_prompt("\n\n".join(group), final=False) for group in groups], regenerate
+            )
+        with self.metrics.timed('prompt_assembly'):
+            return self._reduce_prompt("\n\n---\n\n".join(partials), final=True)
+    
+    def summarize_document(self, text: str, regenerate: bool = False, progress_callback=None) -> str:
+        """Summarize the document"""
+        if not text or len(text.strip()) < 50:
+            return "Document content is too short to summarize."
+            
+        try:
+            prompt = self._summary_prompt_for(text, regenerate, progress_callback)
+            return self._generate(prompt, regenerate)
+        except Exception as e:
+            return f"Error generating summary: {str(e)}"
+    
+    def summarize_document_stream(self, text: str, regenerate: bool = False,
+                                  progress_callback=None) -> Iterator[str]:
+        """Summarize the document, yielding the summary as it is generated"""
+        if not text or len(text.strip()) < 50:
+            yield "Document content is too short to summarize."
+            return
+            
+        try:
+            prompt = self._summary_prompt_for(text, regenerate, progress_callback)
+            yield from self._generate_stream(prompt, regenerate)
+        except Exception as e:
+            yield f"Error generating summary: {str(e)}"
+    
+    def topic_index(self) -> topic_map.TopicMap:
+        """Topics covered by the loaded documents, merged from the per-document keyphrase tables"""
+        if self._topic_map_version != self._documents_version:
+            version = self._documents_version
+            documents = [
+                (ref.doc_hash, len(self._shared_chunks(doc_id, ref)), self._document_phrases(doc_id, ref))
+                for doc_id, ref in enumerate(self.document_refs)
+            ]
+            self._topic_map = topic_map.TopicMap(documents)
+            self._topic_map_version = version
+        return self._topic_map
+    
+    def suggest_topics(self, prefix: str = "", limit: int = 10) -> List[str]:
+        """Autocomplete topic names from the loaded documents"""
+        return self.topic_index().autocomplete(prefix, limit)
+    
+    def _topic_candidates(self, topics: List[topic_map.Topic], per_topic: int) -> List[context_packer.Candidate]:
+        """The chunks where each topic occurs most, as packing candidates (topics interleaved)"""
+        doc_ids = {ref.doc_hash: doc_id for doc_id, ref in enumerate(self.document_refs)}
+        per_topic_candidates = []
+        for topic in topics:
+            candidates = []
+            for doc_hash, chunk_index, count in topic.locations[:per_topic]:
+                doc_id = doc_ids.get(doc_hash)
+                if doc_id is None:
+                    continue
+                chunk = self._shared_chunks(doc_id, self.document_refs[doc_id])[chunk_index]
+                candidates.append(context_packer.Candidate(1.0, doc_id, chunk.start, chunk.end, chunk.page, chunk.text))
+            per_topic_candidates.append(candidates)
+        interleaved = []
+        for round_index in range(max((len(c) for c in per_topic_candidates), default=0)):
+            interleaved.extend(c[round_index] for c in per_topic_candidates if round_index < len(c))
+        return interleaved
+    
+    def _chunk_hashes(self, doc_id: int, ref: DocumentRef) -> List[str]:
+        """Content hashes of a document's chunks, the keys of its banked questions"""
+        return self.corpus_memory.derived(
+            ref.doc_hash, CHUNK_HASH_SIGNATURE,
+            lambda: [corpus_store.content_hash(chunk.text) for chunk in self._shared_chunks(doc_id, ref)]
+        )
+    
+    def _question_scope(self, doc_ids: Optional[List[int]] = None) -> Dict[str, str]:
+        """Chunk hash -> document hash for the loaded documents (or only doc_ids)"""
+        scope = {}
+        for doc_id, ref in enumerate(self.document_refs):
+            if doc_ids is None or doc_id in doc_ids:
+                scope.update((chunk_hash, ref.doc_hash) for chunk_hash in self._chunk_hashes(doc_id, ref))
+        return scope
+    
+    def question_bank_size(self, doc_ids: Optional[List[int]] = None) -> int:
+        """Banked questions drawn from the loaded documents (or only doc_ids); 0 without a corpus store"""
+        if self.corpus_store is None or not self.document_refs:
+            return 0
+        return self.corpus_store.count_questions(list(self._question_scope(doc_ids)))
+    
+    def _banked_questions(self, question_type: Optional[str], difficulty: Optional[str],
+                          topics: Optional[List[str]], doc_ids: Optional[List[int]]) -> List[Dict]:
+        """Bank entries matching the request, least served first"""
+        if self.corpus_store is None:
+            return []
+        with self.metrics.timed('question_bank'):
+            entries = self.corpus_store.find_questions(list(self._question_scope(doc_ids)), question_type, difficulty)
+            if topics:
+                # Questions drawn from a topic's chunks, or tagged with the topic by the model
+                matched = [match for name in topics for match in self.topic_index().lookup(name, limit=1)]
+                topic_chunks = {
+                    corpus_store.content_hash(candidate.text)
+                    for candidate in self._topic_candidates(matched, topic_map.LOCATIONS_PER_PHRASE)
+                }
+                names = [name.lower() for name in topics]
+                entries = [
+                    entry for entry in entries
+                    if entry['chunk_hash'] in topic_chunks or any(name in entry['topic'].lower() for name in names)
+                ]
+        return entries
+    
+    def _sample_question_groups(self, batch_count: int, topics: Optional[List[str]] = None,
+                                doc_ids: Optional[List[int]] = None,
+                                covered: Optional[Set[str]] = None) -> List[List[context_packer.Candidate]]:
+        """Pick the chunks for each question batch, spread evenly over every loaded document (or doc_ids).
+
+        With topics, batches draw on the chunks where those topics occur
+        instead. Chunks whose hash is in covered (they already have banked
+        questions) are only used once no other chunk is left.
+        """
+        covered = covered or set()
+        if topics:
+            matched = [match for name in topics for match in self.topic_index().lookup(name, limit=1)]
+            candidates = [
+                candidate for candidate in self._topic_candidates(matched, topic_map.LOCATIONS_PER_PHRASE)
+                if doc_ids is None or candidate.doc_id in doc_ids
+            ]
+            fresh = [c for c in candidates if corpus_store.content_hash(c.text) not in covered]
+            candidates = fresh or candidates
+            if candidates:
+                groups = [
+                    candidates[start:start + CHUNKS_PER_QUESTION_BATCH]
+                    for start in range(0, len(candidates), CHUNKS_PER_QUESTION_BATCH)
+                ]
+                return [groups[i % len(groups)] for i in range(batch_count)]
+        self._ensure_index()
+        chunks_by_doc = {}
+        for chunk_id, doc_id in enumerate(self.retriever.chunk_docs):
+            if doc_id >= 0 and (doc_ids is None or doc_id in doc_ids):
+                chunks_by_doc.setdefault(doc_id, []).append(chunk_id)
+        if covered:
+            for doc_id, chunk_ids in chunks_by_doc.items():
+                fresh = [
+                    chunk_id for chunk_id in chunk_ids
+                    if corpus_store.content_hash(self.retriever.chunk_texts[chunk_id]) not in covered
+                ]
+                chunks_by_doc[doc_id] = fresh or chunk_ids
+        if not chunks_by_doc:
+            return []
+        
+        # Each document gets a share proportional to its length, but at least one batch
+        wanted = batch_count * CHUNKS_PER_QUESTION_BATCH
+        total_chunks = sum(len(chunk_ids) for chunk_ids in chunks_by_doc.values())
+        picks = []
+        for doc_id, chunk_ids in chunks_by_doc.items():
+            share = max(1, round(wanted * len(chunk_ids) / total_chunks))
+            share = min(share, len(chunk_ids))
+            step = len(chunk_ids) / share
+            picks.append([chunk_ids[int(i * step)] for i in range(share)])
+        
+        # Interleave documents so every batch mixes material from across the corpus
+        ordered = []
+        for round_index in range(max(len(p) for p in picks)):
+            ordered.extend(p[round_index] for p in picks if round_index < len(p))
+        groups = [
+            self._candidates((1.0, chunk_id) for chunk_id in ordered[start:start + CHUNKS_PER_QUESTION_BATCH])
+            for start in range(0, len(ordered), CHUNKS_PER_QUESTION_BATCH)
+        ]
+        # Small corpora have fewer distinct groups than batches; reuse them
+        return [groups[i % len(groups)] for i in range(batch_count)]
+    
+    def _question_batch_prompt(self, context: str, count: int, question_type: str, batch_index: int,
+                               topics: Optional[List[str]] = None, difficulty: Optional[str] = None) -> str:
+        focus = f"Focus on these topics: {', '.join(topics)}." if topics else ""
+        if difficulty:
+            focus = f"{focus} Every question must be of {difficulty} difficulty.".strip()
+        return f"""Generate {count} {question_type.lower()} exam-style questions based on the following study material.
+            {QUESTION_TYPE_INSTRUCTIONS.get(question_type, "")}
+            {focus}
+            Each question must test a different fact or concept. Multiple choice questions need exactly
+            4 options written as "A. ...", "B. ...", "C. ...", "D. ..."; other questions have no options.
+            Put the correct answer with a short explanation in "answer".
+            (Batch {batch_index + 1})
+            
+            Study material:
+            {context}
+            """
+    
+    @staticmethod
+    def _question_kind(question: Dict) -> str:
+        """Canonical question type (a QUESTION_TYPE_INSTRUCTIONS key) for the model's free-form one"""
+        kind = question['type'].lower()
+        if len(question['options']) >= 2 or 'choice' in kind or 'mcq' in kind:
+            return "Multiple Choice"
+        if 'problem' in kind or 'numerical' in kind:
+            return "Problem Solving"
+        return "Short Answer"
+    
+    @staticmethod
+    def _question_source(question: Dict, group: List[context_packer.Candidate]) -> context_packer.Candidate:
+        """The chunk of a batch's context that a question draws on most"""
+        words = set(retrieval.tokenize(f"{question['question']} {question['answer']}"))
+        return max(group, key=lambda candidate: len(words.intersection(retrieval.tokenize(candidate.text))))
+    
+    def _generate_question_batches(self, batch_count: int, question_type: str, regenerate: bool,
+                                   progress_callback, topics: Optional[List[str]], difficulty: Optional[str],
+                                   scope: Optional[List[str]], covered: Set[str],
+                                   batch_offset: int) -> List[Dict]:
+        """Generate batch_count batches of deduplicated questions from the documents in scope (by hash, None for all)
+        and bank them by their source chunk.
+
+        Chunks in covered are avoided where possible; the chunks used are added to it.
+        """
+        # Everything read from the loaded documents is taken at once, so the model calls
+        # below can run while the session keeps changing its documents
+        with self._documents_lock:
+            groups = self._sample_question_groups(batch_count, topics, self._doc_ids_of(scope), covered)
+            doc_hashes = [ref.doc_hash for ref in self.document_refs]
+            with self.metrics.timed('prompt_assembly'):
+                prompts = [
+                    self._question_batch_prompt(
+                        self._pack_context(group, QUESTION_CONTEXT_TOKENS), QUESTIONS_PER_BATCH, question_type,
+                        batch_offset + i, topics, difficulty
+                    )
+                    for i, group in enumerate(groups)
+                ]
+        covered.update(corpus_store.content_hash(candidate.text) for group in groups for candidate in group)
+        generation_config = {"response_mime_type": "application/json", "response_schema": QUESTION_SCHEMA}
+        
+        done = 0
+        
+        def on_done(i: int, response_text: str):
+            nonlocal done
+            done += 1
+            if progress_callback:
+                progress_callback(done, len(prompts))
+        
+        responses = self._run_concurrently(prompts, regenerate, on_done, generation_config)
+        
+        questions = []
+        sources = []
+        for group, response_text in zip(groups, responses):
+            try:
+                items = json.loads(response_text)
+            except ValueError:
+                continue
+            for item in items if isinstance(items, list) else []:
+                if not isinstance(item, dict) or not str(item.get('question', '')).strip():
+                    continue
+                question = {
+                    'question': str(item.get('question', '')).strip(),
+                    'type': str(item.get('type', '')),
+                    'difficulty': str(item.get('difficulty', '')).strip().title(),
+                    'topic': str(item.get('topic', '')),
+                    'options': [str(option) for option in item.get('options') or []],
+                    'answer': str(item.get('answer', ''))
+                }
+                question['type'] = self._question_kind(question)
+                questions.append(question)
+                sources.append(self._question_source(question, group))
+        
+        keep = retrieval.distinct_mask([q['question'] for q in questions], QUESTION_DUPLICATE_SIMILARITY)
+        kept = [(q, source) for q, source, k in zip(questions, sources, keep) if k]
+        if self.corpus_store is not None and kept:
+            with self.metrics.timed('question_bank'):
+                self.corpus_store.put_questions([
+                    (corpus_store.content_hash(source.text), doc_hashes[source.doc_id], q)
+                    for q, source in kept
+                ])
+        return [q for q, _ in kept]
+    
+    def generate_questions_from_corpus(self, num_questions: int = 50, question_type: str = "Mixed",
+                                       regenerate: bool = False, progress_callback=None,
+                                       topics: Optional[List[str]] = None, difficulty: Optional[str] = None,
+                                       doc_ids: Optional[List[int]] = None) -> List[Dict]:
+        """A deduplicated question set for all documents (or doc_ids / topics), served from the question bank first.
+
+        Only the shortfall is generated, from chunks sampled across the
+        documents that have no banked questions yet; every generated question
+        is banked. regenerate skips the bank (and the response cache).
+        """
+        # The documents in scope cannot be removed until the questions are done (see remove_document)
+        with self.using_documents(doc_ids) as in_use:
+            if not in_use:
+                return [{"error": "No documents uploaded yet."}]
+            # Positions shift when other documents are removed meanwhile, so the scope is kept by hash
+            return self._questions_from_bank_and_model(
+                num_questions, question_type, regenerate, progress_callback, topics, difficulty,
+                None if doc_ids is None else in_use
+            )
+    
+    def _doc_ids_of(self, scope: Optional[List[str]]) -> Optional[List[int]]:
+        """Current positions of the loaded documents with these hashes (None stays None: all documents)"""
+        if scope is None:
+            return None
+        return [doc_id for doc_id, ref in enumerate(self.document_refs) if ref.doc_hash in scope]
+    
+    def _questions_from_bank_and_model(self, num_questions: int, question_type: str, regenerate: bool,
+                                       progress_callback, topics: Optional[List[str]], difficulty: Optional[str],
+                                       scope: Optional[List[str]]) -> List[Dict]:
+        try:
+            type_filter = question_type if question_type in QUESTION_TYPE_INSTRUCTIONS else None
+            with self._documents_lock:
+                banked = [] if regenerate else self._banked_questions(type_filter, difficulty, topics,
+                                                                      self._doc_ids_of(scope))
+            served = banked[:num_questions]
+            questions = [entry['question'] for entry in served]
+            self.metrics.increment('questions_from_bank', len(served))
+            
+            covered = {entry['chunk_hash'] for entry in banked}
+            # Prompts differ from earlier requests' even when chunks have to be reused
+            batch_offset = len(banked) // QUESTIONS_PER_BATCH
+            for _ in range(QUESTION_FILL_ROUNDS):
+                shortfall = num_questions - len(questions)
+                if shortfall <= 0:
+                    break
+                batch_count = max(1, -(-int(shortfall * QUESTION_OVERGENERATION) // QUESTIONS_PER_BATCH))
+                generated = self._generate_question_batches(
+                    batch_count, question_type, regenerate, progress_callback, topics, difficulty, scope,
+                    covered, batch_offset
+                )
+                batch_offset += batch_count
+                if not generated:
+                    break
+                # Off-filter questions stay banked for other requests but do not fill this one
+                generated = [
+                    q for q in generated
+                    if (not type_filter or q['type'] == type_filter) and (not difficulty or q['difficulty'] == difficulty)
+                ]
+                keep = retrieval.distinct_mask([q['question'] for q in questions + generated],
+                                               QUESTION_DUPLICATE_SIMILARITY)[len(questions):]
+                generated = [q for q, kept in zip(generated, keep) if kept][:shortfall]
+                self.metrics.increment('questions_generated', len(generated))
+                questions += generated
+            
+            # Repeat requests rotate through the bank, starting with the questions seen least
+            if self.corpus_store is not None and questions:
+                self.corpus_store.mark_questions_served([corpus_store.question_hash(q) for q in questions])
+            if not questions:
+                return [{"error": "The model did not return any usable questions."}]
+            return questions
+        except Exception as e:
+            return [{"error": f"Error generating questions: {str(e)}"}]
+    
+    def _explain_prompt(self, topic: str) -> str:
+        # Search in uploaded documents first
+        matches = self.topic_index().lookup(topic) if self.document_refs else []
+        candidates = []
+        if self.document_refs:
+            # Known topic: where it occurs most goes first, then every search result
+            candidates = self._retrieve(topic, 0.0 if matches else CONTEXT_MIN_RELATIVE_SCORE)
+        if matches:
+            candidates = self._topic_candidates(matches, TOPIC_CONTEXT_CHUNKS) + candidates
+        
+        with self.metrics.timed('prompt_assembly'):
+            context = self._pack_context(candidates, CONTEXT_BUDGET_TOKENS)
+            return self._explain_prompt_text(topic, context)
+    
+    def _explain_prompt_text(self, topic: str, context: str) -> str:
+        return f"""Explain the following topic in simple, easy-to-understand language as if teaching a beginner.
+            Use analogies, real-world examples, and simple diagrams in text form where helpful.
+            Break down complex concepts into step-by-step explanations.
+            
+            Topic to explain: {topic}
+            
+            Context from study materials (if available):
+            {context}
+            
+            Structure your explanation as:
+            ## 📖 What is {topic}? (Simple Definition)
+            ## 🔍 Key Points Explained Simply
+            ## 🌟 Real-world Example/Analogy
+            ## ⚠️ Common Misconceptions to Avoid
+            ## 💎 Quick Summary (3-5 bullet points)
+            """
+    
+    def explain_topic(self, topic: str, regenerate: bool = False) -> str:
+        """Explain a topic in simple language"""
+        if not topic.strip():
+            return "Please enter a topic to explain."
+            
+        try:
+            return self._generate(self._explain_prompt(topic), regenerate)
+        except Exception as e:
+            return f"Error explaining topic: {str(e)}"
+    
+    def explain_topic_stream(self, topic: str, regenerate: bool = False) -> Iterator[str]:
+        """Explain a topic in simple language, yielding the explanation as it is generated"""
+        if not topic.strip():
+            yield "Please enter a topic to explain."
+            return
+            
+        try:
+            yield from self._generate_stream(self._explain_prompt(topic), regenerate)
+        except Exception as e:
+            yield f"Error explaining topic: {str(e)}"
+    
+    def _summarize_conversation(self, previous_summary: str, older_turns: str) -> str:
+        """Fold older chat turns into the rolling conversation summary (runs in the background)"""
+        return self._generate(f"""Update the running summary of a student's conversation with a study assistant.
+            Keep the topics asked about, the key facts given in answers and any open follow-ups.
+            Write at most {chat_memory.SUMMARY_MAX_TOKENS * 3 // 4} words of plain prose.
+            
+            Current summary:
+            {previous_summary or "(none yet)"}
+            
+            Turns to add:
+            {older_turns}
+            """)
+    
+    def _search_prompt(self, query: str, history: str = "") -> Optional[str]:
+        """Build the chat prompt, or return None when no document passage matches"""
+        # Follow-ups ("what about its units?") retrieve better together with the previous question
+        retrieval_query = query
+        if self.chat_memory.turns:
+            retrieval_query = f"{self.chat_memory.turns[-1][0]} {query}"
+        candidates = self._retrieve(retrieval_query)
+        if not candidates:
+            return None
+        
+        with self.metrics.timed('prompt_assembly'):
+            # Best-ranked passages first
+            combined_context = self._pack_context(candidates, CONTEXT_BUDGET_TOKENS)
+            return self._search_prompt_text(query, combined_context, history)
+    
+    def _search_prompt_text(self, query: str, combined_context: str, history: str = "") -> str:
+        conversation = ""
+        if history:
+            conversation = f"""
+            Conversation so far (use it to understand follow-up questions):
+            {history}
+            """
+        return f"""Based on the following context from study materials, answer the question.
+            If the context doesn't contain enough information, say so clearly.
+            Cite the sources you use as they are labelled, e.g. [notes.pdf, p. 213].
+            {conversation}
+            Question: {query}
+            
+            Context from study materials:
+            {combined_context}
+            
+            Provide a helpful and accurate answer:
+            """
+    
+    def search_in_documents(self, query: str, regenerate: bool = False) -> str:
+        """Search for relevant information in uploaded documents"""
+        if not self.document_refs:
+            return "No documents uploaded yet."
+            
+        try:
+            prompt = self._search_prompt(query, self.chat_memory.render())
+            if prompt is None:
+                return "No relevant information found in documents."
+            answer = self._generate(prompt, regenerate)
+            self.chat_memory.add_turn(query, answer)
+            return answer
+        except Exception as e:
+            return f"Error searching documents: {str(e)}"
+    
+    def search_in_documents_stream(self, query: str, regenerate: bool = False) -> Iterator[str]:
+        """Answer a question from the documents, yielding the answer as it is generated"""
+        if not self.document_refs:
+            yield "No documents uploaded yet."
+            return
+            
+        try:
+            prompt = self._search_prompt(query, self.chat_memory.render())
+            if prompt is None:
+                yield "No relevant information found in documents."
+                return
+            pieces = []
+            for piece in self._generate_stream(prompt, regenerate):
+                pieces.append(piece)
+                yield piece
+            self.chat_memory.add_turn(query, "".join(pieces))
+        except Exception as e:
+            yield f"Error searching documents: {str(e)}"
@@ -0,0 +1,120 @@
+"""Deterministic synthetic study documents (TXT/MD, DOCX, PDF) for benchmarks and load tests"""
+import io
+import random
+from typing import List
+import docx
+
+# Roughly one printed page of notes
+WORDS_PER_PAGE = 450
+LINE_CHARS = 90
+TOPICS = [
+    "thermodynamics", "entropy", "heat transfer", "fluid mechanics", "linear algebra",
+    "eigenvalues", "probability", "graph theory", "operating systems", "virtual memory",
+    "compiler design", "context free grammars", "computer networks", "routing protocols",
+    "database normalization", "transaction isolation", "digital logic", "signal processing",
+    "control systems", "machine learning"
+]
+FILLER = (
+    "the of system value method result process equation model energy state function "
+    "input output rate time data example condition theorem proof property analysis "
+    "design constraint boundary variable parameter algorithm structure sequence limit"
+).split()
+
+
+def make_pages(page_count: int, seed: int = 0) -> List[str]:
+    """Generate page_count pages of topical prose with headings, sentences and paragraphs"""
+    rng = random.Random(seed)
+    pages = []
+    for page_number in range(page_count):
+        topic = TOPICS[(page_number + seed) % len(TOPICS)]
+        paragraphs = [f"{topic.title()} (part {page_number + 1})"]
+        words = 0
+        while words < WORDS_PER_PAGE:
+            sentences = []
+            for _ in range(rng.randint(3, 6)):
+                length = rng.randint(8, 24)
+                body = [rng.choice(FILLER) for _ in range(length)]
+                body.insert(rng.randrange(length), topic)
+                sentences.append(" ".join(body).capitalize() + ".")
+                words += length + 1
+            paragraphs.append(" ".join(sentences))
+        pages.append("\n\n".join(paragraphs))
+    return pages
+
+
+def make_txt(pages: List[str]) -> bytes:
+    """Plain UTF-8 text with pages separated by blank lines"""
+    return "\n\n".join(pages).encode('utf-8')
+
+
+def make_docx(pages: List[str]) -> bytes:
+    """A DOCX with one paragraph per source paragraph and a page break between pages"""
+    document = docx.Document()
+    for page_number, page in enumerate(pages):
+        if page_number:
+            document.add_page_break()
+        for paragraph in page.split("\n\n"):
+            document.add_paragraph(paragraph)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def _wrap(text: str, width: int = LINE_CHARS) -> List[str]:
+    lines = []
+    for paragraph in text.split("\n\n"):
+        line = ""
+        for word in paragraph.split():
+            if line and len(line) + 1 + len(word) > width:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}" if line else word
+        lines.append(line)
+        lines.append("")
+    return lines
+
+
+def _pdf_escape(line: str) -> str:
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(pages: List[str]) -> bytes:
+    """A minimal, valid PDF with one Helvetica text page per input page (no extra dependencies)"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{4 + 2 * i} 0 R" for i in range(len(pages)))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>".encode())
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for i, page in enumerate(pages):
+        text_ops = "".join(f"({_pdf_escape(line)}) '\n" for line in _wrap(page))
+        stream = f"BT /F1 8 Tf 40 800 Td 10 TL\n{text_ops}ET".encode('latin-1', 'replace')
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>".encode()
+        )
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n".encode() + body + b"\nendobj\n")
+    xref_offset = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+def make_document(file_extension: str, page_count: int, seed: int = 0) -> bytes:
+    """Build a synthetic document of the given type ('pdf', 'docx', 'txt' or 'md')"""
+    pages = make_pages(page_count, seed)
+    if file_extension == 'pdf':
+        return make_pdf(pages)
+    if file_extension == 'docx':
+        return make_docx(pages)
+    if file_extension in ['txt', 'md']:
+        return make_txt(pages)
+    raise ValueError(f"Unsupported file type: {file_extension}")
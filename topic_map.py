@@ -0,0 +1,168 @@
+"""Ingestion-time keyphrase and topic map: which topics a corpus covers and where.
+
+Each document's chunks are reduced once (vectorized with NumPy) to their
+candidate n-gram phrases and the chunks they occur in. The corpus map merges
+those per-document tables and scores phrases by TF-IDF across all chunks, so
+adding or removing a document never re-reads the other documents.
+"""
+import difflib
+import math
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+import numpy as np
+from retrieval import STOPWORDS, TOKEN_PATTERN
+
+MAX_PHRASE_WORDS = 3
+# Candidate phrases kept per document, and topics kept for the whole corpus
+PHRASES_PER_DOCUMENT = 400
+MAX_TOPICS = 300
+# A phrase must occur at least this often in a document to be a candidate there
+MIN_PHRASE_COUNT = 2
+# Chunk locations remembered per phrase and document
+LOCATIONS_PER_PHRASE = 12
+# Multi-word phrases are more specific than single words
+NGRAM_BOOST = 0.6
+FUZZY_CUTOFF = 0.75
+
+# phrase -> (chunks it occurs in, total occurrences, [(chunk index, occurrences)] best chunks first)
+DocumentPhrases = Dict[str, Tuple[int, int, List[Tuple[int, int]]]]
+
+
+class Topic(NamedTuple):
+    phrase: str
+    score: float
+    # (doc_hash, chunk index within that document, occurrences), best first
+    locations: List[Tuple[str, int, int]]
+
+
+def iter_phrases(text: str):
+    """Lowercase 1..MAX_PHRASE_WORDS-word phrases that neither cross nor contain stopwords or bare numbers"""
+    run: List[str] = []
+    for token in TOKEN_PATTERN.findall(text.lower()) + [""]:
+        if token and token not in STOPWORDS and not token.isdigit() and len(token) > 1:
+            run.append(token)
+            for n in range(1, min(MAX_PHRASE_WORDS, len(run)) + 1):
+                yield " ".join(run[-n:])
+        else:
+            run = []
+
+
+def document_phrases(chunk_texts: Sequence[str], max_phrases: int = PHRASES_PER_DOCUMENT) -> DocumentPhrases:
+    """The document's most distinctive candidate phrases with the chunks they occur in"""
+    vocabulary: Dict[str, int] = {}
+    chunk_ids: List[int] = []
+    phrase_ids: List[int] = []
+    for chunk_index, text in enumerate(chunk_texts):
+        for phrase in iter_phrases(text):
+            phrase_ids.append(vocabulary.setdefault(phrase, len(vocabulary)))
+            chunk_ids.append(chunk_index)
+    if not phrase_ids:
+        return {}
+
+    # One (chunk, phrase) cell per pair, with its occurrence count
+    size = len(vocabulary)
+    cells, counts = np.unique(np.asarray(chunk_ids, dtype=np.int64) * size + np.asarray(phrase_ids, dtype=np.int64),
+                              return_counts=True)
+    cell_chunks, cell_phrases = cells // size, cells % size
+    document_frequency = np.bincount(cell_phrases, minlength=size)
+    totals = np.bincount(cell_phrases, weights=counts, minlength=size)
+    phrases = np.array(list(vocabulary), dtype=object)
+    words = np.fromiter((phrase.count(" ") + 1 for phrase in phrases), dtype=np.float64, count=size)
+    # No smoothing floor: words in nearly every chunk are background, not topics
+    idf = np.log((len(chunk_texts) + 1) / (document_frequency + 0.5))
+    scores = totals * idf * (1 + NGRAM_BOOST * (words - 1))
+    scores[totals < MIN_PHRASE_COUNT] = 0
+    keep = np.flatnonzero(scores > 0)
+    if len(keep) > max_phrases:
+        keep = keep[np.argpartition(-scores[keep], max_phrases)[:max_phrases]]
+    kept = np.zeros(size, dtype=bool)
+    kept[keep] = True
+
+    selected = kept[cell_phrases]
+    locations: Dict[str, List[Tuple[int, int]]] = {}
+    # Group the kept cells by phrase, most occurrences first
+    order = np.lexsort((-counts[selected], cell_phrases[selected]))
+    for phrase_id, chunk_index, count in zip(cell_phrases[selected][order], cell_chunks[selected][order],
+                                             counts[selected][order]):
+        phrase_locations = locations.setdefault(phrases[phrase_id], [])
+        if len(phrase_locations) < LOCATIONS_PER_PHRASE:
+            phrase_locations.append((int(chunk_index), int(count)))
+    return {
+        phrases[phrase_id]: (int(document_frequency[phrase_id]), int(totals[phrase_id]),
+                             locations[phrases[phrase_id]])
+        for phrase_id in keep
+    }
+
+
+class TopicMap:
+    """Corpus-wide topics ranked by TF-IDF, with fuzzy lookup and autocomplete"""
+    def __init__(self, documents: Sequence[Tuple[str, int, DocumentPhrases]], max_topics: int = MAX_TOPICS):
+        """documents holds (doc_hash, chunk count, document_phrases(...)) for every loaded document"""
+        total_chunks = sum(chunk_count for _, chunk_count, _ in documents) or 1
+        # phrase -> [chunk frequency, occurrences, locations]
+        merged: Dict[str, list] = {}
+        for doc_hash, _, phrases in documents:
+            for phrase, (frequency, occurrences, locations) in phrases.items():
+                entry = merged.setdefault(phrase, [0, 0, []])
+                entry[0] += frequency
+                entry[1] += occurrences
+                entry[2].extend((doc_hash, chunk, count) for chunk, count in locations)
+
+        scored = []
+        for phrase, (frequency, occurrences, locations) in merged.items():
+            idf = math.log((total_chunks + 1) / (frequency + 0.5))
+            words = phrase.count(" ") + 1
+            score = occurrences * idf * (1 + NGRAM_BOOST * (words - 1))
+            scored.append((score, phrase, occurrences, locations))
+        scored.sort(key=lambda item: -item[0])
+
+        # A phrase is not a separate topic when a chosen longer phrase covers most of its uses
+        self.topics: List[Topic] = []
+        covered: Dict[str, int] = {}
+        for score, phrase, occurrences, locations in scored:
+            if len(self.topics) >= max_topics:
+                break
+            if covered.get(phrase, 0) >= 0.8 * occurrences:
+                continue
+            self.topics.append(Topic(phrase, score, sorted(locations, key=lambda location: -location[2])))
+            words = phrase.split()
+            for n in range(1, len(words)):
+                for start in range(len(words) - n + 1):
+                    part = " ".join(words[start:start + n])
+                    covered[part] = max(covered.get(part, 0), occurrences)
+        self._by_phrase = {topic.phrase: topic for topic in self.topics}
+
+    def __len__(self) -> int:
+        return len(self.topics)
+
+    def phrases(self, limit: Optional[int] = None) -> List[str]:
+        """Topic phrases, most prominent first"""
+        return [topic.phrase for topic in self.topics[:limit]]
+
+    def lookup(self, query: str, limit: int = 3) -> List[Topic]:
+        """Topics matching query exactly, by containment, or fuzzily (typos, word order)"""
+        key = " ".join(TOKEN_PATTERN.findall(query.lower()))
+        if not key:
+            return []
+        if key in self._by_phrase:
+            return [self._by_phrase[key]]
+        query_words = set(key.split()) - STOPWORDS
+        matches = [
+            topic for topic in self.topics
+            if key in topic.phrase or (query_words and query_words <= set(topic.phrase.split()))
+        ]
+        if not matches:
+            close = difflib.get_close_matches(key, list(self._by_phrase), n=limit, cutoff=FUZZY_CUTOFF)
+            matches = [self._by_phrase[phrase] for phrase in close]
+        return matches[:limit]
+
+    def autocomplete(self, prefix: str, limit: int = 10) -> List[str]:
+        """Topic phrases starting with prefix, or with a word starting with it"""
+        prefix = prefix.lower().strip()
+        if not prefix:
+            return self.phrases(limit)
+        starts = [topic.phrase for topic in self.topics if topic.phrase.startswith(prefix)]
+        inner = [
+            topic.phrase for topic in self.topics
+            if not topic.phrase.startswith(prefix) and any(word.startswith(prefix) for word in topic.phrase.split())
+        ]
+        return (starts + inner)[:limit]